@@ -0,0 +1,410 @@
+"""
+Asyncio API for fb_core.
+
+AsyncFBRTDBMgr and AsyncFirebaseAdmin expose awaitable versions of the
+FBRTDBMgr and FirebaseAdmin operations. The admin SDK is blocking, so calls
+run on a dedicated bounded thread pool and a semaphore (one per event loop,
+so a manager can serve several asyncio.run() calls) caps the number of
+in-flight operations; independent writes can be awaited together with
+asyncio.gather.
+"""
+
+import asyncio
+import functools
+import itertools
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fb_core.db_admin import (
+    FirebaseAdmin,
+    get_admin_registry,
+    get_firebase_admin,
+    resolve_billing_user_id,
+)
+from fb_core.real_time_database import FBRTDBMgr, WriteBatch
+from fb_core.run_progress import RunProgress
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncFBRTDBMgr:
+    """Awaitable wrapper around FBRTDBMgr with bounded concurrency."""
+
+    def __init__(
+        self,
+        manager: Optional[FBRTDBMgr] = None,
+        max_concurrency: int = 32,
+    ):
+        """Initialize the async database manager.
+
+        Args:
+            manager: Blocking manager to delegate to; a default FBRTDBMgr if omitted
+            max_concurrency: Maximum number of operations in flight at once
+        """
+        self.manager = manager if manager is not None else FBRTDBMgr()
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="fb_core-async",
+        )
+        # asyncio primitives belong to one loop; the pool bounds work across loops
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._semaphores_lock = threading.Lock()
+
+    def _semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[loop] = semaphore
+            return semaphore
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking callable on the manager's thread pool.
+
+        Args:
+            fn: Callable to run
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            The callable's return value
+        """
+        loop = asyncio.get_running_loop()
+        async with self._semaphore(loop):
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def get_data(
+        self,
+        path: str,
+        shallow: bool = False,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Optional[Any]:
+        """Async version of FBRTDBMgr.get_data."""
+        return await self.run(self.manager.get_data, path, shallow=shallow, fields=fields)
+
+    async def exists(self, path: str) -> bool:
+        """Async version of FBRTDBMgr.exists."""
+        return await self.run(self.manager.exists, path)
+
+    async def list_keys(self, path: str, strict: bool = False) -> List[str]:
+        """Async version of FBRTDBMgr.list_keys."""
+        return await self.run(self.manager.list_keys, path, strict=strict)
+
+    async def update_data(self, path: str, data: Dict[str, Any]) -> bool:
+        """Async version of FBRTDBMgr.update_data."""
+        return await self.run(self.manager.update_data, path, data)
+
+    async def set_data(self, path: str, data: Any) -> bool:
+        """Async version of FBRTDBMgr.set_data."""
+        return await self.run(self.manager.set_data, path, data)
+
+    async def read_snapshot(self, path: str) -> Optional[Tuple[str, Any]]:
+        """Async version of FBRTDBMgr.read_snapshot."""
+        return await self.run(self.manager.read_snapshot, path)
+
+    async def transact(
+        self,
+        path: str,
+        update_fn: Callable[[Any], Any],
+        snapshot: Optional[Tuple[str, Any]] = None,
+    ) -> bool:
+        """Async version of FBRTDBMgr.transact."""
+        return await self.run(self.manager.transact, path, update_fn, snapshot=snapshot)
+
+    async def remove_data(self, path: str) -> bool:
+        """Async version of FBRTDBMgr.remove_data."""
+        return await self.run(self.manager.remove_data, path)
+
+    async def health_check(self) -> bool:
+        """Async version of FBRTDBMgr.health_check."""
+        return await self.run(self.manager.health_check)
+
+    def batch(self) -> WriteBatch:
+        """Start a write batch; flush it with commit()."""
+        return self.manager.batch()
+
+    async def commit(self, batch: WriteBatch) -> bool:
+        """Flush a write batch as one multi-path update."""
+        return await self.run(batch.commit)
+
+    def close(self) -> None:
+        """Shut down the thread pool, waiting for in-flight operations."""
+        self._executor.shutdown(wait=True)
+
+
+class AsyncFirebaseAdmin:
+    """Awaitable counterpart of FirebaseAdmin.
+
+    Business logic is shared with FirebaseAdmin; every blocking operation runs
+    through the AsyncFBRTDBMgr thread pool.
+    """
+
+    def __init__(
+        self,
+        user_id: str,
+        env_id: str = "default",
+        db_manager: Optional[AsyncFBRTDBMgr] = None,
+    ):
+        """Initialize AsyncFirebaseAdmin for a specific user.
+
+        Args:
+            user_id: The user identifier (UID or email)
+            env_id: Environment identifier (default, staging, etc.)
+            db_manager: Async database manager; the module default if omitted
+        """
+        if db_manager is None:
+            # share the registry handle (and its per-user state) with sync callers
+            db_manager = get_default_async_manager()
+            self.admin = get_firebase_admin(user_id, env_id=env_id)
+        else:
+            self.admin = FirebaseAdmin(user_id, env_id=env_id, db_manager=db_manager.manager)
+        self.db_manager = db_manager if self.admin.db_manager is not None else None
+        self.user_id = user_id
+        self.env_id = env_id
+        self.database = self.admin.database
+
+    async def _run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if self.db_manager is None:
+            # nothing to offload, FirebaseAdmin handles the missing manager itself
+            return fn(*args, **kwargs)
+        return await self.db_manager.run(fn, *args, **kwargs)
+
+    async def create_user_from_google_claims(self, claims: Dict[str, Any]) -> Dict[str, Any]:
+        """Async version of FirebaseAdmin.create_user_from_google_claims."""
+        return await self._run(self.admin.create_user_from_google_claims, claims)
+
+    async def ensure_user_spaces(self, batch: Optional[WriteBatch] = None) -> bool:
+        """Async version of FirebaseAdmin.ensure_user_spaces."""
+        return await self._run(self.admin.ensure_user_spaces, batch=batch)
+
+    async def get_credits(self, use_cache: bool = True, strict: bool = False) -> int:
+        """Async version of FirebaseAdmin.get_credits."""
+        return await self._run(self.admin.get_credits, use_cache=use_cache, strict=strict)
+
+    async def add_credits_atomic(
+        self,
+        credits: int,
+        operation_id: str,
+        batch: Optional[WriteBatch] = None,
+        check_ledger: bool = False,
+    ) -> Dict[str, Any]:
+        """Async version of FirebaseAdmin.add_credits_atomic."""
+        return await self._run(
+            self.admin.add_credits_atomic, credits, operation_id, batch=batch, check_ledger=check_ledger
+        )
+
+    async def deduct_credits_atomic(
+        self,
+        credits: int,
+        operation_id: str,
+        require_full_amount: bool = True,
+        batch: Optional[WriteBatch] = None,
+        check_ledger: bool = False,
+    ) -> Dict[str, Any]:
+        """Async version of FirebaseAdmin.deduct_credits_atomic."""
+        return await self._run(
+            self.admin.deduct_credits_atomic,
+            credits,
+            operation_id,
+            require_full_amount=require_full_amount,
+            batch=batch,
+            check_ledger=check_ledger,
+        )
+
+    async def record_history_event(
+        self,
+        action: str,
+        status: str = "ok",
+        details: Optional[Dict[str, Any]] = None,
+        request_id: Optional[str] = None,
+        batch: Optional[WriteBatch] = None,
+    ) -> bool:
+        """Async version of FirebaseAdmin.record_history_event."""
+        if batch is not None:
+            # staging into a batch does no I/O
+            return self.admin.record_history_event(action, status, details, request_id, batch=batch)
+        return await self._run(self.admin.record_history_event, action, status, details, request_id)
+
+    async def _iter_pages(self, iterator: Iterator[Dict[str, Any]], page_size: int) -> AsyncIterator[Dict[str, Any]]:
+        # pull a page per executor call instead of one call per item
+        while True:
+            page = await self._run(lambda: list(itertools.islice(iterator, page_size)))
+            for item in page:
+                yield item
+            if len(page) < page_size:
+                return
+
+    async def iter_history(
+        self,
+        since: Optional[datetime] = None,
+        action: Optional[str] = None,
+        page_size: int = 500,
+        until: Optional[datetime] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of FirebaseAdmin.iter_history."""
+        iterator = self.admin.iter_history(since=since, action=action, page_size=page_size, until=until)
+        async for event in self._iter_pages(iterator, page_size):
+            yield event
+
+    async def iter_ledger(
+        self,
+        since: Optional[datetime] = None,
+        txn_type: Optional[str] = None,
+        page_size: int = 500,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Async version of FirebaseAdmin.iter_ledger."""
+        iterator = self.admin.iter_ledger(since=since, txn_type=txn_type, page_size=page_size)
+        async for entry in self._iter_pages(iterator, page_size):
+            yield entry
+
+    async def ensure_output_space(
+        self,
+        run_id: str,
+        meta: Optional[Dict[str, Any]] = None,
+        status: str = "pending",
+    ) -> str:
+        """Async version of FirebaseAdmin.ensure_output_space."""
+        return await self._run(self.admin.ensure_output_space, run_id, meta, status)
+
+    async def open_run(self, run_id: str, **options: Any) -> RunProgress:
+        """Async version of FirebaseAdmin.open_run.
+
+        The handle is the blocking RunProgress: update() only writes on
+        terminal statuses or once the interval has passed, otherwise a timer
+        thread does.
+        """
+        return await self._run(self.admin.open_run, run_id, **options)
+
+    async def record_output_files(self, run_id: str, files: Iterable[Dict[str, Any]]) -> bool:
+        """Async version of FirebaseAdmin.record_output_files."""
+        return await self._run(self.admin.record_output_files, run_id, files)
+
+    async def stream_output_files(
+        self,
+        run_id: str,
+        files: Iterable[Dict[str, Any]],
+        status: Optional[str] = None,
+        **options: Any,
+    ) -> Dict[str, Any]:
+        """Async version of FirebaseAdmin.stream_output_files (files are consumed on the pool)."""
+        return await self._run(self.admin.stream_output_files, run_id, files, status, **options)
+
+
+_default_async_manager: Optional[AsyncFBRTDBMgr] = None
+
+
+def get_default_async_manager() -> Optional[AsyncFBRTDBMgr]:
+    """Return the process-wide AsyncFBRTDBMgr, creating it on first use.
+
+    Wraps the FBRTDBMgr shared through the AdminRegistry.
+
+    Returns:
+        The shared async manager, or None if Firebase is not initialized
+    """
+    global _default_async_manager
+    manager = get_admin_registry().db_manager
+    if manager is None:
+        return None
+    if _default_async_manager is None or _default_async_manager.manager is not manager:
+        _default_async_manager = AsyncFBRTDBMgr(manager)
+    return _default_async_manager
+
+
+async def async_resolve_billing_user_id(
+    uid: Optional[str] = None,
+    email: Optional[str] = None,
+    env_id: str = "default",
+) -> Optional[str]:
+    """Async version of resolve_billing_user_id."""
+    if uid and str(uid).strip():
+        return str(uid).strip()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(resolve_billing_user_id, uid, email, env_id))
+
+
+async def async_sync_user_session(
+    billing_key: str,
+    *,
+    email: Optional[str] = None,
+    display_name: Optional[str] = None,
+    source: str = "django",
+    action: str = "auth.session",
+    env_id: str = "default",
+    db_manager: Optional[AsyncFBRTDBMgr] = None,
+) -> bool:
+    """Async version of sync_user_session: one read pass, one multi-path write."""
+    admin = AsyncFirebaseAdmin(billing_key, env_id=env_id, db_manager=db_manager)
+    if admin.db_manager is None:
+        return True
+    batch = admin.db_manager.batch()
+    await admin.ensure_user_spaces(batch=batch)
+    profile_payload = {
+        "email": email,
+        "display_name": display_name,
+        "source": source,
+        "last_action": action,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    batch.update(
+        f"{admin.database}/profile",
+        {key: value for key, value in profile_payload.items() if value is not None},
+    )
+    await admin.record_history_event(
+        action=action,
+        status="ok",
+        details={"source": source, "email": email},
+        batch=batch,
+    )
+    if not await admin.db_manager.commit(batch):
+        logger.warning("Session sync failed user_id=%s action=%s", admin.user_id, action)
+        return False
+    return True
+
+
+async def async_record_purchase_event(
+    billing_key: str,
+    *,
+    credits: int,
+    operation_id: str,
+    source: str = "stripe",
+    details: Optional[Dict[str, Any]] = None,
+    env_id: str = "default",
+    db_manager: Optional[AsyncFBRTDBMgr] = None,
+) -> Dict[str, Any]:
+    """Async version of record_purchase_event.
+
+    The ledger entry and the audit event are independent writes; both are
+    staged behind the credit transaction and flushed as one multi-path update,
+    and skipped entirely when the operation was already applied.
+    """
+    admin = AsyncFirebaseAdmin(billing_key, env_id=env_id, db_manager=db_manager)
+    batch = admin.db_manager.batch() if admin.db_manager is not None else None
+    result = await admin.add_credits_atomic(credits, operation_id, batch=batch, check_ledger=True)
+    if result.get("duplicate"):
+        return result
+    event_details = {"source": source, "credits": credits}
+    if details and isinstance(details, dict):
+        event_details.update(details)
+    await admin.record_history_event(
+        action="billing.purchase",
+        status="ok",
+        details=event_details,
+        request_id=operation_id,
+        batch=batch,
+    )
+    if not await admin.db_manager.commit(batch):
+        logger.error(
+            "Purchase credited but not recorded user_id=%s credits=%s op_id=%s",
+            admin.user_id,
+            credits,
+            operation_id,
+        )
+        result["recorded"] = False
+    return result
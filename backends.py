@@ -0,0 +1,557 @@
+"""
+Storage backends for FBRTDBMgr.
+
+A backend performs the raw reads and writes behind FBRTDBMgr. The default
+FirebaseBackend talks to Firebase Realtime Database through the admin SDK;
+InMemoryBackend keeps an in-process tree with the same path semantics and is
+used for local load testing and as the reference implementation.
+"""
+
+import copy
+import functools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import firebase_admin
+from firebase_admin import db
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionAbortedError(Exception):
+    """Raised when a transaction could not be committed within its retry budget."""
+
+
+class AbortTransaction(Exception):
+    """Raise from a transaction update function to abort it without writing."""
+
+
+# order_by value of query() that orders children by their key
+KEY = "$key"
+
+
+# app name -> result of the last availability probe, shared by all backends
+_availability: Dict[str, bool] = {}
+_availability_lock = threading.Lock()
+
+
+def invalidate_availability(app_name: Optional[str] = None) -> None:
+    """Forget cached availability probes.
+
+    Call after re-initializing a Firebase app so the next operation probes again.
+
+    Args:
+        app_name: App to invalidate; all apps when omitted
+    """
+    with _availability_lock:
+        if app_name is None:
+            _availability.clear()
+        else:
+            _availability.pop(app_name, None)
+
+
+def split_path(path: str) -> List[str]:
+    """Split a database path into its non-empty segments.
+
+    Args:
+        path: The database path (e.g., 'users/uid123/credits' or '/')
+
+    Returns:
+        List of path segments; empty for the root.
+    """
+    return [segment for segment in str(path or "").split("/") if segment]
+
+
+def join_path(*parts: str) -> str:
+    """Join path fragments into a normalized database path."""
+    segments: List[str] = []
+    for part in parts:
+        segments.extend(split_path(part))
+    return "/".join(segments)
+
+
+class RTDBBackend:
+    """Interface implemented by every FBRTDBMgr storage backend.
+
+    Paths are slash separated and relative to the database root. Semantics
+    follow Realtime Database: writing None deletes a node, empty objects are
+    not stored, update() merges the given children (keys may be nested paths).
+    """
+
+    def is_available(self) -> bool:
+        """Return True if the backend can serve requests."""
+        raise NotImplementedError
+
+    def health_check(self) -> bool:
+        """Probe the backend, bypassing any cached availability state."""
+        return self.is_available()
+
+    def invalidate(self) -> None:
+        """Drop cached connection state (availability, references)."""
+
+    def get(self, path: str, shallow: bool = False) -> Any:
+        """Return the value at path, or None if nothing is stored there.
+
+        With shallow=True, child objects are truncated to True, so only the
+        keys (and primitive children) of the node are transferred.
+        """
+        raise NotImplementedError
+
+    def set(self, path: str, value: Any) -> None:
+        """Replace the value at path."""
+        raise NotImplementedError
+
+    def update(self, path: str, value: Dict[str, Any]) -> None:
+        """Merge the given children into the node at path."""
+        raise NotImplementedError
+
+    def delete(self, path: str) -> None:
+        """Remove the node at path."""
+        raise NotImplementedError
+
+    def transaction(self, path: str, update_fn: Callable[[Any], Any]) -> Any:
+        """Atomically replace the value at path with update_fn(current).
+
+        Returns:
+            The committed value.
+
+        Raises:
+            TransactionAbortedError: If the transaction kept conflicting.
+        """
+        raise NotImplementedError
+
+    def query(
+        self,
+        path: str,
+        order_by: str = KEY,
+        start_at: Any = None,
+        end_at: Any = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[str, Any]]:
+        """Return the children of path ordered by key or by a child value.
+
+        Args:
+            path: Parent node
+            order_by: KEY to order by child key, otherwise a child path
+            start_at: Inclusive lower bound of the ordered value
+            end_at: Inclusive upper bound of the ordered value
+            limit: Maximum number of children (from the start)
+
+        Returns:
+            List of (key, value) pairs in query order.
+        """
+        raise NotImplementedError
+
+    def listen(self, path: str, callback: Callable[[Any], None]) -> Any:
+        """Stream changes of the node at path to callback.
+
+        callback receives events with event_type ('put' or 'patch'), path
+        (relative to the listened node) and data; the first event is a 'put'
+        of the whole node.
+
+        Returns:
+            A registration whose close() stops the stream.
+        """
+        raise NotImplementedError
+
+
+class FirebaseBackend(RTDBBackend):
+    """Backend that talks to Firebase Realtime Database via the admin SDK.
+
+    Availability is probed once per app and cached until invalidated, and
+    db.Reference objects are cached per path.
+    """
+
+    def __init__(self, app: Optional[Any] = None, ref_cache_size: int = 4096):
+        """Initialize the backend.
+
+        Args:
+            app: Firebase app to use; defaults to the default app.
+            ref_cache_size: Maximum number of cached db.Reference objects
+        """
+        self._explicit_app = app is not None
+        self.app = app if app is not None else self._resolve_app()
+        self._ref = functools.lru_cache(maxsize=ref_cache_size)(self._build_ref)
+
+    @staticmethod
+    def _resolve_app() -> Optional[Any]:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            logger.warning("Firebase app not initialized. Some operations will fail.")
+            return None
+
+    def _build_ref(self, path: str):
+        return db.reference(path or "/", app=self.app)
+
+    def _probe(self) -> bool:
+        if not self.app:
+            return False
+        try:
+            # db.reference() will raise ValueError if no databaseURL is set
+            self._build_ref("/")
+            return True
+        except Exception:
+            return False
+
+    def is_available(self) -> bool:
+        if not self.app:
+            return False
+        available = _availability.get(self.app.name)
+        if available is None:
+            available = self._probe()
+            with _availability_lock:
+                _availability[self.app.name] = available
+        return available
+
+    def health_check(self) -> bool:
+        if self.app is not None:
+            invalidate_availability(self.app.name)
+        return self.is_available()
+
+    def invalidate(self) -> None:
+        if self.app is not None:
+            invalidate_availability(self.app.name)
+        if not self._explicit_app:
+            self.app = self._resolve_app()
+        self._ref.cache_clear()
+
+    def get(self, path: str, shallow: bool = False) -> Any:
+        if shallow:
+            return self._ref(path).get(shallow=True)
+        return self._ref(path).get()
+
+    def set(self, path: str, value: Any) -> None:
+        self._ref(path).set(value)
+
+    def update(self, path: str, value: Dict[str, Any]) -> None:
+        self._ref(path).update(value)
+
+    def delete(self, path: str) -> None:
+        self._ref(path).delete()
+
+    def transaction(self, path: str, update_fn: Callable[[Any], Any]) -> Any:
+        try:
+            return self._ref(path).transaction(update_fn)
+        except db.TransactionAbortedError as error:
+            raise TransactionAbortedError(str(error)) from error
+
+    def query(
+        self,
+        path: str,
+        order_by: str = KEY,
+        start_at: Any = None,
+        end_at: Any = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[str, Any]]:
+        ref = self._ref(path)
+        query = ref.order_by_key() if order_by == KEY else ref.order_by_child(order_by)
+        if start_at is not None:
+            query = query.start_at(start_at)
+        if end_at is not None:
+            query = query.end_at(end_at)
+        if limit is not None:
+            query = query.limit_to_first(limit)
+        result = query.get()
+        if isinstance(result, list):
+            return [(str(index), value) for index, value in enumerate(result) if value is not None]
+        return list(result.items()) if result else []
+
+    def listen(self, path: str, callback: Callable[[Any], None]) -> Any:
+        return self._ref(path).listen(callback)
+
+
+def _clone(value: Any) -> Any:
+    """Copy a JSON-like value; primitives are returned as is."""
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+def _normalize(value: Any) -> Any:
+    """Return value as RTDB would store it: no None children, no empty objects."""
+    if isinstance(value, dict):
+        cleaned = {}
+        for key, child in value.items():
+            child = _normalize(child)
+            if child is not None:
+                cleaned[str(key)] = child
+        return cleaned or None
+    if isinstance(value, list):
+        cleaned_list = [_normalize(child) for child in value]
+        return cleaned_list if any(child is not None for child in cleaned_list) else None
+    return value
+
+
+def _resolve_server_values(value: Any, current: Any) -> Any:
+    """Replace {".sv": ...} placeholders with their values, as RTDB does on write.
+
+    Supports {"increment": n} (added to the numeric value stored there, 0 if
+    none) and "timestamp" (milliseconds since the epoch).
+    """
+    if not isinstance(value, dict):
+        return value
+    if ".sv" in value and len(value) == 1:
+        server_value = value[".sv"]
+        if isinstance(server_value, dict) and "increment" in server_value:
+            numeric = isinstance(current, (int, float)) and not isinstance(current, bool)
+            return (current if numeric else 0) + server_value["increment"]
+        if server_value == "timestamp":
+            return int(time.time() * 1000)
+        raise ValueError(f"Unsupported server value {server_value!r}")
+    return {
+        key: _resolve_server_values(child, current.get(key) if isinstance(current, dict) else None)
+        for key, child in value.items()
+    }
+
+
+def _has_increment(value: Any) -> bool:
+    """True if value contains a {".sv": {"increment": n}} placeholder.
+
+    Such a write is not idempotent: applying it twice adds n twice.
+    """
+    if not isinstance(value, dict):
+        return False
+    server_value = value.get(".sv")
+    if isinstance(server_value, dict) and "increment" in server_value:
+        return True
+    return any(_has_increment(child) for child in value.values())
+
+
+def _key_order(key: str) -> Tuple[int, Any]:
+    """Sort key of a child key: integer keys first (numerically), then strings."""
+    if key.lstrip("-").isdigit() and len(key) < 11:
+        return (0, int(key))
+    return (1, key)
+
+
+def _value_order(value: Any) -> Tuple[int, Any]:
+    """Sort key of a child value: null, false, true, numbers, strings, objects."""
+    if value is None:
+        return (0, 0)
+    if value is False:
+        return (1, 0)
+    if value is True:
+        return (2, 0)
+    if isinstance(value, (int, float)):
+        return (3, value)
+    if isinstance(value, str):
+        return (4, value)
+    return (5, 0)
+
+
+class ListenerEvent:
+    """Change event delivered to InMemoryBackend listeners (mirrors db.Event)."""
+
+    __slots__ = ("event_type", "path", "data")
+
+    def __init__(self, event_type: str, path: str, data: Any):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class ListenerRegistration:
+    """Handle returned by InMemoryBackend.listen()."""
+
+    def __init__(self, backend: "InMemoryBackend", segments: List[str], callback: Callable[[Any], None]):
+        self._backend = backend
+        self.segments = segments
+        self.callback = callback
+
+    def close(self) -> None:
+        """Stop delivering events to the callback."""
+        with self._backend._lock:
+            if self in self._backend._listeners:
+                self._backend._listeners.remove(self)
+
+
+class InMemoryBackend(RTDBBackend):
+    """Thread-safe in-process RTDB tree.
+
+    Reads and writes are served from a nested dict guarded by a lock.
+    Transactions are optimistic: update_fn runs outside the lock against a
+    snapshot and the result is committed only if the node did not change in
+    the meantime, otherwise update_fn is retried, as RTDB does.
+
+    Listeners are called synchronously after each write that touches their
+    node, with a 'put' of the node's current value. Server values
+    ({".sv": {"increment": n}} and {".sv": "timestamp"}) are resolved on write.
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None, max_retries: int = 25):
+        """Initialize the backend.
+
+        Args:
+            data: Optional initial tree
+            max_retries: Transaction attempts before giving up
+        """
+        self._lock = threading.RLock()
+        self._root: Dict[str, Any] = _normalize(_clone(data)) or {}
+        self._version = 0
+        self.max_retries = max_retries
+        self._listeners: List[ListenerRegistration] = []
+        # serializes deliveries so listeners never see an older value last
+        self._dispatch_lock = threading.RLock()
+
+    def is_available(self) -> bool:
+        return True
+
+    def _lookup(self, segments: List[str]) -> Any:
+        node: Any = self._root
+        for segment in segments:
+            if isinstance(node, dict):
+                node = node.get(segment)
+            elif isinstance(node, list) and segment.isdigit() and int(segment) < len(node):
+                node = node[int(segment)]
+            else:
+                return None
+            if node is None:
+                return None
+        return node
+
+    def _write(self, segments: List[str], value: Any) -> None:
+        """Write a normalized value at segments; caller must hold the lock."""
+        self._version += 1
+        if not segments:
+            self._root = value if isinstance(value, dict) else {}
+            return
+        parents = [self._root]
+        node = self._root
+        for segment in segments[:-1]:
+            child = node.get(segment)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = {}
+                node[segment] = child
+            node = child
+            parents.append(node)
+        if value is None:
+            node.pop(segments[-1], None)
+            # prune parents that became empty, RTDB does not keep empty objects
+            for depth in range(len(segments) - 1, 0, -1):
+                if parents[depth]:
+                    break
+                parents[depth - 1].pop(segments[depth - 1], None)
+        else:
+            node[segments[-1]] = value
+
+    def _notify(self, written: List[List[str]]) -> None:
+        """Deliver the current value to listeners whose node overlaps a written path."""
+        if not self._listeners:
+            return
+        with self._dispatch_lock:
+            with self._lock:
+                deliveries = []
+                for registration in self._listeners:
+                    watched = registration.segments
+                    for segments in written:
+                        common = min(len(watched), len(segments))
+                        if watched[:common] == segments[:common]:
+                            deliveries.append((registration, _clone(self._lookup(watched))))
+                            break
+            for registration, data in deliveries:
+                try:
+                    registration.callback(ListenerEvent("put", "/", data))
+                except Exception as error:
+                    logger.warning(f"Listener on /{'/'.join(registration.segments)} failed: {error}")
+
+    def listen(self, path: str, callback: Callable[[Any], None]) -> ListenerRegistration:
+        registration = ListenerRegistration(self, split_path(path), callback)
+        with self._dispatch_lock:
+            with self._lock:
+                self._listeners.append(registration)
+                data = _clone(self._lookup(registration.segments))
+            callback(ListenerEvent("put", "/", data))
+        return registration
+
+    def get(self, path: str, shallow: bool = False) -> Any:
+        with self._lock:
+            node = self._lookup(split_path(path))
+            if shallow and isinstance(node, dict):
+                return {
+                    key: True if isinstance(child, (dict, list)) else child
+                    for key, child in node.items()
+                }
+            return _clone(node)
+
+    def query(
+        self,
+        path: str,
+        order_by: str = KEY,
+        start_at: Any = None,
+        end_at: Any = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[str, Any]]:
+        base = split_path(path)
+        child_path = split_path(order_by)
+        with self._lock:
+            node = self._lookup(base)
+            if isinstance(node, list):
+                node = {str(index): child for index, child in enumerate(node) if child is not None}
+            if not isinstance(node, dict):
+                return []
+
+            def order(key: str) -> Tuple[Any, ...]:
+                if order_by == KEY:
+                    return _key_order(key)
+                # ties between equal child values are ordered by key
+                return _value_order(self._lookup(base + [key] + child_path)), _key_order(key)
+
+            def bound(value: Any) -> Tuple[Any, ...]:
+                return _key_order(str(value)) if order_by == KEY else (_value_order(value),)
+
+            keys = sorted(node, key=order)
+            if start_at is not None:
+                keys = [key for key in keys if order(key) >= bound(start_at)]
+            if end_at is not None:
+                upper = bound(end_at)
+                keys = [key for key in keys if order(key)[:len(upper)] <= upper]
+            if limit is not None:
+                keys = keys[:limit]
+            return [(key, _clone(node[key])) for key in keys]
+
+    def set(self, path: str, value: Any) -> None:
+        value = _normalize(_clone(value))
+        segments = split_path(path)
+        with self._lock:
+            self._write(segments, _resolve_server_values(value, self._lookup(segments)))
+        self._notify([segments])
+
+    def update(self, path: str, value: Dict[str, Any]) -> None:
+        if not isinstance(value, dict) or not value:
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        base = split_path(path)
+        writes = [(base + split_path(key), _normalize(_clone(child))) for key, child in value.items()]
+        targets = sorted(tuple(segments) for segments, _ in writes)
+        for prev, nxt in zip(targets, targets[1:]):
+            if nxt[:len(prev)] == prev:
+                raise ValueError(f"Path {'/'.join(prev)} is an ancestor of {'/'.join(nxt)}")
+        with self._lock:
+            for segments, child in writes:
+                self._write(segments, _resolve_server_values(child, self._lookup(segments)))
+        self._notify([segments for segments, _ in writes])
+
+    def delete(self, path: str) -> None:
+        segments = split_path(path)
+        with self._lock:
+            self._write(segments, None)
+        self._notify([segments])
+
+    def transaction(self, path: str, update_fn: Callable[[Any], Any]) -> Any:
+        segments = split_path(path)
+        for _ in range(self.max_retries):
+            with self._lock:
+                version = self._version
+                snapshot = _clone(self._lookup(segments))
+            new_value = _normalize(update_fn(_clone(snapshot)))
+            with self._lock:
+                if version != self._version and self._lookup(segments) != snapshot:
+                    continue
+                self._write(segments, _clone(new_value))
+            self._notify([segments])
+            return new_value
+        raise TransactionAbortedError(f"Transaction at {path} aborted after {self.max_retries} attempts")
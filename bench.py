@@ -0,0 +1,715 @@
+"""
+Benchmarks and load replay for the credit and session flows.
+
+Flows run against a local stand-in for RTDB (LatencyBackend, an
+InMemoryBackend that sleeps per round trip and between the read and write
+half of a transaction, so concurrent writers really conflict) and for
+Firebase Auth (FakeAuth, patched over firebase_admin.auth). Per flow the
+report gives ops/sec, p50/p99 latency, backend round trips and transaction
+attempts per operation. replay_trace() re-runs a recorded JSON lines
+operation log at N times its original speed.
+
+Run from the command line:
+
+    python -m fb_core.bench --operations 2000 --concurrency 16 --latency-ms 5
+    python -m fb_core.bench --replay ops.jsonl --speed 10
+    python -m fb_core.bench --transport rest
+
+With --transport rest, FBRTDBMgr uses a RestBackend that talks HTTP to a
+RestStandInServer, exercising the REST transport end to end.
+"""
+
+import argparse
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import json
+import logging
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+from firebase_admin import auth as fb_auth
+
+from fb_core import db_admin
+from fb_core.backends import InMemoryBackend
+from fb_core.real_time_database import FBRTDBMgr
+from fb_core.rest_backend import RestBackend
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_MEMORY = "memory"
+TRANSPORT_REST = "rest"
+
+# [round trips, transaction attempts] of the replayed operation running in this
+# context; counted on the client side, so concurrent operations stay apart
+_op_tally: "contextvars.ContextVar[Optional[List[int]]]" = contextvars.ContextVar("fb_core_bench_tally", default=None)
+
+
+def _tally(index: int) -> None:
+    tally = _op_tally.get()
+    if tally is not None:
+        tally[index] += 1
+
+
+class LatencyBackend(InMemoryBackend):
+    """InMemoryBackend that simulates network latency and counts round trips."""
+
+    def __init__(self, latency_ms: float = 5.0, jitter_ms: float = 1.0, data: Optional[Dict[str, Any]] = None):
+        """Initialize the backend.
+
+        Args:
+            latency_ms: Mean delay per round trip
+            jitter_ms: Uniform jitter added to or removed from each delay
+            data: Optional initial tree
+        """
+        super().__init__(data)
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.round_trips = 0
+        self.transaction_attempts = 0
+        self._counter_lock = threading.Lock()
+
+    def _round_trip(self) -> None:
+        with self._counter_lock:
+            self.round_trips += 1
+        _tally(0)
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def get(self, path: str, shallow: bool = False) -> Any:
+        self._round_trip()
+        return super().get(path, shallow=shallow)
+
+    def query(self, path: str, *args: Any, **kwargs: Any) -> Any:
+        self._round_trip()
+        return super().query(path, *args, **kwargs)
+
+    def set(self, path: str, value: Any) -> None:
+        self._round_trip()
+        super().set(path, value)
+
+    def update(self, path: str, value: Dict[str, Any]) -> None:
+        self._round_trip()
+        super().update(path, value)
+
+    def delete(self, path: str) -> None:
+        self._round_trip()
+        super().delete(path)
+
+    def transaction(self, path: str, update_fn: Callable[[Any], Any]) -> Any:
+        def _remote(current: Any) -> Any:
+            # the read arrived; the conditional write is another round trip
+            with self._counter_lock:
+                self.transaction_attempts += 1
+            _tally(1)
+            result = update_fn(current)
+            self._round_trip()
+            return result
+
+        self._round_trip()
+        return super().transaction(path, _remote)
+
+
+class _UserRecord:
+    def __init__(self, uid: str, email: Optional[str], display_name: Optional[str] = None):
+        self.uid = uid
+        self.email = email
+        self.display_name = display_name
+        self.photo_url = None
+        self.disabled = False
+
+
+class _GetUsersResult:
+    def __init__(self, users: List[_UserRecord]):
+        self.users = users
+
+
+class _ImportError:
+    def __init__(self, index: int, reason: str):
+        self.index = index
+        self.reason = reason
+
+
+class _ImportResult:
+    def __init__(self, errors: List[_ImportError]):
+        self.errors = errors
+        self.failure_count = len(errors)
+        self.success_count = 0
+
+
+class FakeAuth:
+    """In-memory stand-in for the firebase_admin.auth user functions used by fb_core."""
+
+    def __init__(self, latency_ms: float = 20.0):
+        """Initialize the fake.
+
+        Args:
+            latency_ms: Delay per Auth API call
+        """
+        self.latency = latency_ms / 1000.0
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._by_email: Dict[str, _UserRecord] = {}
+        self._by_uid: Dict[str, _UserRecord] = {}
+
+    def _call(self) -> None:
+        with self._lock:
+            self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _add(self, uid: str, email: Optional[str], display_name: Optional[str] = None) -> _UserRecord:
+        user = _UserRecord(uid, email, display_name)
+        self._by_uid[uid] = user
+        if email:
+            self._by_email[email] = user
+        return user
+
+    def get_user(self, uid: str, app: Any = None) -> _UserRecord:
+        self._call()
+        if uid not in self._by_uid:
+            raise fb_auth.UserNotFoundError(f"No user record found for uid {uid}")
+        return self._by_uid[uid]
+
+    def get_user_by_email(self, email: str, app: Any = None) -> _UserRecord:
+        self._call()
+        if email not in self._by_email:
+            raise fb_auth.UserNotFoundError(f"No user record found for email {email}")
+        return self._by_email[email]
+
+    def create_user(self, **kwargs: Any) -> _UserRecord:
+        self._call()
+        email = kwargs.get("email")
+        with self._lock:
+            if email and email in self._by_email:
+                raise fb_auth.EmailAlreadyExistsError(f"{email} already exists", None, None)
+            return self._add(kwargs.get("uid") or uuid.uuid4().hex[:28], email, kwargs.get("display_name"))
+
+    def get_users(self, identifiers: Sequence[Any], app: Any = None) -> _GetUsersResult:
+        self._call()
+        emails = [getattr(identifier, "email", None) for identifier in identifiers]
+        return _GetUsersResult([self._by_email[email] for email in emails if email in self._by_email])
+
+    def import_users(self, users: Sequence[Any], hash_alg: Any = None, app: Any = None) -> _ImportResult:
+        self._call()
+        errors = []
+        with self._lock:
+            for index, record in enumerate(users):
+                if record.email in self._by_email:
+                    errors.append(_ImportError(index, "email already exists"))
+                else:
+                    self._add(record.uid, record.email)
+        return _ImportResult(errors)
+
+    @contextlib.contextmanager
+    def installed(self) -> Iterator["FakeAuth"]:
+        """Patch firebase_admin.auth with this fake for the duration of the block."""
+        names = ("get_user", "get_user_by_email", "create_user", "get_users", "import_users")
+        originals = {name: getattr(fb_auth, name) for name in names}
+        for name in names:
+            setattr(fb_auth, name, getattr(self, name))
+        db_admin.clear_identity_cache()
+        try:
+            yield self
+        finally:
+            for name, original in originals.items():
+                setattr(fb_auth, name, original)
+            db_admin.clear_identity_cache()
+
+
+class RestStandInServer:
+    """Local HTTP server answering the RTDB REST protocol from an InMemoryBackend.
+
+    Supports what RestBackend uses: GET (shallow, ordered queries, ETags),
+    PUT (print=silent, if-match), PATCH and DELETE; streaming is not served.
+    Every request waits latency_ms (plus jitter) before it is handled.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[InMemoryBackend] = None,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """Initialize the server (call start() or use it as a context manager).
+
+        Args:
+            backend: Tree to serve; a new empty InMemoryBackend if omitted
+            latency_ms: Delay before each request is handled
+            jitter_ms: Uniform jitter of the delay
+            host: Interface to bind
+            port: Port to bind; 0 picks a free one
+        """
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.round_trips = 0
+        self.transaction_attempts = 0
+        self._counter_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Database URL to give RestBackend."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/?ns=standin"
+
+    def start(self) -> "RestStandInServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fb_core-rest-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "RestStandInServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+    @staticmethod
+    def etag(value: Any) -> str:
+        return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                # headers and body go out as separate writes; avoid Nagle/delayed-ACK stalls
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug("stand-in: " + format, *args)
+
+            def _reply(self, status: int, value: Any = None, headers: Optional[Dict[str, str]] = None) -> None:
+                body = b"" if status == 204 else json.dumps(value).encode()
+                if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    headers = dict(headers or {}, **{"Content-Encoding": "gzip"})
+                self.send_response(status)
+                for name, header in (headers or {}).items():
+                    self.send_header(name, header)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self) -> None:
+                with server._counter_lock:
+                    server.round_trips += 1
+                delay = server.latency + random.uniform(-server.jitter, server.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                url = urlparse(self.path)
+                path = unquote(url.path[:-len(".json")] if url.path.endswith(".json") else url.path)
+                params = {name: values[0] for name, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                try:
+                    status, value, headers = self._dispatch(self.command, path, params, body)
+                except ValueError as error:
+                    status, value, headers = 400, {"error": str(error)}, None
+                if params.get("print") == "silent" and status == 200:
+                    status = 204
+                self._reply(status, value, headers)
+
+            def _dispatch(self, method: str, path: str, params: Dict[str, str], body: Any) -> Tuple[int, Any, Any]:
+                backend = server.backend
+                if method == "GET":
+                    if "text/event-stream" in self.headers.get("Accept", ""):
+                        return 400, {"error": "streaming is not supported by the stand-in"}, None
+                    if "orderBy" in params:
+                        pairs = backend.query(
+                            path,
+                            order_by=json.loads(params["orderBy"]),
+                            start_at=json.loads(params["startAt"]) if "startAt" in params else None,
+                            end_at=json.loads(params["endAt"]) if "endAt" in params else None,
+                            limit=int(params["limitToFirst"]) if "limitToFirst" in params else None,
+                        )
+                        return 200, dict(pairs), None
+                    value = backend.get(path, shallow=params.get("shallow") == "true")
+                    if self.headers.get("X-Firebase-ETag") == "true":
+                        return 200, value, {"ETag": server.etag(value)}
+                    return 200, value, None
+                # the backend lock makes the if-match check and the write one step
+                with backend._lock:
+                    if method == "PUT":
+                        expected = self.headers.get("if-match")
+                        if expected is not None:
+                            with server._counter_lock:
+                                server.transaction_attempts += 1
+                            current = backend.get(path)
+                            if server.etag(current) != expected:
+                                return 412, current, {"ETag": server.etag(current)}
+                        backend.set(path, body)
+                        return 200, body, {"ETag": server.etag(backend.get(path))}
+                    if method == "PATCH":
+                        backend.update(path, body)
+                        return 200, body, None
+                    if method == "DELETE":
+                        backend.delete(path)
+                        return 200, None, None
+                return 405, {"error": f"{method} not supported"}, None
+
+            do_GET = do_PUT = do_PATCH = do_DELETE = _handle
+
+        return Handler
+
+
+@contextlib.contextmanager
+def local_environment(
+    latency_ms: float = 5.0,
+    jitter_ms: float = 1.0,
+    auth_latency_ms: float = 20.0,
+    transport: str = TRANSPORT_MEMORY,
+) -> Iterator[Dict[str, Any]]:
+    """Point the admin registry at a local RTDB stand-in and patch in FakeAuth.
+
+    Args:
+        latency_ms: Simulated RTDB round-trip latency
+        jitter_ms: Uniform jitter of the RTDB latency
+        auth_latency_ms: Simulated Firebase Auth call latency
+        transport: 'memory' for a LatencyBackend, 'rest' for a RestBackend
+            talking HTTP to a RestStandInServer
+
+    Yields:
+        Dict with the 'backend' (round_trips and transaction_attempts
+        counters), 'manager' and 'auth' stand-ins
+    """
+    registry = db_admin.get_admin_registry()
+    previous = (registry._db_manager, registry.max_size, registry.credit_shards)
+    server = None
+    if transport == TRANSPORT_REST:
+        server = RestStandInServer(latency_ms=latency_ms, jitter_ms=jitter_ms).start()
+        counters, manager = server, FBRTDBMgr(_TalliedRestBackend(database_url=server.url))
+    elif transport == TRANSPORT_MEMORY:
+        counters = LatencyBackend(latency_ms=latency_ms, jitter_ms=jitter_ms)
+        manager = FBRTDBMgr(counters)
+    else:
+        raise ValueError(f"unknown transport {transport!r}")
+    registry.configure(db_manager=manager, credit_shards=None)
+    auth = FakeAuth(latency_ms=auth_latency_ms)
+    try:
+        with auth.installed():
+            yield {"backend": counters, "manager": manager, "auth": auth}
+    finally:
+        manager.disable_write_behind()
+        registry.configure(db_manager=previous[0], max_size=previous[1], credit_shards=previous[2])
+        if server is not None:
+            manager.backend.close()
+            server.stop()
+
+
+def _run_flow_op(flow: str, user_id: str, key: str, args: Optional[Dict[str, Any]] = None) -> Any:
+    """Run one operation of a flow; key makes its default operation and run ids unique."""
+    args = args or {}
+    admin = db_admin.get_firebase_admin(user_id, env_id=args.get("env_id", "default"))
+    if flow == "add_credits":
+        return admin.add_credits_atomic(args.get("credits", 1), args.get("operation_id", f"bench-add-{key}"))
+    if flow == "deduct_credits":
+        return admin.deduct_credits_atomic(
+            args.get("credits", 1), args.get("operation_id", f"bench-deduct-{key}"), require_full_amount=False
+        )
+    if flow == "get_credits":
+        return admin.get_credits()
+    if flow == "record_history_event":
+        return admin.record_history_event(args.get("action", "bench.event"), details=args.get("details"))
+    if flow == "output_files":
+        run_id = admin.ensure_output_space(args.get("run_id", f"bench-run-{key}"))
+        files = args.get("files") or [{"name": f"file-{n}.png", "size_bytes": 1024} for n in range(5)]
+        return admin.record_output_files(run_id, files)
+    if flow == "sync_user_session":
+        email = args.get("email", f"{user_id}@bench.local")
+        billing_key = db_admin.resolve_billing_user_id(uid=args.get("uid"), email=email) or user_id
+        return db_admin.sync_user_session(billing_key, email=email, env_id=args.get("env_id", "default"))
+    if flow == "record_purchase_event":
+        return db_admin.record_purchase_event(
+            user_id,
+            credits=args.get("credits", 10),
+            operation_id=args.get("operation_id", f"bench-purchase-{key}"),
+        )
+    raise ValueError(f"unknown flow {flow!r}")
+
+
+FLOWS = (
+    "add_credits",
+    "deduct_credits",
+    "record_history_event",
+    "output_files",
+    "sync_user_session",
+    "record_purchase_event",
+)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def _summarize(latencies: List[float], errors: int, elapsed: float, round_trips: int, attempts: int) -> Dict[str, Any]:
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "operations": count,
+        "errors": errors,
+        "ops_per_sec": count / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "round_trips_per_op": round_trips / count if count else 0.0,
+        "transaction_attempts_per_op": attempts / count if count else 0.0,
+    }
+
+
+class _TalliedRestBackend(RestBackend):
+    """RestBackend that attributes its requests to the replayed operation (see _op_tally)."""
+
+    def _request(self, method: str, path: str, *args: Any, **kwargs: Any) -> Any:
+        _tally(0)
+        if method == "PUT" and "if-match" in (kwargs.get("headers") or {}):
+            _tally(1)
+        return super()._request(method, path, *args, **kwargs)
+
+
+def _tallied(tally: List[int], fn: Callable[[], Any]) -> Any:
+    token = _op_tally.set(tally)
+    try:
+        return fn()
+    finally:
+        _op_tally.reset(token)
+
+
+def _timed(fn: Callable[[], Any], latencies: List[float], failures: List[int]) -> None:
+    started = time.perf_counter()
+    try:
+        fn()
+    except Exception as error:
+        failures.append(1)
+        logger.debug("Benchmark operation failed: %s", error)
+    latencies.append(time.perf_counter() - started)
+
+
+def run_benchmark(
+    flows: Sequence[str] = FLOWS,
+    operations: int = 1000,
+    concurrency: int = 8,
+    users: int = 100,
+    latency_ms: float = 5.0,
+    jitter_ms: float = 1.0,
+    auth_latency_ms: float = 20.0,
+    write_behind: bool = False,
+    transport: str = TRANSPORT_MEMORY,
+) -> Dict[str, Dict[str, Any]]:
+    """Drive each flow against the local stand-ins and report its performance.
+
+    Args:
+        flows: Flows to run, see FLOWS
+        operations: Operations per flow
+        concurrency: Operations in flight at once
+        users: Distinct users the operations are spread over; fewer users
+            means more contention on each credits node
+        latency_ms: Simulated RTDB round-trip latency
+        jitter_ms: Uniform jitter of the RTDB latency
+        auth_latency_ms: Simulated Firebase Auth call latency
+        write_behind: Enable the write-behind queue for history and ledger writes
+        transport: 'memory' (LatencyBackend) or 'rest' (RestBackend over HTTP)
+
+    Returns:
+        Dict flow -> ops_per_sec, p50_ms, p99_ms, round_trips_per_op,
+        transaction_attempts_per_op, operations and errors
+    """
+    report = {}
+    with local_environment(latency_ms, jitter_ms, auth_latency_ms, transport) as env:
+        backend, manager = env["backend"], env["manager"]
+        if write_behind:
+            manager.enable_write_behind()
+        user_ids = [f"bench-user-{n}" for n in range(users)]
+        # operation ids must not repeat across runs, or idempotency short-circuits them
+        run_tag = uuid.uuid4().hex[:8]
+        # fund every user so deductions measure the happy path
+        for user_id in user_ids:
+            db_admin.get_firebase_admin(user_id).add_credits_atomic(operations * 10, f"bench-fund-{run_tag}-{user_id}")
+        for flow in flows:
+            latencies: List[float] = []
+            failures: List[int] = []
+            trips, attempts = backend.round_trips, backend.transaction_attempts
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for index in range(operations):
+                    user_id = user_ids[index % users]
+                    pool.submit(_timed, lambda f=flow, u=user_id, k=f"{run_tag}-{index}": _run_flow_op(f, u, k), latencies, failures)
+            if manager.write_queue is not None:
+                manager.write_queue.flush()
+            elapsed = time.perf_counter() - started
+            report[flow] = _summarize(
+                latencies,
+                len(failures),
+                elapsed,
+                backend.round_trips - trips,
+                backend.transaction_attempts - attempts,
+            )
+    return report
+
+
+def replay_trace(
+    path: str,
+    speed: float = 1.0,
+    concurrency: int = 32,
+    latency_ms: float = 5.0,
+    jitter_ms: float = 1.0,
+    auth_latency_ms: float = 20.0,
+    transport: str = TRANSPORT_MEMORY,
+) -> Dict[str, Dict[str, Any]]:
+    """Re-run a recorded operation log against the local stand-ins.
+
+    Each line of the log is a JSON object
+    `{"ts": <epoch seconds>, "op": <flow>, "user_id": <id>, "args": {...}}`;
+    op is one of FLOWS or 'get_credits' and args override the flow defaults
+    (credits, operation_id, action, run_id, files, email, env_id). Operations
+    are issued at their recorded offsets divided by speed.
+
+    Args:
+        path: JSON lines trace file
+        speed: Replay speed factor (10 = ten times faster than recorded)
+        concurrency: Maximum operations in flight
+        latency_ms: Simulated RTDB round-trip latency
+        jitter_ms: Uniform jitter of the RTDB latency
+        auth_latency_ms: Simulated Firebase Auth call latency
+        transport: 'memory' (LatencyBackend) or 'rest' (RestBackend over HTTP)
+
+    Round trips and transaction attempts are counted per operation on the
+    client side, so each op reports its own; writes deferred to the
+    write-behind queue happen outside any operation and are not included.
+
+    Returns:
+        Dict op -> statistics as in run_benchmark, plus '_replay' with the
+        total duration and the maximum lag behind the schedule
+    """
+    if speed <= 0:
+        raise ValueError("speed must be positive")
+    stats: Dict[str, Dict[str, List]] = {}
+    max_lag = 0.0
+    with local_environment(latency_ms, jitter_ms, auth_latency_ms, transport):
+        run_tag = uuid.uuid4().hex[:8]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool, open(path, "r", encoding="utf-8") as trace:
+            first_ts = None
+            for index, line in enumerate(trace):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                ts = float(entry.get("ts") or 0)
+                first_ts = ts if first_ts is None else first_ts
+                wait = (ts - first_ts) / speed - (time.perf_counter() - started)
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    max_lag = max(max_lag, -wait)
+                op = entry["op"]
+                series = stats.setdefault(op, {"latencies": [], "failures": [], "tallies": []})
+                tally = [0, 0]
+                series["tallies"].append(tally)
+                pool.submit(
+                    _timed,
+                    lambda t=tally, o=op, u=entry["user_id"], k=f"{run_tag}-{index}", a=entry.get("args"): _tallied(
+                        t, lambda: _run_flow_op(o, u, k, a)
+                    ),
+                    series["latencies"],
+                    series["failures"],
+                )
+        elapsed = time.perf_counter() - started
+    report = {
+        op: _summarize(
+            series["latencies"],
+            len(series["failures"]),
+            elapsed,
+            sum(tally[0] for tally in series["tallies"]),
+            sum(tally[1] for tally in series["tallies"]),
+        )
+        for op, series in stats.items()
+    }
+    report["_replay"] = {"elapsed_s": elapsed, "max_lag_ms": max_lag * 1000, "speed": speed}
+    return report
+
+
+def _print_report(report: Dict[str, Dict[str, Any]]) -> None:
+    header = f"{'flow':<24}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'trips/op':>10}{'txn/op':>8}{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    for flow, row in report.items():
+        if flow.startswith("_"):
+            continue
+        print(
+            f"{flow:<24}{row['ops_per_sec']:>10.1f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            f"{row['round_trips_per_op']:>10.2f}{row['transaction_attempts_per_op']:>8.2f}{row['errors']:>8}"
+        )
+    if "_replay" in report:
+        replay = report["_replay"]
+        print(f"replayed at {replay['speed']}x in {replay['elapsed_s']:.2f}s, max lag {replay['max_lag_ms']:.1f} ms")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark fb_core credit and session flows")
+    parser.add_argument("--flows", nargs="*", default=list(FLOWS), choices=FLOWS)
+    parser.add_argument("--operations", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=1.0)
+    parser.add_argument("--auth-latency-ms", type=float, default=20.0)
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--transport", default=TRANSPORT_MEMORY, choices=(TRANSPORT_MEMORY, TRANSPORT_REST))
+    parser.add_argument("--replay", help="JSON lines trace to replay instead of the synthetic flows")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+    if args.replay:
+        report = replay_trace(
+            args.replay,
+            speed=args.speed,
+            concurrency=args.concurrency,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            auth_latency_ms=args.auth_latency_ms,
+            transport=args.transport,
+        )
+    else:
+        report = run_benchmark(
+            flows=args.flows,
+            operations=args.operations,
+            concurrency=args.concurrency,
+            users=args.users,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            auth_latency_ms=args.auth_latency_ms,
+            write_behind=args.write_behind,
+            transport=args.transport,
+        )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Parallel fan-out of admin operations over many users.
+
+run_for_users() runs one operation per user key on a bounded thread pool,
+using the shared FirebaseAdmin handles of the registry. Starts are paced by
+a token bucket to stay under RTDB rate quotas, each operation has its own
+deadline, and the outcome is returned as one aggregated report instead of
+stopping at the first failure.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+
+from fb_core.db_admin import FirebaseAdmin, get_firebase_admin
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Thread-safe token bucket."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        """Initialize the bucket.
+
+        Args:
+            rate: Tokens added per second
+            burst: Bucket capacity; defaults to one second worth of tokens
+            clock: Monotonic time source
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+def run_for_users(
+    keys: Iterable[str],
+    op: Union[str, Callable[[FirebaseAdmin], Any]],
+    max_workers: int = 16,
+    timeout: Optional[float] = None,
+    rate_limit: Optional[float] = None,
+    env_id: str = "default",
+) -> Dict[str, Any]:
+    """Run op for every user key concurrently and aggregate the outcome.
+
+    Operations that exceed their timeout are reported as timed out; their
+    threads cannot be interrupted and finish in the background, their results
+    are discarded.
+
+    Args:
+        keys: User ids (billing keys) to process
+        op: Callable receiving the user's FirebaseAdmin, or the name of a
+            FirebaseAdmin method to call without arguments (e.g. 'ensure_user_spaces')
+        max_workers: Maximum operations running at once
+        timeout: Seconds each operation may run before it is reported as timed out
+        rate_limit: Maximum operation starts per second
+        env_id: Environment of the FirebaseAdmin handles
+
+    Returns:
+        Dict with succeeded/failed/timed_out counts, results and errors keyed
+        by user key, the list of timed out keys and the elapsed seconds
+    """
+    if isinstance(op, str):
+        method = op
+
+        def call(admin: FirebaseAdmin) -> Any:
+            return getattr(admin, method)()
+    else:
+        call = op
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    report: Dict[str, Any] = {
+        "succeeded": 0,
+        "failed": 0,
+        "timed_out": 0,
+        "results": {},
+        "errors": {},
+        "timed_out_keys": [],
+    }
+    started_at = time.monotonic()
+    # future -> [key, start time or None while waiting for a worker/token]
+    running: Dict[Future, list] = {}
+
+    def _call(key: str, slot: list) -> Any:
+        if limiter is not None:
+            limiter.acquire()
+        slot[1] = time.monotonic()
+        return call(get_firebase_admin(key, env_id=env_id))
+
+    def _collect(done: Iterable[Future]) -> None:
+        for future in done:
+            key, _ = running.pop(future)
+            error = future.exception()
+            if error is None:
+                report["succeeded"] += 1
+                report["results"][key] = future.result()
+            else:
+                report["failed"] += 1
+                report["errors"][key] = f"{type(error).__name__}: {error}"
+                logger.warning("Bulk operation failed for %s: %s", key, error)
+
+    def _expire() -> None:
+        now = time.monotonic()
+        for future, (key, start) in list(running.items()):
+            if start is not None and now - start > timeout and not future.done():
+                running.pop(future)
+                report["timed_out"] += 1
+                report["timed_out_keys"].append(key)
+                logger.warning("Bulk operation timed out for %s after %.1fs", key, timeout)
+
+    def _wait(max_pending: int) -> None:
+        while len(running) > max_pending:
+            done, _ = wait(list(running), timeout=0.05 if timeout else None, return_when=FIRST_COMPLETED)
+            _collect(done)
+            if timeout:
+                _expire()
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fb_core-bulk")
+    try:
+        for key in keys:
+            # bounded submission keeps memory flat for very long key streams
+            _wait(max_workers * 2)
+            slot = [key, None]
+            running[pool.submit(_call, key, slot)] = slot
+        _wait(0)
+    finally:
+        # do not block on timed out operations
+        pool.shutdown(wait=False)
+
+    report["elapsed"] = time.monotonic() - started_at
+    logger.info(
+        "Bulk operation finished succeeded=%d failed=%d timed_out=%d elapsed=%.2fs",
+        report["succeeded"],
+        report["failed"],
+        report["timed_out"],
+        report["elapsed"],
+    )
+    return report
@@ -0,0 +1,149 @@
+"""
+In-process caches for fb_core.
+
+TTLCache is a thread-safe LRU mapping whose entries also expire after a
+time-to-live; it backs the per-process caches kept by FirebaseAdmin.
+SingleFlight collapses concurrent identical lookups into one call.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache with per-entry expiry."""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries; least recently used are evicted first
+            ttl: Default time-to-live in seconds
+            clock: Monotonic time source
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store value under key.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Time-to-live in seconds; the cache default if omitted
+        """
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key and return its value (expired or not), or default."""
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self) -> None:
+        """Remove all entries; counters are kept."""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            return entry is not _MISSING and entry[0] > self._clock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters."""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key.
+
+    While a call for a key is running, other callers with the same key wait
+    for it and receive its result (or exception) instead of calling again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run fn once for all concurrent callers using key.
+
+        Args:
+            key: Deduplication key
+            fn: Zero-argument callable producing the result
+
+        Returns:
+            The result of the (shared) call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
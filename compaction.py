@@ -0,0 +1,286 @@
+"""
+Retention and compaction of history and ledger subtrees.
+
+Old ledger entries are rolled into one balance checkpoint per day under
+`ledger_checkpoints/{day}` and old history events are archived into
+gzip-compressed JSON lines blobs, one or more per day, through a pluggable
+ArchiveSink. Each page is removed from RTDB in the same multi-path update
+that stores its checkpoint and advances the progress marker under
+`compaction/`, so a run can stop after any page (max_items) and the next
+run picks up whatever is still older than the cutoff.
+"""
+
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from fb_core.push_ids import push_id_upper_bound
+
+if TYPE_CHECKING:
+    from fb_core.db_admin import FirebaseAdmin
+
+logger = logging.getLogger(__name__)
+
+HISTORY_RETENTION_DAYS = 90
+LEDGER_RETENTION_DAYS = 180
+COMPACTION_PAGE_SIZE = 500
+
+
+class ArchiveSink:
+    """Destination for archived blobs (local directory, object storage, ...)."""
+
+    def write(self, name: str, payload: bytes) -> None:
+        """Store payload under name, replacing any previous blob with that name."""
+        raise NotImplementedError
+
+
+class LocalFileSink(ArchiveSink):
+    """Stores archive blobs as files below a root directory."""
+
+    def __init__(self, root: str):
+        """Initialize the sink.
+
+        Args:
+            root: Directory that receives the archive tree
+        """
+        self.root = root
+
+    def write(self, name: str, payload: bytes) -> None:
+        path = os.path.join(self.root, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as blob:
+            blob.write(payload)
+        # readers never see a partially written blob
+        os.replace(tmp_path, path)
+
+
+def _encode_blob(records: List[Dict[str, Any]]) -> bytes:
+    lines = "".join(json.dumps(record, sort_keys=True, default=str) + "\n" for record in records)
+    return gzip.compress(lines.encode("utf-8"))
+
+
+def _day_of(timestamp: Any) -> str:
+    return str(timestamp or "")[:10] or "unknown"
+
+
+def _group_by_day(entries: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+    days: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+    for key, entry in entries:
+        days.setdefault(_day_of(entry.get("timestamp")), []).append((key, entry))
+    return days
+
+
+def _merge_checkpoint(checkpoint: Any, day: str, entries: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Fold ledger entries of one day into its (possibly existing) checkpoint."""
+    checkpoint = dict(checkpoint) if isinstance(checkpoint, dict) else {"day": day, "entries": 0}
+    by_type = dict(checkpoint.get("by_type") or {})
+    for _, entry in entries:
+        txn_type = str(entry.get("type") or "unknown")
+        totals = dict(by_type.get(txn_type) or {"count": 0, "amount": 0})
+        totals["count"] = int(totals.get("count") or 0) + 1
+        totals["amount"] = int(totals.get("amount") or 0) + int(entry.get("amount") or 0)
+        by_type[txn_type] = totals
+        timestamp = str(entry.get("timestamp") or "")
+        if timestamp >= str(checkpoint.get("last_timestamp") or ""):
+            checkpoint["last_timestamp"] = timestamp
+            checkpoint["closing_balance"] = entry.get("new_balance")
+    checkpoint["entries"] = int(checkpoint.get("entries") or 0) + len(entries)
+    checkpoint["by_type"] = by_type
+    return checkpoint
+
+
+def _utc(when: datetime) -> datetime:
+    return when.replace(tzinfo=timezone.utc) if when.tzinfo is None else when.astimezone(timezone.utc)
+
+
+def _read_page(admin: "FirebaseAdmin", path: str, limit: int, **query: Any) -> List[Tuple[str, Any]]:
+    page = []
+    for key, value in admin.db_manager.iter_children(path, page_size=limit, **query):
+        page.append((key, value))
+        if len(page) >= limit:
+            break
+    return page
+
+
+def _load_progress(admin: "FirebaseAdmin", name: str) -> Optional[Dict[str, Any]]:
+    """Progress marker of a subtree, or None if it could not be read."""
+    result = admin.db_manager.read(f"{admin.database}/compaction/{name}")
+    if not result.available:
+        logger.warning("Compaction progress of %s unavailable for %s", name, admin.user_id)
+        return None
+    return dict(result.value) if isinstance(result.value, dict) else {"compacted": 0}
+
+
+def _advance(progress: Dict[str, Any], cursor: Any, count: int) -> Dict[str, Any]:
+    """Progress marker after one more compacted page."""
+    progress["cursor"] = cursor
+    progress["compacted"] = int(progress.get("compacted") or 0) + count
+    progress["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return dict(progress)
+
+
+def compact_ledger(
+    admin: "FirebaseAdmin",
+    before: datetime,
+    sink: Optional[ArchiveSink] = None,
+    max_items: Optional[int] = None,
+    page_size: int = COMPACTION_PAGE_SIZE,
+) -> int:
+    """Roll ledger entries older than `before` into daily balance checkpoints.
+
+    Args:
+        admin: FirebaseAdmin of the user to compact
+        before: Entries with an earlier timestamp are compacted
+        sink: Optional sink that also receives the raw entries as archive blobs
+        max_items: Stop after about this many entries (resumed by the next run)
+        page_size: Entries read and removed per round trip
+
+    Returns:
+        Number of entries compacted
+    """
+    ledger_path = f"{admin.database}/ledger"
+    cutoff = _utc(before).isoformat()
+    progress = _load_progress(admin, "ledger")
+    if progress is None:
+        return 0
+    compacted = 0
+    while max_items is None or compacted < max_items:
+        limit = page_size if max_items is None else min(page_size, max_items - compacted)
+        page = [
+            (key, entry)
+            for key, entry in _read_page(admin, ledger_path, limit, order_by="timestamp", end_at=cutoff)
+            # end_at is inclusive, the cutoff itself stays hot
+            if isinstance(entry, dict) and str(entry.get("timestamp") or "") < cutoff
+        ]
+        if not page:
+            break
+        days = _group_by_day(page)
+        checkpoints = {}
+        for day in days:
+            result = admin.db_manager.read(f"{admin.database}/ledger_checkpoints/{day}")
+            if not result.available:
+                break
+            checkpoints[day] = result.value
+        if len(checkpoints) < len(days):
+            # merging into a checkpoint that could not be read would replace it
+            logger.warning("Ledger checkpoint unavailable, compaction stopped for %s", admin.user_id)
+            break
+        batch = admin.db_manager.batch()
+        for day, entries in days.items():
+            if sink is not None:
+                sink.write(f"{ledger_path}/{day}/{entries[0][0]}.jsonl.gz", _encode_blob(
+                    [dict(entry, ledger_key=key) for key, entry in entries]
+                ))
+            batch.set(
+                f"{admin.database}/ledger_checkpoints/{day}",
+                _merge_checkpoint(checkpoints[day], day, entries),
+            )
+            for key, _ in entries:
+                batch.remove(f"{ledger_path}/{key}")
+        batch.set(f"{admin.database}/compaction/ledger", _advance(progress, page[-1][1].get("timestamp"), len(page)))
+        if not batch.commit():
+            logger.warning("Ledger compaction commit failed for %s", admin.user_id)
+            break
+        compacted += len(page)
+        if len(page) < limit:
+            break
+    return compacted
+
+
+def compact_history(
+    admin: "FirebaseAdmin",
+    before: datetime,
+    sink: ArchiveSink,
+    max_items: Optional[int] = None,
+    page_size: int = COMPACTION_PAGE_SIZE,
+) -> int:
+    """Archive history events older than `before` into daily compressed blobs.
+
+    Only push-ID keyed events are considered (their keys encode the time);
+    legacy uuid4 keyed events are left in place.
+
+    Args:
+        admin: FirebaseAdmin of the user to compact
+        before: Events created earlier are archived
+        sink: Sink receiving `{database}/history/{day}/{first_key}.jsonl.gz` blobs
+        max_items: Stop after about this many events (resumed by the next run)
+        page_size: Events read and removed per round trip
+
+    Returns:
+        Number of events archived
+    """
+    history_path = f"{admin.database}/history"
+    end_at = push_id_upper_bound(_utc(before) - timedelta(milliseconds=1))
+    progress = _load_progress(admin, "history")
+    if progress is None:
+        return 0
+    compacted = 0
+    while max_items is None or compacted < max_items:
+        limit = page_size if max_items is None else min(page_size, max_items - compacted)
+        page = [
+            (key, event if isinstance(event, dict) else {"value": event})
+            for key, event in _read_page(admin, history_path, limit, end_at=end_at)
+        ]
+        if not page:
+            break
+        batch = admin.db_manager.batch()
+        for day, events in _group_by_day(page).items():
+            # named after the first key, so a retried page overwrites its own blob
+            sink.write(f"{history_path}/{day}/{events[0][0]}.jsonl.gz", _encode_blob(
+                [dict(event, event_id=event.get("event_id", key)) for key, event in events]
+            ))
+            for key, _ in events:
+                batch.remove(f"{history_path}/{key}")
+        batch.set(f"{admin.database}/compaction/history", _advance(progress, page[-1][0], len(page)))
+        if not batch.commit():
+            logger.warning("History compaction commit failed for %s", admin.user_id)
+            break
+        compacted += len(page)
+        if len(page) < limit:
+            break
+    return compacted
+
+
+def compact_user(
+    admin: "FirebaseAdmin",
+    sink: Optional[ArchiveSink] = None,
+    history_retention_days: float = HISTORY_RETENTION_DAYS,
+    ledger_retention_days: float = LEDGER_RETENTION_DAYS,
+    max_items: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> Dict[str, int]:
+    """Compact one user's ledger and (given a sink) history.
+
+    Args:
+        admin: FirebaseAdmin of the user to compact
+        sink: Archive sink; history is only compacted when one is given
+        history_retention_days: History younger than this stays hot
+        ledger_retention_days: Ledger entries younger than this stay hot
+        max_items: Per-subtree budget for this run
+        now: Reference time (defaults to the current time)
+
+    Returns:
+        Dict with the number of ledger and history items compacted
+    """
+    report = {"ledger": 0, "history": 0}
+    if admin.db_manager is None:
+        return report
+    now = now or datetime.now(timezone.utc)
+    report["ledger"] = compact_ledger(
+        admin, now - timedelta(days=ledger_retention_days), sink=sink, max_items=max_items
+    )
+    if sink is not None:
+        report["history"] = compact_history(
+            admin, now - timedelta(days=history_retention_days), sink, max_items=max_items
+        )
+    logger.info(
+        "Compaction finished user_id=%s ledger=%s history=%s",
+        admin.user_id,
+        report["ledger"],
+        report["history"],
+    )
+    return report
@@ -0,0 +1,341 @@
+"""
+Local credit reservations for high-frequency deductions.
+
+A CreditLease atomically moves a block of credits from a user's balance into
+a reservation node (credits/reserved/{lease_id}) and then serves deductions
+from an in-process counter. Consumption is settled back with one transaction
+that returns the unused credits and drops the reservation, followed by a
+single aggregated ledger entry. Leases settle on flush, on expiry (checked on
+the next deduction), on close and at interpreter shutdown.
+
+Both transactions are safe to retry after a lost commit response: every
+reservation attempt is recorded under the lease with its own id, and a
+settlement that finds its reservation already gone was applied before.
+Reservations reclaimed by recover_expired_leases() leave a tombstone, so the
+holder can still tell a reclaimed block from one it settled itself.
+"""
+
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from fb_core.backends import AbortTransaction
+from fb_core.credit_shards import credits_total, debit
+from fb_core.resilience import RTDBUnavailableError
+
+if TYPE_CHECKING:
+    from fb_core.db_admin import FirebaseAdmin
+
+logger = logging.getLogger(__name__)
+
+_active_leases: "weakref.WeakSet[CreditLease]" = weakref.WeakSet()
+
+# reclaimed reservations are forgotten this long after they expired
+LEASE_TOMBSTONE_SECONDS = 7 * 24 * 3600
+
+
+class CreditLease:
+    """In-process credit counter backed by a reservation on the user's balance."""
+
+    def __init__(
+        self,
+        admin: "FirebaseAdmin",
+        block_size: int,
+        ttl_seconds: float = 60.0,
+    ):
+        """Initialize the lease; credits are reserved on the first deduction.
+
+        Args:
+            admin: FirebaseAdmin of the user whose credits are leased
+            block_size: Credits reserved per round trip
+            ttl_seconds: Time after which a reservation is settled and renewed
+        """
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        self.admin = admin
+        self.block_size = block_size
+        self.ttl_seconds = ttl_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.RLock()
+        self._lease_id: Optional[str] = None
+        self._reserved = 0
+        self._available = 0
+        self._consumed = 0
+        self._operations = 0
+        self._expires_at = 0.0
+        self._closed = False
+        _active_leases.add(self)
+
+    @property
+    def available(self) -> int:
+        """Credits that can still be deducted without a round trip."""
+        return self._available
+
+    def __enter__(self) -> "CreditLease":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def _acquire(self, minimum: int) -> int:
+        """Reserve at least `minimum` credits (up to a full block) from the balance.
+
+        Returns:
+            Number of credits actually reserved (may be less if the balance is low)
+
+        Raises:
+            RTDBUnavailableError: If the reservation could not be committed
+        """
+        amount = max(self.block_size, minimum)
+        lease_id = self._lease_id or uuid.uuid4().hex
+        attempt_id = uuid.uuid4().hex
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        taken = {"amount": 0}
+
+        def _reserve_txn(current):
+            if not isinstance(current, dict):
+                current = {"balance": 0}
+            reserved = current.get("reserved") if isinstance(current.get("reserved"), dict) else {}
+            entry = reserved.get(lease_id) if isinstance(reserved.get(lease_id), dict) else {}
+            attempts = entry.get("attempts") if isinstance(entry.get("attempts"), dict) else {}
+            if attempt_id in attempts:
+                # an earlier try committed but its response was lost
+                taken["amount"] = int(attempts[attempt_id] or 0)
+                taken["replayed"] = True
+                raise AbortTransaction()
+            # takes from the legacy balance first, then from credit shards
+            take = debit(current, amount)
+            taken["amount"] = take
+            if take <= 0:
+                return current
+            reserved[lease_id] = {
+                "amount": int(entry.get("amount") or 0) + take,
+                "attempts": dict(attempts, **{attempt_id: take}),
+                "holder": self.holder,
+                "expires_at": expires_at.isoformat(),
+            }
+            current["reserved"] = reserved
+            current["updated_at"] = datetime.now(timezone.utc).isoformat()
+            return current
+
+        committed = self.admin.db_manager.transact(f"{self.admin.database}/credits", _reserve_txn)
+        if not committed and not taken.get("replayed"):
+            raise RTDBUnavailableError(f"credits of {self.admin.user_id} unavailable, no credits reserved")
+        take = taken["amount"]
+        if take > 0:
+            self.admin._forget_balance()
+            if self._lease_id is None:
+                self._expires_at = time.monotonic() + self.ttl_seconds
+            self._lease_id = lease_id
+            self._reserved += take
+            self._available += take
+        return take
+
+    def deduct(
+        self,
+        credits: int,
+        operation_id: Optional[str] = None,
+        require_full_amount: bool = True,
+    ) -> Dict[str, Any]:
+        """Deduct credits from the local reservation, reserving more when needed.
+
+        Args:
+            credits: Number of credits to deduct
+            operation_id: Optional caller operation identifier (for tracing)
+            require_full_amount: If True, fail if insufficient balance
+
+        Returns:
+            Result dict with transaction_id, deducted and the locally available credits
+
+        Raises:
+            ValueError: If insufficient credits and require_full_amount=True
+            RTDBUnavailableError: If more credits were needed and RTDB is unavailable
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError("credit lease is closed")
+            if self._lease_id is not None and time.monotonic() >= self._expires_at:
+                self.settle()
+            if self._available < credits:
+                self._acquire(credits - self._available)
+            if self._available < credits:
+                if require_full_amount:
+                    raise ValueError(
+                        f"insufficient credits: required {credits}, available {self._available}"
+                    )
+                deducted = self._available
+            else:
+                deducted = credits
+            self._available -= deducted
+            self._consumed += deducted
+            self._operations += 1
+            return {
+                "transaction_id": operation_id,
+                "deducted": deducted,
+                "available": self._available,
+            }
+
+    def settle(self) -> Dict[str, Any]:
+        """Return unused credits, drop the reservation and record consumption.
+
+        Returns:
+            Dict with consumed, refunded, operations, new_balance and settled
+            (False if the settlement failed; the lease stays as it was, so it
+            can be settled again)
+        """
+        with self._lock:
+            summary = {
+                "consumed": self._consumed,
+                "refunded": 0,
+                "operations": self._operations,
+                "new_balance": None,
+                "settled": True,
+            }
+            if self._lease_id is None:
+                return summary
+            lease_id = self._lease_id
+            consumed = self._reserved - self._available
+            refund = {"amount": 0, "new_balance": None}
+
+            def _settle_txn(current):
+                if not isinstance(current, dict):
+                    current = {"balance": 0}
+                reserved = current.get("reserved") if isinstance(current.get("reserved"), dict) else {}
+                entry = reserved.pop(lease_id, None)
+                if not isinstance(entry, dict):
+                    # an earlier try committed but its response was lost
+                    refund["amount"] = self._available
+                    refund["replayed"] = True
+                    raise AbortTransaction()
+                if entry.get("reclaimed") is not None:
+                    # reclaimed by recover_expired_leases: the whole block went back,
+                    # so take the consumed part out again
+                    unused = 0
+                    debit(current, consumed)
+                else:
+                    unused = max(0, int(entry.get("amount") or 0) - consumed)
+                    current["balance"] = int(current.get("balance") or 0) + unused
+                current["reserved"] = reserved
+                current["updated_at"] = datetime.now(timezone.utc).isoformat()
+                refund["amount"] = unused
+                refund["new_balance"] = credits_total(current)
+                return current
+
+            committed = self.admin.db_manager.transact(f"{self.admin.database}/credits", _settle_txn)
+            if not committed and not refund.get("replayed"):
+                logger.warning("Failed to settle credit lease %s for %s", lease_id, self.admin.user_id)
+                summary["settled"] = False
+                return summary
+            if committed:
+                self.admin._cache_balance(refund["new_balance"])
+            else:
+                self.admin._forget_balance()
+
+            if self._consumed:
+                self.admin._record_transaction(
+                    "deduct_credits",
+                    self._consumed,
+                    f"lease-{lease_id}",
+                    refund["new_balance"],
+                    details={"lease_id": lease_id, "operations": self._operations},
+                )
+            summary.update({"refunded": refund["amount"], "new_balance": refund["new_balance"]})
+            logger.info(
+                "Credit lease settled user_id=%s lease_id=%s consumed=%s refunded=%s operations=%s",
+                self.admin.user_id,
+                lease_id,
+                self._consumed,
+                refund["amount"],
+                self._operations,
+            )
+            self._lease_id = None
+            self._reserved = self._available = self._consumed = self._operations = 0
+            return summary
+
+    def flush(self) -> Dict[str, Any]:
+        """Alias of settle(); the next deduction reserves a new block."""
+        return self.settle()
+
+    def close(self) -> Dict[str, Any]:
+        """Settle the lease and refuse further deductions.
+
+        If the settlement fails the lease stays open (and is retried at
+        interpreter shutdown); check summary['settled'] and close again.
+        """
+        with self._lock:
+            summary = self.settle()
+            if summary["settled"]:
+                self._closed = True
+                _active_leases.discard(self)
+            return summary
+
+
+def recover_expired_leases(admin: "FirebaseAdmin") -> int:
+    """Return credits of expired reservations (e.g. from crashed holders) to the balance.
+
+    A reclaimed reservation is replaced by a tombstone (dropped after
+    LEASE_TOMBSTONE_SECONDS), so a holder that settles late is charged for
+    what it consumed instead of being refunded twice.
+
+    Args:
+        admin: FirebaseAdmin of the user to clean up
+
+    Returns:
+        Number of credits returned
+
+    Raises:
+        RTDBUnavailableError: If the recovery transaction could not be committed
+    """
+    now = datetime.now(timezone.utc)
+    expired_before = now.isoformat()
+    forget_before = (now - timedelta(seconds=LEASE_TOMBSTONE_SECONDS)).isoformat()
+    recovered = {"amount": 0, "changed": False, "aborted": False}
+
+    def _recover_txn(current):
+        recovered.update(amount=0, changed=False, aborted=False)
+        if not isinstance(current, dict) or not isinstance(current.get("reserved"), dict):
+            recovered["aborted"] = True
+            raise AbortTransaction()
+        reserved = current["reserved"]
+        amount = 0
+        for lease_id in list(reserved):
+            entry = reserved[lease_id]
+            expires_at = str(entry.get("expires_at") or "") if isinstance(entry, dict) else ""
+            if not isinstance(entry, dict) or (entry.get("reclaimed") is not None and expires_at < forget_before):
+                del reserved[lease_id]
+                recovered["changed"] = True
+            elif entry.get("reclaimed") is None and expires_at < expired_before:
+                taken = int(entry.get("amount") or 0)
+                amount += taken
+                reserved[lease_id] = {"reclaimed": taken, "expires_at": expires_at}
+                recovered["changed"] = True
+        if not recovered["changed"]:
+            # nothing expired: no write, no contention with live holders
+            recovered["aborted"] = True
+            raise AbortTransaction()
+        current["balance"] = int(current.get("balance") or 0) + amount
+        recovered["amount"] = amount
+        return current
+
+    if not admin.db_manager.transact(f"{admin.database}/credits", _recover_txn):
+        if not recovered["aborted"]:
+            raise RTDBUnavailableError(f"credits of {admin.user_id} unavailable, no reservations recovered")
+        return 0
+    return recovered["amount"]
+
+
+@atexit.register
+def settle_all_leases() -> None:
+    """Settle every open lease in this process (run automatically at exit)."""
+    for lease in list(_active_leases):
+        try:
+            lease.close()
+        except Exception as error:
+            logger.warning("Failed to settle credit lease at shutdown: %s", error)
@@ -0,0 +1,121 @@
+"""
+Sharded credit counter layout.
+
+A user's credits node may hold, next to the legacy `balance`, N sub-counters
+under `credits/shards/{i}/balance`. The spendable total is the legacy balance
+plus the sum of all shards, so single-balance and sharded writers can coexist
+during a migration. Writers pick a shard from the operation key, so retries of
+one operation always land on the same shard, and rebalancing moves every
+idempotency record to the shard its operation maps to.
+"""
+
+import zlib
+from typing import Any, Dict, Iterator, Tuple
+
+# children of a credits node that credits_total() needs (ops and reservations are not)
+BALANCE_FIELDS = ("balance", "shards")
+
+
+def iter_shards(credits: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (shard key, shard node) pairs of a credits node.
+
+    RTDB returns objects with sequential integer keys as lists, so both list
+    and dict shapes are accepted.
+    """
+    shards = credits.get("shards") if isinstance(credits, dict) else None
+    if isinstance(shards, list):
+        items = ((str(index), node) for index, node in enumerate(shards))
+    elif isinstance(shards, dict):
+        items = iter(shards.items())
+    else:
+        return
+    for key, node in items:
+        if isinstance(node, dict):
+            yield key, node
+
+
+def shard_balance(node: Any) -> int:
+    """Balance of a single shard node."""
+    if isinstance(node, dict):
+        return int(node.get("balance") or 0)
+    return 0
+
+
+def credits_total(credits: Any) -> int:
+    """Spendable balance of a credits node: legacy balance plus all shards."""
+    if not isinstance(credits, dict):
+        return 0
+    total = int(credits.get("balance") or 0)
+    for _, node in iter_shards(credits):
+        total += shard_balance(node)
+    return total
+
+
+def shard_index(op_key: str, shard_count: int) -> int:
+    """Stable shard for an operation key (see idempotency.operation_key)."""
+    return zlib.crc32(str(op_key).encode("utf-8")) % shard_count
+
+
+def _shards_as_dict(credits: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    shards = {key: dict(node) for key, node in iter_shards(credits)}
+    credits["shards"] = shards
+    return shards
+
+
+def debit(credits: Dict[str, Any], amount: int) -> int:
+    """Take up to amount from a credits node, legacy balance first, then shards.
+
+    Args:
+        credits: Credits node to mutate in place
+        amount: Credits to take
+
+    Returns:
+        Credits actually taken
+    """
+    remaining = amount
+    balance = int(credits.get("balance") or 0)
+    take = min(balance, remaining)
+    credits["balance"] = balance - take
+    remaining -= take
+    if remaining > 0 and credits.get("shards"):
+        for node in _shards_as_dict(credits).values():
+            if remaining <= 0:
+                break
+            take = min(shard_balance(node), remaining)
+            node["balance"] = shard_balance(node) - take
+            remaining -= take
+    return amount - remaining
+
+
+def rebalance(credits: Dict[str, Any], shard_count: int) -> None:
+    """Spread the whole spendable total evenly over shard_count shards.
+
+    The legacy balance is folded into the shards and set to 0. Operation
+    records (legacy `ops` and those of every shard, including dropped ones)
+    are moved to the shard their key maps to, where sharded writers look for
+    them.
+
+    Args:
+        credits: Credits node to mutate in place
+        shard_count: Number of shards to spread over
+    """
+    total = credits_total(credits)
+    shards = _shards_as_dict(credits)
+    ops = credits.pop("ops", None)
+    ops = dict(ops) if isinstance(ops, dict) else {}
+    for node in shards.values():
+        node_ops = node.pop("ops", None)
+        if isinstance(node_ops, dict):
+            ops.update(node_ops)
+    base, extra = divmod(total, shard_count)
+    for index in range(shard_count):
+        node = shards.setdefault(str(index), {})
+        node["balance"] = base + (1 if index < extra else 0)
+    for key in list(shards):
+        if not key.isdigit() or int(key) >= shard_count:
+            del shards[key]
+    for key, entry in ops.items():
+        shards[str(shard_index(key, shard_count))].setdefault("ops", {})[key] = entry
+    credits["balance"] = 0
+    credits["shard_count"] = shard_count
+
@@ -5,19 +5,107 @@ This module provides the FirebaseAdmin class for managing user spaces, credit op
 and history tracking in Firebase Realtime Database using the Admin SDK.
 """
 
-import os
 import logging
-from typing import Any, Dict, Optional, List
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional, List, Tuple
 import uuid
 from datetime import datetime, timezone
 
-import firebase_admin
-from firebase_admin import auth as fb_auth, db
+from firebase_admin import auth as fb_auth
 
-from fb_core.real_time_database import FBRTDBMgr
+from fb_core.backends import AbortTransaction, InMemoryBackend
+from fb_core.cache import SingleFlight, TTLCache
+from fb_core.compaction import HISTORY_RETENTION_DAYS, LEDGER_RETENTION_DAYS, ArchiveSink, compact_user
+from fb_core.credit_lease import CreditLease, recover_expired_leases
+from fb_core.credit_shards import BALANCE_FIELDS, credits_total, debit, rebalance, shard_balance, shard_index
+from fb_core.idempotency import IDEMPOTENCY_RETENTION_SECONDS, find_operation, operation_key, record_operation
+from fb_core.metrics import instrument_flow, payload_size
+from fb_core.push_ids import generate_push_id, push_id_range
+from fb_core.real_time_database import FBRTDBMgr, WriteBatch
+from fb_core.resilience import RTDBUnavailableError
+from fb_core.run_progress import RUN_PROGRESS_MIN_INTERVAL, RunProgress
 
 logger = logging.getLogger(__name__)
 
+# (user_id, env_id) pairs whose credits/metadata spaces are known to exist, and
+# (user_id, env_id, 'output', run_id) keys of runs whose created_at is written
+KNOWN_SPACES_TTL = 3600.0
+# runs are remembered longer: forgetting one rewrites its created_at
+KNOWN_RUNS_TTL = 7 * 24 * 3600.0
+KNOWN_SPACES_MAX_SIZE = 100_000
+_known_spaces = TTLCache(maxsize=KNOWN_SPACES_MAX_SIZE, ttl=KNOWN_SPACES_TTL)
+
+
+def clear_known_spaces_cache() -> None:
+    """Forget which user spaces are known to exist, forcing a re-check."""
+    _known_spaces.clear()
+
+
+# normalized email / uid -> Firebase Auth user record (or _NOT_FOUND)
+IDENTITY_CACHE_TTL = 600.0
+IDENTITY_NEGATIVE_TTL = 30.0
+IDENTITY_CACHE_MAX_SIZE = 50_000
+_NOT_FOUND = object()
+_email_user_cache = TTLCache(maxsize=IDENTITY_CACHE_MAX_SIZE, ttl=IDENTITY_CACHE_TTL)
+_uid_user_cache = TTLCache(maxsize=IDENTITY_CACHE_MAX_SIZE, ttl=IDENTITY_CACHE_TTL)
+_auth_flights = SingleFlight()
+
+# (database, operation_id) -> applied credit operation, skips the round trip for local retries
+_seen_operations = TTLCache(maxsize=100_000, ttl=IDEMPOTENCY_RETENTION_SECONDS)
+
+# database path -> spendable credits, filled from credit operation results and
+# credits listeners; entries older than BALANCE_CACHE_MAX_AGE are re-read
+BALANCE_CACHE_MAX_AGE = 5.0
+BALANCE_CACHE_MAX_SIZE = 100_000
+_balance_cache = TTLCache(maxsize=BALANCE_CACHE_MAX_SIZE, ttl=BALANCE_CACHE_MAX_AGE)
+# database path -> (listener registration, mirror of the credits node)
+_balance_watches: Dict[str, Tuple[Any, InMemoryBackend]] = {}
+_balance_watches_lock = threading.Lock()
+
+# stream_output_files chunking; RTDB rejects single writes above 16 MB
+OUTPUT_CHUNK_BYTES = 256 * 1024
+OUTPUT_CHUNK_FILES = 1000
+OUTPUT_FILE_FIELDS = (
+    "name", "mime_type", "size_bytes", "firebase_path", "relative_path", "view_url", "download_url",
+)
+
+
+def configure_balance_cache(max_age: Optional[float] = None, max_size: Optional[int] = None) -> None:
+    """Change the staleness bound and/or size of the balance cache.
+    
+    Args:
+        max_age: Seconds a balance not kept live by a listener may be served
+        max_size: Maximum number of cached balances
+    """
+    if max_age is not None:
+        _balance_cache.ttl = max_age
+    if max_size is not None:
+        _balance_cache.maxsize = max_size
+
+
+def clear_balance_cache() -> None:
+    """Forget all cached balances (listeners refill theirs on the next event)."""
+    _balance_cache.clear()
+
+
+def balance_cache_stats() -> Dict[str, Any]:
+    """Return size, hit/miss counters and number of live listeners of the balance cache."""
+    stats = _balance_cache.stats()
+    stats["watched"] = len(_balance_watches)
+    return stats
+
+
+# fb_auth.get_users accepts at most 100 identifiers per call
+AUTH_LOOKUP_BATCH_SIZE = 100
+
+
+def _utc_iso(when: datetime) -> str:
+    """ISO timestamp in UTC, comparable with the stored event timestamps."""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc).isoformat()
+
 
 def _normalize_email(email: Optional[str]) -> Optional[str]:
     """Normalize an email address for case-insensitive comparison.
@@ -36,10 +124,77 @@ def _normalize_email(email: Optional[str]) -> Optional[str]:
     return normalized
 
 
+def _lookup_auth_user(kind: str, value: str) -> Optional[Any]:
+    """Fetch a Firebase Auth user record by uid or email through the identity cache.
+    
+    Concurrent lookups for the same key share one Auth call, and not-found
+    results are cached for IDENTITY_NEGATIVE_TTL seconds.
+    
+    Args:
+        kind: 'uid' or 'email' (already normalized)
+        value: The uid or email to look up
+        
+    Returns:
+        The UserRecord, or None if no such user exists
+        
+    Raises:
+        Exception: Auth errors other than not-found are propagated uncached
+    """
+    cache = _uid_user_cache if kind == "uid" else _email_user_cache
+    cached = cache.get(value)
+    if cached is not None:
+        return None if cached is _NOT_FOUND else cached
+
+    def _fetch():
+        try:
+            if kind == "uid":
+                user = fb_auth.get_user(value)
+            else:
+                user = fb_auth.get_user_by_email(value)
+        except fb_auth.UserNotFoundError:
+            cache.set(value, _NOT_FOUND, ttl=IDENTITY_NEGATIVE_TTL)
+            return None
+        _remember_auth_user(user)
+        return user
+
+    return _auth_flights.do((kind, value), _fetch)
+
+
+def _remember_auth_user(user: Any) -> None:
+    """Store a user record in the uid and email identity caches."""
+    _uid_user_cache.set(user.uid, user)
+    email_value = _normalize_email(getattr(user, "email", None))
+    if email_value:
+        _email_user_cache.set(email_value, user)
+
+
+def clear_identity_cache() -> None:
+    """Forget all cached email/uid -> user record resolutions."""
+    _email_user_cache.clear()
+    _uid_user_cache.clear()
+
+
+def _create_auth_user(email_value: str) -> Optional[str]:
+    try:
+        user = fb_auth.create_user(
+            email=email_value,
+            email_verified=False,
+        )
+    except fb_auth.EmailAlreadyExistsError:
+        # created concurrently elsewhere: drop the negative entry and look it up
+        _email_user_cache.pop(email_value)
+        user = _lookup_auth_user("email", email_value)
+        return user.uid if user is not None else None
+    _remember_auth_user(user)
+    logger.info("Created new user for email=%s uid=%s", email_value, user.uid)
+    return user.uid
+
+
 def _ensure_user_exists_in_auth(customer_email: Optional[str]) -> Optional[str]:
     """Ensure a user exists in Firebase Auth, creating one if necessary.
     
     Looks up user by email. If not found, creates a new user with that email.
+    Resolutions are served from the identity cache when possible.
     
     Args:
         customer_email: Email address of the user
@@ -54,25 +209,34 @@ def _ensure_user_exists_in_auth(customer_email: Optional[str]) -> Optional[str]:
 
     try:
         # Try to get existing user by email
-        user = fb_auth.get_user_by_email(email_value)
-        logger.info("Found existing user for email=%s uid=%s", email_value, user.uid)
-        return user.uid
-    except fb_auth.UserNotFoundError:
-        # User doesn't exist, create one
-        try:
-            user = fb_auth.create_user(
-                email=email_value,
-                email_verified=False,
-            )
-            logger.info("Created new user for email=%s uid=%s", email_value, user.uid)
+        user = _lookup_auth_user("email", email_value)
+        if user is not None:
+            logger.debug("Found existing user for email=%s uid=%s", email_value, user.uid)
             return user.uid
-        except Exception as create_error:
-            logger.warning("Failed to create user for email=%s error=%s", email_value, create_error)
-            return None
     except Exception as error:
         logger.warning("Failed to get/create user for email=%s error=%s", email_value, error)
         return None
 
+    # User doesn't exist, create one (once, even under concurrent requests)
+    try:
+        return _auth_flights.do(("create", email_value), lambda: _create_auth_user(email_value))
+    except Exception as create_error:
+        logger.warning("Failed to create user for email=%s error=%s", email_value, create_error)
+        return None
+
+
+def _as_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _output_file_record(file_item: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored fields of an output file (file_master dict); missing fields are omitted."""
+    record = {field: file_item.get(field) for field in OUTPUT_FILE_FIELDS}
+    return {field: value for field, value in record.items() if value is not None}
+
 
 class FirebaseAdmin:
     """
@@ -85,24 +249,38 @@ class FirebaseAdmin:
     - Atomic credit operations
     """
 
-    def __init__(self, user_id: str, env_id: str = "default"):
+    def __init__(
+        self,
+        user_id: str,
+        env_id: str = "default",
+        db_manager: Optional[FBRTDBMgr] = None,
+        credit_shards: Optional[int] = None,
+    ):
         """Initialize FirebaseAdmin for a specific user.
         
         Args:
             user_id: The user identifier (UID or email)
             env_id: Environment identifier (default, staging, etc.)
+            db_manager: Optional database manager to use, e.g. one backed by
+                InMemoryBackend; defaults to an admin SDK backed manager
+            credit_shards: Number of credit sub-counters to write to; None keeps
+                the single-balance layout (see migrate_credits_to_shards)
         """
         self.user_id = user_id
         self.env_id = env_id
         self.database = f"users/{self.user_id}/env/{self.env_id}"
+        self.credit_shards = credit_shards
         
         # Initialize database manager
-        try:
-            firebase_admin.get_app()
-            self.db_manager = FBRTDBMgr()
-        except ValueError as e:
-            logger.warning("Firebase not initialized: %s", e)
-            self.db_manager = None
+        if db_manager is not None:
+            self.db_manager = db_manager
+        else:
+            # FBRTDBMgr resolves the app itself, no separate get_app() probe
+            db_manager = FBRTDBMgr()
+            if db_manager.app is None:
+                logger.warning("Firebase not initialized")
+                db_manager = None
+            self.db_manager = db_manager
 
     def create_user_from_google_claims(self, claims: Dict[str, Any]) -> Dict[str, Any]:
         """Create or fetch user from Google authentication claims.
@@ -123,8 +301,8 @@ class FirebaseAdmin:
         try:
             # Try to find existing user by UID
             if candidate_uid:
-                try:
-                    user = fb_auth.get_user(candidate_uid)
+                user = _lookup_auth_user("uid", candidate_uid)
+                if user is not None:
                     return {
                         "created": False,
                         "lookup": "uid",
@@ -135,13 +313,11 @@ class FirebaseAdmin:
                         "disabled": user.disabled,
                         "firebase_synced": True,
                     }
-                except fb_auth.UserNotFoundError:
-                    pass
             
             # Try to find by email
             if candidate_email:
-                try:
-                    user = fb_auth.get_user_by_email(candidate_email)
+                user = _lookup_auth_user("email", candidate_email)
+                if user is not None:
                     return {
                         "created": False,
                         "lookup": "email",
@@ -152,8 +328,6 @@ class FirebaseAdmin:
                         "disabled": user.disabled,
                         "firebase_synced": True,
                     }
-                except fb_auth.UserNotFoundError:
-                    pass
             
             # Create new user with email
             if candidate_email:
@@ -163,6 +337,7 @@ class FirebaseAdmin:
                     photo_url=claims.get("picture") or claims.get("photoUrl"),
                     email_verified=bool(claims.get("email_verified")),
                 )
+                _remember_auth_user(user)
                 logger.info("Created user from Google claims: uid=%s email=%s", user.uid, user.email)
                 return {
                     "created": True,
@@ -196,36 +371,157 @@ class FirebaseAdmin:
             "firebase_synced": False,
         }
 
-    def ensure_user_spaces(self) -> bool:
+    def ensure_users_bulk(
+        self,
+        emails: Iterable[str],
+        chunk_size: int = AUTH_LOOKUP_BATCH_SIZE,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Ensure Auth users and RTDB user spaces exist for many emails at once.
+        
+        Emails are resolved with fb_auth.get_users in chunks (at most 100
+        identifiers per call), misses are created with one fb_auth.import_users
+        call per chunk, and the user spaces of each chunk are written with a
+        single multi-path update in this admin's environment.
+        
+        Args:
+            emails: Email addresses to provision
+            chunk_size: Emails per chunk (capped at 100, the Auth batch limit)
+            
+        Returns:
+            Report keyed by normalized email (or the raw value if invalid) with
+            uid, created and, on failure, error
+        """
+        chunk_size = max(1, min(chunk_size, AUTH_LOOKUP_BATCH_SIZE))
+        report: Dict[str, Dict[str, Any]] = {}
+        pending: List[str] = []
+        for raw_email in emails:
+            email_value = _normalize_email(raw_email)
+            if not email_value:
+                report[str(raw_email)] = {"uid": None, "created": False, "error": "invalid email"}
+            elif email_value not in report:
+                report[email_value] = {"uid": None, "created": False}
+                pending.append(email_value)
+        
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            try:
+                self._ensure_users_chunk(chunk, report)
+            except Exception as error:
+                logger.warning("Bulk provisioning failed for %d emails: %s", len(chunk), error)
+                for email_value in chunk:
+                    report[email_value].setdefault("error", str(error))
+        
+        logger.info(
+            "Bulk provisioning env_id=%s emails=%d created=%d failed=%d",
+            self.env_id,
+            len(report),
+            sum(1 for entry in report.values() if entry.get("created")),
+            sum(1 for entry in report.values() if entry.get("error")),
+        )
+        return report
+
+    def _ensure_users_chunk(self, chunk: List[str], report: Dict[str, Dict[str, Any]]) -> None:
+        """Provision one chunk of normalized emails, filling in report."""
+        existing: Dict[str, Any] = {}
+        to_lookup = []
+        for email_value in chunk:
+            cached = _email_user_cache.get(email_value)
+            if cached is not None and cached is not _NOT_FOUND:
+                existing[email_value] = cached
+            else:
+                to_lookup.append(email_value)
+        
+        if to_lookup:
+            result = fb_auth.get_users([fb_auth.EmailIdentifier(email_value) for email_value in to_lookup])
+            for user in result.users:
+                _remember_auth_user(user)
+                existing[_normalize_email(user.email)] = user
+        
+        created: Dict[str, str] = {}
+        missing = [email_value for email_value in chunk if email_value not in existing]
+        if missing:
+            records = [
+                fb_auth.ImportUserRecord(uid=uuid.uuid4().hex, email=email_value, email_verified=False)
+                for email_value in missing
+            ]
+            import_result = fb_auth.import_users(records)
+            failed = {error.index: error.reason for error in import_result.errors}
+            for index, record in enumerate(records):
+                if index in failed:
+                    report[record.email]["error"] = failed[index]
+                    continue
+                created[record.email] = record.uid
+                _uid_user_cache.pop(record.uid)
+                _email_user_cache.pop(record.email)
+        
+        if self.db_manager is None:
+            return
+        
+        batch = self.db_manager.batch()
+        for email_value, user in existing.items():
+            report[email_value]["uid"] = user.uid
+            admin = FirebaseAdmin(user.uid, env_id=self.env_id, db_manager=self.db_manager)
+            admin.ensure_user_spaces(batch=batch)
+        for email_value, uid in created.items():
+            report[email_value].update({"uid": uid, "created": True})
+            # brand new users have no spaces yet, no need to read first
+            FirebaseAdmin(uid, env_id=self.env_id, db_manager=self.db_manager)._create_missing_spaces({}, batch)
+        if not batch.commit():
+            for email_value in chunk:
+                report[email_value].setdefault("error", "failed to write user spaces")
+
+    def _write(
+        self,
+        path: str,
+        data: Any,
+        batch: Optional[WriteBatch] = None,
+        deferrable: bool = False,
+    ) -> bool:
+        """Write data at path, or stage it in batch when one is given.
+        
+        Dict payloads are merged like FBRTDBMgr.set_data does. Deferrable
+        writes (never read back on the request path) go to the manager's
+        write-behind queue when one is enabled.
+        """
+        if batch is None:
+            if deferrable and self.db_manager.write_queue is not None:
+                return self.db_manager.write_queue.enqueue(path, data)
+            return self.db_manager.set_data(path, data)
+        if isinstance(data, dict) and data:
+            batch.update(path, data)
+        else:
+            batch.set(path, data)
+        return True
+
+    def ensure_user_spaces(self, batch: Optional[WriteBatch] = None) -> bool:
         """Ensure all standard user spaces exist in RTDB.
         
-        Creates metadata for credits, usage tracking, output, etc.
+        Creates metadata for credits, usage tracking, output, etc. Users whose
+        spaces are known to exist are served from a per-process cache without
+        any round trip.
         
+        Args:
+            batch: Optional write batch to stage the initial nodes in
+            
         Returns:
             True if successful or already exists, False on error
         """
         if self.db_manager is None:
             return False
         
+        space_key = (self.user_id, self.env_id)
+        if _known_spaces.get(space_key):
+            return True
+        
         try:
-            # Initialize credits at 0 if not present
-            credits_path = f"{self.database}/credits"
-            existing_credits = self.db_manager.get_data(credits_path)
-            if existing_credits is None:
-                self.db_manager.set_data(credits_path, {
-                    "balance": 0,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat(),
-                })
-            
-            # Initialize metadata
-            metadata_path = f"{self.database}/metadata"
-            existing_meta = self.db_manager.get_data(metadata_path)
-            if existing_meta is None:
-                self.db_manager.set_data(metadata_path, {
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "updated_at": datetime.now(timezone.utc).isoformat(),
-                })
+            # one shallow read of the env root tells which spaces exist
+            result = self.db_manager.read(self.database, shallow=True)
+            if not result.available:
+                # never initialize spaces over data we could not see
+                logger.warning("Failed to ensure user spaces for %s: %s", self.user_id, result.error)
+                return False
+            existing = result.value if isinstance(result.value, dict) else {}
+            self._create_missing_spaces(existing, batch)
             
             logger.info("User spaces ensured for user_id=%s", self.user_id)
             return True
@@ -233,58 +529,264 @@ class FirebaseAdmin:
             logger.warning("Failed to ensure user spaces for %s: %s", self.user_id, error)
             return False
 
-    def get_credits(self) -> int:
+    def _create_missing_spaces(self, existing: Dict[str, Any], batch: Optional[WriteBatch] = None) -> bool:
+        """Write the initial credits/metadata nodes that are not in existing.
+        
+        Args:
+            existing: Shallow view of the env root (child name -> anything)
+            batch: Optional write batch to stage the nodes in
+            
+        Returns:
+            True if all writes succeeded (or were staged)
+        """
+        space_key = (self.user_id, self.env_id)
+        written = True
+        
+        # Initialize credits at 0 if not present
+        if "credits" not in existing:
+            written &= self._write(f"{self.database}/credits", {
+                "balance": 0,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }, batch)
+        
+        # Initialize metadata
+        if "metadata" not in existing:
+            written &= self._write(f"{self.database}/metadata", {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }, batch)
+        
+        # spaces are never removed once created, remember them
+        if batch is not None:
+            batch.on_commit(lambda: _known_spaces.set(space_key, True))
+        elif written:
+            _known_spaces.set(space_key, True)
+        return written
+
+    def get_credits(self, use_cache: bool = True, strict: bool = False) -> int:
         """Get current credit balance for user.
         
+        Served from the balance cache when possible: entries come from credit
+        operation results (at most BALANCE_CACHE_MAX_AGE old) or from a
+        credits listener started with watch_credits().
+        
+        Args:
+            use_cache: If False, always read the balance from the database
+            strict: If True, raise instead of returning 0 when RTDB is unavailable
+            
         Returns:
-            Credit balance, or 0 if not found/error
+            Credit balance, or 0 if not found (or unavailable, unless strict)
+            
+        Raises:
+            RTDBUnavailableError: If strict and the balance could not be read
         """
         if self.db_manager is None:
+            if strict:
+                raise RTDBUnavailableError("Database manager not available")
             return 0
         
-        try:
-            credits_path = f"{self.database}/credits"
-            data = self.db_manager.get_data(credits_path)
-            if isinstance(data, dict):
-                return int(data.get("balance") or 0)
-            return 0
-        except Exception as error:
-            logger.warning("Failed to get credits for %s: %s", self.user_id, error)
+        if use_cache:
+            cached = _balance_cache.get(self.database)
+            if cached is not None:
+                return cached
+        
+        credits_path = f"{self.database}/credits"
+        # only the counters; the node also holds idempotency records and leases
+        result = self.db_manager.read(credits_path, fields=BALANCE_FIELDS)
+        if not result.available:
+            if strict:
+                raise RTDBUnavailableError(f"credits of {self.user_id} unavailable: {result.error}")
+            logger.warning("Failed to get credits for %s: %s", self.user_id, result.error)
             return 0
+        # legacy balance plus any credit shards
+        balance = credits_total(result.value)
+        self._cache_balance(balance)
+        return balance
+
+    def _cache_balance(self, balance: Optional[int]) -> None:
+        """Remember a balance computed by a committed write (no-op while a listener is live)."""
+        if balance is None or self.database in _balance_watches:
+            return
+        _balance_cache.set(self.database, balance)
+
+    def _forget_balance(self) -> None:
+        """Drop the cached balance after a write whose resulting total is unknown."""
+        if self.database not in _balance_watches:
+            _balance_cache.pop(self.database)
+
+    def watch_credits(self) -> bool:
+        """Keep this user's cached balance live with an RTDB listener.
+        
+        The listener mirrors the credits node, so every change (from any
+        process) refreshes the cache and the balance never expires until
+        unwatch_credits() is called.
+        
+        Returns:
+            True if the listener is running
+        """
+        if self.db_manager is None:
+            return False
+        with _balance_watches_lock:
+            if self.database in _balance_watches:
+                return True
+            database = self.database
+            mirror = InMemoryBackend()
+            
+            def _on_credits_event(event):
+                if event.event_type == "patch" and isinstance(event.data, dict):
+                    mirror.update(event.path, event.data)
+                else:
+                    mirror.set(event.path, event.data)
+                # live entries do not expire, the listener keeps them current
+                _balance_cache.set(database, credits_total(mirror.get("/")), ttl=float("inf"))
+            
+            registration = self.db_manager.listen(f"{database}/credits", _on_credits_event)
+            if registration is None:
+                return False
+            _balance_watches[database] = (registration, mirror)
+        logger.info("Watching credits user_id=%s", self.user_id)
+        return True
+
+    def unwatch_credits(self) -> None:
+        """Stop the credits listener started by watch_credits()."""
+        with _balance_watches_lock:
+            watch = _balance_watches.pop(self.database, None)
+            _balance_cache.pop(self.database)
+        if watch is not None:
+            watch[0].close()
+
+    def _duplicate_operation(self, operation_id: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the result for an already applied credit operation and remember it."""
+        _seen_operations.set((self.database, operation_id), entry)
+        new_balance = entry.get("new_balance")
+        result = {
+            "transaction_id": operation_id,
+            "new_balance": new_balance if new_balance is not None else self.get_credits(),
+            "duplicate": True,
+        }
+        if entry.get("type") == "deduct_credits":
+            result["deducted"] = int(entry.get("amount") or 0)
+        logger.info(
+            "Duplicate credit operation ignored user_id=%s type=%s op_id=%s",
+            self.user_id,
+            entry.get("type"),
+            operation_id,
+        )
+        return result
+
+    def _recorded_operation(self, operation_id: str) -> Optional[Dict[str, Any]]:
+        """Look up an operation in the ledger, for retries older than its inline record.
+        
+        Returns:
+            The ledger entry, or None if the operation was not recorded or the
+            ledger could not be read (the inline record is still checked)
+        """
+        result = self.db_manager.read(f"{self.database}/ledger/{operation_id}")
+        if not result.available:
+            logger.warning(
+                "Ledger lookup failed user_id=%s op_id=%s error=%s",
+                self.user_id,
+                operation_id,
+                result.error,
+            )
+            return None
+        return result.value if isinstance(result.value, dict) else None
+
+    def _operation_failed(self, txn_type: str, operation_id: str) -> RTDBUnavailableError:
+        """Error for a credit transaction that neither committed nor aborted on purpose."""
+        logger.warning(
+            "Credit operation not applied user_id=%s type=%s op_id=%s",
+            self.user_id,
+            txn_type,
+            operation_id,
+        )
+        return RTDBUnavailableError(f"{txn_type} {operation_id} of {self.user_id} not applied: RTDB unavailable")
 
-    def add_credits_atomic(self, credits: int, operation_id: str) -> Dict[str, Any]:
+    @instrument_flow("add_credits")
+    def add_credits_atomic(
+        self,
+        credits: int,
+        operation_id: str,
+        batch: Optional[WriteBatch] = None,
+        check_ledger: bool = False,
+    ) -> Dict[str, Any]:
         """Atomically add credits to user account.
         
+        The operation id is recorded inside the same transaction, so a retried
+        operation is not applied twice; it returns the original result with
+        duplicate=True and writes no ledger entry.
+        
         Args:
             credits: Number of credits to add
             operation_id: Unique operation identifier for idempotency
+            batch: Optional write batch to stage the ledger entry in
+            check_ledger: Also look the operation up in the ledger first, for
+                retries that may arrive after its inline record was pruned
+                (one extra read)
             
         Returns:
             Result dict with new_balance and transaction_id
+            
+        Raises:
+            RTDBUnavailableError: If the transaction could not be committed; the
+                operation is not recorded, so it can be retried with the same id
         """
         if self.db_manager is None:
             raise ValueError("Database manager not available")
         
+        seen = _seen_operations.get((self.database, operation_id))
+        if seen is not None:
+            return self._duplicate_operation(operation_id, seen)
+        
+        recorded = self._recorded_operation(operation_id) if check_ledger else None
+        if recorded is not None:
+            return self._duplicate_operation(operation_id, recorded)
+        
         result = {"transaction_id": operation_id, "new_balance": 0}
+        op_key = operation_key(operation_id)
         
-        def _add_credits_txn(current):
-            if not isinstance(current, dict):
-                current = {"balance": 0}
-            
-            current_balance = int(current.get("balance") or 0)
-            new_balance = current_balance + credits
-            
-            current["balance"] = new_balance
-            current["updated_at"] = datetime.now(timezone.utc).isoformat()
-            result["new_balance"] = new_balance
+        if self.credit_shards:
+            self._add_to_shard(credits, operation_id, result)
+        else:
+            def _add_credits_txn(current):
+                if not isinstance(current, dict):
+                    current = {"balance": 0}
+                
+                applied = find_operation(current, op_key)
+                if applied is not None:
+                    result["applied"] = applied
+                    raise AbortTransaction()
+                
+                current_balance = int(current.get("balance") or 0)
+                
+                current["balance"] = current_balance + credits
+                current["updated_at"] = datetime.now(timezone.utc).isoformat()
+                result["new_balance"] = credits_total(current)
+                record_operation(current, op_key, {
+                    "type": "add_credits",
+                    "amount": credits,
+                    "new_balance": result["new_balance"],
+                })
+                
+                return current
             
-            return current
+            credits_path = f"{self.database}/credits"
+            committed = self.db_manager.transact(path=credits_path, update_fn=_add_credits_txn)
+            if not committed and "applied" not in result:
+                raise self._operation_failed("add_credits", operation_id)
         
-        credits_path = f"{self.database}/credits"
-        self.db_manager.transact(path=credits_path, update_fn=_add_credits_txn)
+        if "applied" in result:
+            return self._duplicate_operation(operation_id, result["applied"])
+        self._cache_balance(result.get("new_balance"))
+        _seen_operations.set((self.database, operation_id), {
+            "type": "add_credits",
+            "amount": credits,
+            "new_balance": result.get("new_balance"),
+        })
         
         # Record transaction
-        self._record_transaction("add_credits", credits, operation_id, result.get("new_balance", 0))
+        self._record_transaction("add_credits", credits, operation_id, result.get("new_balance"), batch=batch)
         
         logger.info(
             "Credits added user_id=%s credits=%s new_balance=%s op_id=%s",
@@ -296,61 +798,116 @@ class FirebaseAdmin:
         
         return result
 
+    @instrument_flow("deduct_credits")
     def deduct_credits_atomic(
         self,
         credits: int,
         operation_id: str,
         require_full_amount: bool = True,
+        batch: Optional[WriteBatch] = None,
+        check_ledger: bool = False,
     ) -> Dict[str, Any]:
         """Atomically deduct credits from user account.
         
+        Retried operations are detected inside the transaction and return the
+        original result with duplicate=True (see add_credits_atomic).
+        
         Args:
             credits: Number of credits to deduct
             operation_id: Unique operation identifier for idempotency
             require_full_amount: If True, fail if insufficient balance
+            batch: Optional write batch to stage the ledger entry in
+            check_ledger: Also look the operation up in the ledger first
             
         Returns:
             Result dict with new_balance and transaction_id
             
         Raises:
             ValueError: If insufficient credits and require_full_amount=True
+            RTDBUnavailableError: If the transaction could not be committed; the
+                operation is not recorded, so it can be retried with the same id
         """
         if self.db_manager is None:
             raise ValueError("Database manager not available")
         
+        seen = _seen_operations.get((self.database, operation_id))
+        if seen is not None:
+            return self._duplicate_operation(operation_id, seen)
+        
+        recorded = self._recorded_operation(operation_id) if check_ledger else None
+        if recorded is not None:
+            return self._duplicate_operation(operation_id, recorded)
+        
         result = {"transaction_id": operation_id, "new_balance": 0, "deducted": 0}
+        op_key = operation_key(operation_id)
         
-        def _deduct_credits_txn(current):
-            if not isinstance(current, dict):
-                current = {"balance": 0}
-            
-            current_balance = int(current.get("balance") or 0)
-            
-            if current_balance < credits:
-                if require_full_amount:
-                    result["error"] = "insufficient credits"
-                    return current
-                # Deduct whatever is available
-                deduct_amount = current_balance
-            else:
-                deduct_amount = credits
-            
-            new_balance = current_balance - deduct_amount
-            current["balance"] = new_balance
-            current["updated_at"] = datetime.now(timezone.utc).isoformat()
-            result["new_balance"] = new_balance
-            result["deducted"] = deduct_amount
+        # sharded layout: try the operation's shard first, it only contends with its own writers
+        if not (self.credit_shards and self._deduct_from_shard(credits, operation_id, result)):
+            def _deduct_credits_txn(current):
+                if not isinstance(current, dict):
+                    current = {"balance": 0}
+                
+                applied = find_operation(current, op_key)
+                if applied is not None:
+                    result["applied"] = applied
+                    raise AbortTransaction()
+                
+                # spendable total spans the legacy balance and all shards
+                current_balance = credits_total(current)
+                
+                if current_balance < credits:
+                    if require_full_amount:
+                        result["error"] = "insufficient credits"
+                        raise AbortTransaction()
+                    # Deduct whatever is available
+                    deduct_amount = current_balance
+                else:
+                    deduct_amount = credits
+                
+                debit(current, deduct_amount)
+                op_node = current
+                if self.credit_shards:
+                    # a shard ran dry: spread what is left so the next deductions hit funded shards
+                    rebalance(current, self.credit_shards)
+                    op_node = current["shards"][str(shard_index(op_key, self.credit_shards))]
+                current["updated_at"] = datetime.now(timezone.utc).isoformat()
+                result["new_balance"] = current_balance - deduct_amount
+                result["deducted"] = deduct_amount
+                result.pop("error", None)
+                record_operation(op_node, op_key, {
+                    "type": "deduct_credits",
+                    "amount": deduct_amount,
+                    "new_balance": result["new_balance"],
+                })
+                
+                return current
             
-            return current
+            credits_path = f"{self.database}/credits"
+            committed = self.db_manager.transact(path=credits_path, update_fn=_deduct_credits_txn)
+            if not committed and "applied" not in result and "error" not in result:
+                raise self._operation_failed("deduct_credits", operation_id)
         
-        credits_path = f"{self.database}/credits"
-        self.db_manager.transact(path=credits_path, update_fn=_deduct_credits_txn)
+        if "applied" in result:
+            return self._duplicate_operation(operation_id, result["applied"])
         
         if result.get("error") == "insufficient credits":
             raise ValueError(f"insufficient credits: required {credits}, available {self.get_credits()}")
         
+        self._cache_balance(result.get("new_balance"))
+        _seen_operations.set((self.database, operation_id), {
+            "type": "deduct_credits",
+            "amount": result.get("deducted", 0),
+            "new_balance": result.get("new_balance"),
+        })
+        
         # Record transaction
-        self._record_transaction("deduct_credits", result.get("deducted", 0), operation_id, result.get("new_balance", 0))
+        self._record_transaction(
+            "deduct_credits",
+            result.get("deducted", 0),
+            operation_id,
+            result.get("new_balance"),
+            batch=batch,
+        )
         
         logger.info(
             "Credits deducted user_id=%s credits=%s new_balance=%s op_id=%s",
@@ -362,12 +919,192 @@ class FirebaseAdmin:
         
         return result
 
+    def _add_to_shard(self, credits: int, operation_id: str, result: Dict[str, Any]) -> bool:
+        """Add credits to the operation's shard; fills result with shard and new_balance."""
+        op_key = operation_key(operation_id)
+        index = shard_index(op_key, self.credit_shards)
+        
+        def _add_shard_txn(current):
+            if not isinstance(current, dict):
+                current = {"balance": 0}
+            applied = find_operation(current, op_key)
+            if applied is not None:
+                result["applied"] = applied
+                raise AbortTransaction()
+            current["balance"] = shard_balance(current) + credits
+            current["updated_at"] = datetime.now(timezone.utc).isoformat()
+            record_operation(current, op_key, {"type": "add_credits", "amount": credits})
+            return current
+        
+        committed = self.db_manager.transact(f"{self.database}/credits/shards/{index}", _add_shard_txn)
+        if not committed:
+            if "applied" in result:
+                return False
+            raise self._operation_failed("add_credits", operation_id)
+        result["shard"] = index
+        result["new_balance"] = self._committed_total()
+        return True
+
+    def _deduct_from_shard(self, credits: int, operation_id: str, result: Dict[str, Any]) -> bool:
+        """Deduct credits from the operation's shard.
+        
+        Returns:
+            True if the shard covered the full amount (or the operation was
+            already applied), False if it ran dry
+            
+        Raises:
+            RTDBUnavailableError: If the transaction failed without reaching the shard
+        """
+        op_key = operation_key(operation_id)
+        index = shard_index(op_key, self.credit_shards)
+        
+        def _deduct_shard_txn(current):
+            applied = find_operation(current, op_key)
+            if applied is not None:
+                result["applied"] = applied
+                raise AbortTransaction()
+            balance = shard_balance(current)
+            if balance < credits:
+                result["shard_dry"] = True
+                raise AbortTransaction()
+            current["balance"] = balance - credits
+            current["updated_at"] = datetime.now(timezone.utc).isoformat()
+            record_operation(current, op_key, {"type": "deduct_credits", "amount": credits})
+            return current
+        
+        if not self.db_manager.transact(f"{self.database}/credits/shards/{index}", _deduct_shard_txn):
+            if "applied" in result:
+                return True
+            if result.pop("shard_dry", False):
+                return False
+            raise self._operation_failed("deduct_credits", operation_id)
+        result["shard"] = index
+        result["deducted"] = credits
+        result["new_balance"] = self._committed_total()
+        return True
+
+    def _committed_total(self) -> Optional[int]:
+        """Read the spendable total after a committed shard write.
+        
+        The total spans all shards, so it is read instead of locking them all.
+        
+        Returns:
+            The total, or None if it could not be read (the write still stands)
+        """
+        try:
+            return self.get_credits(use_cache=False, strict=True)
+        except RTDBUnavailableError as error:
+            logger.warning("Failed to read credits of %s after a shard write: %s", self.user_id, error)
+            self._forget_balance()
+            return None
+
+    def migrate_credits_to_shards(self, shard_count: int) -> int:
+        """Move the single-balance credits layout to shard_count sub-counters.
+        
+        The legacy balance (and any existing shards) is spread evenly over the
+        new shards in one transaction, and operation records move to the shard
+        each operation maps to, so retries of pre-migration operations are still
+        detected; afterwards this admin writes sharded.
+        
+        Args:
+            shard_count: Number of shards
+            
+        Returns:
+            The spendable total after migration
+        """
+        if self.db_manager is None:
+            raise ValueError("Database manager not available")
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        totals = {"balance": 0}
+        
+        def _migrate_txn(current):
+            if not isinstance(current, dict):
+                current = {"balance": 0}
+            rebalance(current, shard_count)
+            current["updated_at"] = datetime.now(timezone.utc).isoformat()
+            totals["balance"] = credits_total(current)
+            return current
+        
+        if not self.db_manager.transact(f"{self.database}/credits", _migrate_txn):
+            raise ValueError(f"failed to migrate credits of {self.user_id} to shards")
+        self.credit_shards = shard_count
+        self._cache_balance(totals["balance"])
+        logger.info(
+            "Credits migrated to shards user_id=%s shards=%s balance=%s",
+            self.user_id,
+            shard_count,
+            totals["balance"],
+        )
+        return totals["balance"]
+
+    def reserve_credits(self, block_size: int, ttl_seconds: float = 60.0) -> CreditLease:
+        """Open a local credit lease for high-frequency deductions.
+        
+        The lease reserves `block_size` credits per round trip and serves
+        deductions from memory; consumption is settled with one transaction and
+        one aggregated ledger entry on flush, expiry, close or process exit.
+        
+        Args:
+            block_size: Credits reserved per round trip
+            ttl_seconds: Reservation lifetime before it is settled and renewed
+            
+        Returns:
+            A CreditLease (usable as a context manager)
+        """
+        if self.db_manager is None:
+            raise ValueError("Database manager not available")
+        return CreditLease(self, block_size, ttl_seconds=ttl_seconds)
+
+    def recover_expired_leases(self) -> int:
+        """Return credits held by expired reservations to the balance.
+        
+        Returns:
+            Number of credits returned
+        
+        Raises:
+            RTDBUnavailableError: If the credits could not be updated
+        """
+        if self.db_manager is None:
+            return 0
+        recovered = recover_expired_leases(self)
+        if recovered:
+            self._forget_balance()
+        return recovered
+
+    def compact(
+        self,
+        sink: Optional[ArchiveSink] = None,
+        history_retention_days: float = HISTORY_RETENTION_DAYS,
+        ledger_retention_days: float = LEDGER_RETENTION_DAYS,
+        max_items: Optional[int] = None,
+    ) -> Dict[str, int]:
+        """Compact old ledger entries into checkpoints and archive old history.
+        
+        Args:
+            sink: Archive sink (e.g. LocalFileSink); history is only archived with one
+            history_retention_days: History younger than this stays in RTDB
+            ledger_retention_days: Ledger entries younger than this stay in RTDB
+            max_items: Per-subtree budget for this run; the next run continues
+            
+        Returns:
+            Dict with the number of ledger and history items compacted
+        """
+        return compact_user(
+            self,
+            sink=sink,
+            history_retention_days=history_retention_days,
+            ledger_retention_days=ledger_retention_days,
+            max_items=max_items,
+        )
+
     def record_history_event(
         self,
         action: str,
         status: str = "ok",
         details: Optional[Dict[str, Any]] = None,
         request_id: Optional[str] = None,
+        batch: Optional[WriteBatch] = None,
     ) -> bool:
         """Record a user action in history.
         
@@ -376,6 +1113,7 @@ class FirebaseAdmin:
             status: Status of action ('ok', 'error', etc.)
             details: Additional details dict
             request_id: Optional request ID for tracking
+            batch: Optional write batch to stage the event in
             
         Returns:
             True if recorded successfully
@@ -385,7 +1123,8 @@ class FirebaseAdmin:
         
         try:
             history_path = f"{self.database}/history"
-            event_id = str(uuid.uuid4())
+            # time-sortable, so history can be paged by key (see iter_history)
+            event_id = generate_push_id()
             
             event_data = {
                 "event_id": event_id,
@@ -401,7 +1140,7 @@ class FirebaseAdmin:
                 event_data["request_id"] = request_id
             
             path = f"{history_path}/{event_id}"
-            self.db_manager.set_data(path, event_data)
+            self._write(path, event_data, batch, deferrable=True)
             
             logger.debug(
                 "History event recorded user_id=%s action=%s status=%s",
@@ -414,6 +1153,107 @@ class FirebaseAdmin:
             logger.warning("Failed to record history for %s: %s", self.user_id, error)
             return False
 
+    def iter_history(
+        self,
+        since: Optional[datetime] = None,
+        action: Optional[str] = None,
+        page_size: int = 500,
+        until: Optional[datetime] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Stream history events oldest first, one page per query.
+        
+        Events are keyed by push IDs, so the time window becomes a key range
+        and only the pages inside it are read. Legacy events keyed by uuid4
+        sort after all push IDs; they are filtered by their timestamp and only
+        reached when `until` is open.
+        
+        Args:
+            since: Only events recorded at or after this time
+            action: Only events with this action name
+            page_size: Events fetched per query
+            until: Only events recorded at or before this time
+            
+        Yields:
+            Event dicts (each includes event_id)
+        """
+        since_iso = _utc_iso(since) if since is not None else None
+        for event_id, event in self.iter_time_range("history", since, until, page_size=page_size):
+            if not isinstance(event, dict):
+                continue
+            if action is not None and event.get("action") != action:
+                continue
+            if since_iso is not None and str(event.get("timestamp") or "") < since_iso:
+                continue
+            event.setdefault("event_id", event_id)
+            yield event
+
+    def iter_time_range(
+        self,
+        subtree: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        page_size: int = 500,
+    ) -> Iterator[Tuple[str, Any]]:
+        """Stream push-ID keyed children created within a time window.
+        
+        Args:
+            subtree: Node below the user's env, e.g. 'history' or 'output/{run_id}/files'
+            start: Window start (inclusive); open if None
+            end: Window end (inclusive); open if None
+            page_size: Children fetched per query
+            
+        Yields:
+            (key, value) pairs in creation order
+        """
+        if self.db_manager is None:
+            return
+        start_at, end_at = push_id_range(start, end)
+        yield from self.db_manager.iter_children(
+            f"{self.database}/{subtree}", start_at=start_at, end_at=end_at, page_size=page_size
+        )
+
+    def iter_ledger(
+        self,
+        since: Optional[datetime] = None,
+        txn_type: Optional[str] = None,
+        page_size: int = 500,
+    ) -> Iterator[Dict[str, Any]]:
+        """Stream ledger entries oldest first, one page per query.
+        
+        Ledger entries are keyed by operation id, so they are ordered by their
+        timestamp child; add `".indexOn": ["timestamp"]` to the ledger rules
+        so the query is served from an index.
+        
+        Args:
+            since: Only entries recorded at or after this time
+            txn_type: Only entries of this type ('add_credits', 'deduct_credits')
+            page_size: Entries fetched per query
+            
+        Yields:
+            Ledger entry dicts
+        """
+        if self.db_manager is None:
+            return
+        start_at = _utc_iso(since) if since is not None else None
+        for _, entry in self.db_manager.iter_children(
+            f"{self.database}/ledger", order_by="timestamp", start_at=start_at, page_size=page_size
+        ):
+            if not isinstance(entry, dict):
+                continue
+            if txn_type is not None and entry.get("type") != txn_type:
+                continue
+            yield entry
+
+    def list_runs(self) -> List[str]:
+        """List the run ids with an output space, without downloading the runs.
+
+        Returns:
+            Run ids in key order (push ids, so oldest first); empty on error
+        """
+        if self.db_manager is None:
+            return []
+        return self.db_manager.list_keys(f"{self.database}/output")
+
     def ensure_output_space(
         self,
         run_id: str,
@@ -422,6 +1262,11 @@ class FirebaseAdmin:
     ) -> str:
         """Ensure output space exists for a run and update metadata.
         
+        Only run_id, status, updated_at and meta are written. created_at
+        (server time) goes out with the first update of the run in this
+        process, without reading the node first; later calls keep it. For
+        frequent status or progress updates use open_run().
+        
         Args:
             run_id: Run identifier
             meta: Metadata dict for the run
@@ -434,20 +1279,27 @@ class FirebaseAdmin:
             return run_id
         
         try:
-            cleaned_run_id = str(run_id or "").strip() or str(uuid.uuid4())
+            cleaned_run_id = str(run_id or "").strip() or generate_push_id()
             output_path = f"{self.database}/output/{cleaned_run_id}"
             
+            now = datetime.now(timezone.utc).isoformat()
             run_data = {
                 "run_id": cleaned_run_id,
                 "status": status,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "updated_at": now,
             }
             
             if meta and isinstance(meta, dict):
                 run_data["meta"] = meta
             
-            self.db_manager.set_data(output_path, run_data)
+            # created_at rides along with the creating update; later calls only touch the fields above
+            run_key = (self.user_id, self.env_id, "output", cleaned_run_id)
+            if not _known_spaces.get(run_key):
+                run_data["created_at"] = {".sv": "timestamp"}
+            
+            # update, so files and progress already recorded for the run survive
+            if self.db_manager.update_data(output_path, run_data):
+                _known_spaces.set(run_key, True, ttl=KNOWN_RUNS_TTL)
             
             logger.debug(
                 "Output space ensured user_id=%s run_id=%s status=%s",
@@ -460,69 +1312,143 @@ class FirebaseAdmin:
             logger.warning("Failed to ensure output space for %s: %s", self.user_id, error)
             return run_id
 
+    def open_run(
+        self,
+        run_id: str,
+        meta: Optional[Dict[str, Any]] = None,
+        status: str = "running",
+        min_interval: float = RUN_PROGRESS_MIN_INTERVAL,
+    ) -> RunProgress:
+        """Ensure a run's output space and open a throttled progress handle for it.
+        
+        Args:
+            run_id: Run identifier
+            meta: Metadata dict for the run
+            status: Initial run status
+            min_interval: Minimum seconds between progress writes; terminal
+                statuses are written immediately
+            
+        Returns:
+            A RunProgress (usable as a context manager, which marks the run
+            'error' if the block raises)
+        """
+        if self.db_manager is None:
+            raise ValueError("Database manager not available")
+        cleaned_run_id = self.ensure_output_space(run_id, meta=meta, status=status)
+        return RunProgress(self, cleaned_run_id, min_interval=min_interval)
+
     def record_output_files(
         self,
         run_id: str,
-        files: List[Dict[str, Any]],
+        files: Iterable[Dict[str, Any]],
     ) -> bool:
-        """Record output files for a run.
+        """Record output files for a run and mark it completed.
+        
+        Files are appended to those already recorded for the run (see
+        stream_output_files).
         
         Args:
             run_id: Run identifier
-            files: List of file_master dicts with name, mime_type, size_bytes, etc.
+            files: Iterable of file_master dicts with name, mime_type, size_bytes, etc.
             
         Returns:
             True if successful
         """
+        return self.stream_output_files(run_id, files, status="completed")["success"]
+
+    def stream_output_files(
+        self,
+        run_id: str,
+        files: Iterable[Dict[str, Any]],
+        status: Optional[str] = None,
+        max_chunk_bytes: int = OUTPUT_CHUNK_BYTES,
+        max_chunk_files: int = OUTPUT_CHUNK_FILES,
+    ) -> Dict[str, Any]:
+        """Append output files to a run in size-bounded chunks.
+        
+        The iterable is consumed lazily and at most one chunk is held in
+        memory. Each chunk is one multi-path update adding children under
+        `output/{run_id}/files` and bumping the run's `file_count` and
+        `total_bytes` with server-side increments, so concurrent and repeated
+        calls for the same run accumulate instead of replacing each other.
+        Chunk updates are not retried (an increment sent twice counts twice);
+        a failed chunk ends the call with success=False and the totals of
+        the chunks written so far.
+        
+        Args:
+            run_id: Run identifier
+            files: Iterable (or generator) of file_master dicts
+            status: Run status written with the last chunk (e.g. 'completed')
+            max_chunk_bytes: Approximate JSON size of one chunk
+            max_chunk_files: Files per chunk
+            
+        Returns:
+            Dict with success, run_id, files and bytes written, and chunks
+        """
+        cleaned_run_id = str(run_id or "").strip() or generate_push_id()
+        result = {"success": False, "run_id": cleaned_run_id, "files": 0, "bytes": 0, "chunks": 0}
         if self.db_manager is None:
-            return False
+            return result
+        
+        output_path = f"{self.database}/output/{cleaned_run_id}"
+        chunk: Dict[str, Any] = {}
+        chunk_bytes = 0
+        chunk_size_bytes = 0
+        
+        def _flush(final: bool) -> bool:
+            nonlocal chunk, chunk_bytes, chunk_size_bytes
+            if not chunk and not (final and status is not None):
+                return True
+            update_data = dict(chunk)
+            update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+            if chunk:
+                update_data["file_count"] = {".sv": {"increment": len(chunk)}}
+                update_data["total_bytes"] = {".sv": {"increment": chunk_size_bytes}}
+            if final and status is not None:
+                update_data["status"] = status
+            if not self.db_manager.update_data(output_path, update_data):
+                return False
+            result["files"] += len(chunk)
+            result["bytes"] += chunk_size_bytes
+            result["chunks"] += 1
+            chunk, chunk_bytes, chunk_size_bytes = {}, 0, 0
+            return True
         
         try:
-            cleaned_run_id = str(run_id or "").strip() or str(uuid.uuid4())
-            output_path = f"{self.database}/output/{cleaned_run_id}"
-            
-            # Build files dict
-            files_dict = {}
-            for idx, file_item in enumerate(files):
+            for file_item in files:
                 if not isinstance(file_item, dict):
                     continue
-                
-                file_id = str(uuid.uuid4())
-                files_dict[file_id] = {
-                    "name": file_item.get("name"),
-                    "mime_type": file_item.get("mime_type"),
-                    "size_bytes": file_item.get("size_bytes"),
-                    "firebase_path": file_item.get("firebase_path"),
-                    "relative_path": file_item.get("relative_path"),
-                    "view_url": file_item.get("view_url"),
-                    "download_url": file_item.get("download_url"),
-                }
-            
-            update_data = {
-                "files": files_dict,
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "status": "completed",
-            }
-            
-            self.db_manager.update_data(output_path, update_data)
-            
-            logger.debug(
-                "Output files recorded user_id=%s run_id=%s file_count=%d",
-                self.user_id,
-                cleaned_run_id,
-                len(files_dict),
-            )
-            return True
+                record = _output_file_record(file_item)
+                record_bytes = payload_size(record)
+                if chunk and (chunk_bytes + record_bytes > max_chunk_bytes or len(chunk) >= max_chunk_files):
+                    if not _flush(final=False):
+                        return result
+                # time-sortable, so files list in creation order across calls
+                chunk[f"files/{generate_push_id()}"] = record
+                chunk_bytes += record_bytes
+                chunk_size_bytes += _as_int(record.get("size_bytes"))
+            result["success"] = _flush(final=True)
         except Exception as error:
             logger.warning("Failed to record output files for %s: %s", self.user_id, error)
-            return False
+            return result
+        
+        logger.debug(
+            "Output files recorded user_id=%s run_id=%s file_count=%d chunks=%d",
+            self.user_id,
+            cleaned_run_id,
+            result["files"],
+            result["chunks"],
+        )
+        return result
 
     def _record_transaction(
         self,
         txn_type: str,
         amount: int,
         operation_id: str,
-        new_balance: int,
+        new_balance: Optional[int],
+        batch: Optional[WriteBatch] = None,
+        details: Optional[Dict[str, Any]] = None,
     ) -> bool:
         """Record a transaction in the ledger.
         
@@ -530,7 +1456,9 @@ class FirebaseAdmin:
             txn_type: Type of transaction ('add_credits', 'deduct_credits')
             amount: Amount in transaction
             operation_id: Unique operation ID
-            new_balance: Balance after transaction
+            new_balance: Balance after transaction (None if unknown)
+            batch: Optional write batch to stage the entry in
+            details: Optional extra data (e.g. aggregated lease settlement info)
             
         Returns:
             True if recorded
@@ -543,19 +1471,163 @@ class FirebaseAdmin:
             txn_data = {
                 "type": txn_type,
                 "amount": amount,
-                "new_balance": new_balance,
                 "timestamp": datetime.now(timezone.utc).isoformat(),
                 "operation_id": operation_id,
             }
+            if new_balance is not None:
+                txn_data["new_balance"] = new_balance
+            if details:
+                txn_data["details"] = details
             
             path = f"{ledger_path}/{operation_id}"
-            self.db_manager.set_data(path, txn_data)
+            self._write(path, txn_data, batch, deferrable=True)
             return True
         except Exception as error:
             logger.warning("Failed to record transaction for %s: %s", self.user_id, error)
             return False
 
 
+# AdminRegistry.configure() default: leave the setting as it is
+_UNCHANGED: Any = object()
+
+
+def _forget_database_state() -> None:
+    """Drop caches and credits listeners that describe the previous shared database."""
+    with _balance_watches_lock:
+        watches = list(_balance_watches.values())
+        _balance_watches.clear()
+        _balance_cache.clear()
+    for registration, _ in watches:
+        registration.close()
+    _seen_operations.clear()
+    clear_known_spaces_cache()
+
+
+class AdminRegistry:
+    """Process-wide LRU registry of FirebaseAdmin handles.
+    
+    Handles are keyed by (user_id, env_id) and share a single FBRTDBMgr, so
+    module-level helpers reuse objects and per-user state across requests.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        db_manager: Optional[FBRTDBMgr] = None,
+        credit_shards: Optional[int] = None,
+    ):
+        """Initialize the registry.
+        
+        Args:
+            max_size: Maximum number of cached FirebaseAdmin handles
+            db_manager: Shared database manager; resolved lazily if omitted
+            credit_shards: Credit shard count given to every handle (None = single balance)
+        """
+        self.max_size = max_size
+        self.credit_shards = credit_shards
+        self._db_manager = db_manager
+        self._admins: "OrderedDict[Tuple[str, str], FirebaseAdmin]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def db_manager(self) -> Optional[FBRTDBMgr]:
+        """The shared FBRTDBMgr, or None while Firebase is not initialized."""
+        if self._db_manager is None:
+            with self._lock:
+                if self._db_manager is None:
+                    manager = FBRTDBMgr()
+                    # keep retrying until the app is initialized
+                    if manager.app is not None:
+                        self._db_manager = manager
+        return self._db_manager
+
+    def configure(
+        self,
+        db_manager: Optional[FBRTDBMgr] = _UNCHANGED,
+        max_size: Optional[int] = None,
+        credit_shards: Optional[int] = _UNCHANGED,
+    ) -> None:
+        """Replace the shared manager and/or settings, dropping cached handles.
+        
+        Only the arguments passed are changed. When the manager changes, the
+        balance cache, the seen-operations cache, the known-spaces cache and
+        credits listeners are dropped too, since they describe the previous
+        database.
+        
+        Args:
+            db_manager: New shared database manager (e.g. one backed by
+                InMemoryBackend); None resolves the default one lazily again
+            max_size: New maximum number of cached handles
+            credit_shards: Credit shard count for new handles (None = single balance)
+        """
+        with self._lock:
+            manager_changed = db_manager is not _UNCHANGED and db_manager is not self._db_manager
+            if db_manager is not _UNCHANGED:
+                self._db_manager = db_manager
+            if credit_shards is not _UNCHANGED:
+                self.credit_shards = credit_shards
+            if max_size is not None:
+                self.max_size = max_size
+            self._admins.clear()
+        if manager_changed:
+            _forget_database_state()
+
+    def get(self, user_id: str, env_id: str = "default") -> "FirebaseAdmin":
+        """Return the cached FirebaseAdmin for (user_id, env_id), creating it if needed.
+        
+        Args:
+            user_id: The user identifier (UID or email)
+            env_id: Environment identifier
+            
+        Returns:
+            A FirebaseAdmin handle bound to the shared database manager
+        """
+        key = (user_id, env_id)
+        with self._lock:
+            admin = self._admins.get(key)
+            if admin is not None:
+                self._admins.move_to_end(key)
+                return admin
+        db_manager = self.db_manager
+        if db_manager is None:
+            # not cached: a later call may find the app initialized
+            return FirebaseAdmin(user_id, env_id=env_id)
+        admin = FirebaseAdmin(
+            user_id,
+            env_id=env_id,
+            db_manager=db_manager,
+            credit_shards=self.credit_shards,
+        )
+        with self._lock:
+            # another thread may have won the race
+            admin = self._admins.setdefault(key, admin)
+            self._admins.move_to_end(key)
+            while len(self._admins) > self.max_size:
+                self._admins.popitem(last=False)
+        return admin
+
+    def clear(self) -> None:
+        """Drop all cached handles, keeping the shared manager."""
+        with self._lock:
+            self._admins.clear()
+
+    def __len__(self) -> int:
+        return len(self._admins)
+
+
+_registry = AdminRegistry()
+
+
+def get_admin_registry() -> AdminRegistry:
+    """Return the process-wide AdminRegistry."""
+    return _registry
+
+
+def get_firebase_admin(user_id: str, env_id: str = "default") -> FirebaseAdmin:
+    """Return the shared FirebaseAdmin handle for a user and environment."""
+    return _registry.get(user_id, env_id)
+
+
 def resolve_billing_user_id(
     uid: Optional[str] = None,
     email: Optional[str] = None,
@@ -573,6 +1645,7 @@ def resolve_billing_user_id(
     return fb_uid or email_norm
 
 
+@instrument_flow("sync_user_session")
 def sync_user_session(
     billing_key: str,
     *,
@@ -584,8 +1657,12 @@ def sync_user_session(
 ) -> bool:
     """Ensure RTDB user spaces and record auth/session activity."""
     # per-user FirebaseAdmin scoped to env
-    admin = FirebaseAdmin(billing_key, env_id=env_id)
-    admin.ensure_user_spaces()
+    admin = get_firebase_admin(billing_key, env_id=env_id)
+    if admin.db_manager is None:
+        return True
+    # spaces, profile and history go out as one multi-path update
+    batch = admin.db_manager.batch()
+    admin.ensure_user_spaces(batch=batch)
     # profile metadata for billing dashboards
     profile_payload = {
         "email": email,
@@ -594,20 +1671,24 @@ def sync_user_session(
         "last_action": action,
         "updated_at": datetime.now(timezone.utc).isoformat(),
     }
-    if admin.db_manager is not None:
-        admin.db_manager.update_data(
-            f"{admin.database}/profile",
-            {key: value for key, value in profile_payload.items() if value is not None},
-        )
+    batch.update(
+        f"{admin.database}/profile",
+        {key: value for key, value in profile_payload.items() if value is not None},
+    )
     # history trail mirrors accounts auth_views usage
     admin.record_history_event(
         action=action,
         status="ok",
         details={"source": source, "email": email},
+        batch=batch,
     )
+    if not batch.commit():
+        logger.warning("Session sync failed user_id=%s action=%s", admin.user_id, action)
+        return False
     return True
 
 
+@instrument_flow("record_purchase_event")
 def record_purchase_event(
     billing_key: str,
     *,
@@ -617,18 +1698,38 @@ def record_purchase_event(
     details: Optional[Dict[str, Any]] = None,
     env_id: str = "default",
 ) -> Dict[str, Any]:
-    """Atomically add credits and record purchase in RTDB history."""
+    """Atomically add credits and record purchase in RTDB history.
+
+    The credits are added even if the ledger entry and audit event cannot be
+    written afterwards; the result then carries recorded=False.
+    """
     # credit mutation via FirebaseAdmin atomic helper
-    admin = FirebaseAdmin(billing_key, env_id=env_id)
-    result = admin.add_credits_atomic(credits, operation_id)
+    admin = get_firebase_admin(billing_key, env_id=env_id)
+    # ledger entry and audit event share one multi-path update after the transaction
+    batch = admin.db_manager.batch() if admin.db_manager is not None else None
+    # webhooks may be redelivered days later, past the inline operation records
+    result = admin.add_credits_atomic(credits, operation_id, batch=batch, check_ledger=True)
     # purchase audit event
     event_details = {"source": source, "credits": credits}
     if details and isinstance(details, dict):
         event_details.update(details)
+    if result.get("duplicate"):
+        # webhook retry: already credited and audited
+        return result
     admin.record_history_event(
         action="billing.purchase",
         status="ok",
         details=event_details,
         request_id=operation_id,
+        batch=batch,
     )
+    if not batch.commit():
+        # the credits are in; only the ledger entry and audit event are missing
+        logger.error(
+            "Purchase credited but not recorded user_id=%s credits=%s op_id=%s",
+            admin.user_id,
+            credits,
+            operation_id,
+        )
+        result["recorded"] = False
     return result
@@ -0,0 +1,306 @@
+"""
+Bulk export of users' env trees into partitioned columnar files.
+
+UserExporter lists user ids with a shallow read of `users`, fetches several
+users in parallel (credits, profile, paged ledger and history, and the files
+of every output run) and appends flat rows per table to Parquet files when
+pyarrow is installed, or gzip-compressed JSON lines otherwise. Files are laid
+out as `{table}/env={env_id}/part-{seq}.{ext}`. Rows are flushed to a new part
+whenever a buffer fills, so memory stays bounded, and a checkpoint written
+after every window of users lets an interrupted export resume. All reads are
+strict: a read error aborts the run before its window is checkpointed, so a
+failed read is never mistaken for missing data.
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from fb_core.credit_shards import BALANCE_FIELDS, credits_total
+from fb_core.resilience import RTDBUnavailableError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, JSON lines are written instead
+    pa = pq = None
+
+if TYPE_CHECKING:
+    from fb_core.real_time_database import FBRTDBMgr
+
+logger = logging.getLogger(__name__)
+
+# table -> columns; remaining fields of a record go into the JSON 'extra' column
+EXPORT_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "credits": ("user_id", "env_id", "balance", "shard_count", "updated_at"),
+    "profile": ("user_id", "env_id", "email", "display_name", "source", "last_action", "updated_at"),
+    "ledger": ("user_id", "env_id", "key", "type", "amount", "new_balance", "operation_id", "timestamp"),
+    "history": ("user_id", "env_id", "event_id", "action", "status", "request_id", "timestamp"),
+    "files": (
+        "user_id", "env_id", "run_id", "file_id", "name", "mime_type", "size_bytes",
+        "firebase_path", "relative_path", "view_url", "download_url",
+    ),
+}
+
+_INT_COLUMNS = frozenset({"balance", "shard_count", "amount", "new_balance", "size_bytes"})
+
+FORMAT_PARQUET = "parquet"
+FORMAT_JSONL = "jsonl"
+CHECKPOINT_FILE = "_checkpoint.json"
+
+
+def _row(table: str, record: Dict[str, Any], **fixed: Any) -> Dict[str, Any]:
+    """Flatten a record into the table's columns plus a JSON 'extra' column."""
+    record = dict(record, **fixed)
+    row = {column: record.pop(column, None) for column in EXPORT_COLUMNS[table]}
+    # fixed column types, so every part of a table shares one schema
+    for column, value in row.items():
+        if value is None:
+            continue
+        if column in _INT_COLUMNS:
+            try:
+                row[column] = int(value)
+            except (TypeError, ValueError):
+                row[column] = None
+                record[column] = value
+        elif isinstance(value, (dict, list)):
+            row[column] = json.dumps(value, sort_keys=True, default=str)
+        else:
+            row[column] = str(value)
+    row["extra"] = json.dumps(record, sort_keys=True, default=str) if record else None
+    return row
+
+
+class UserExporter:
+    """Streams users' env trees from RTDB into partitioned export files."""
+
+    def __init__(
+        self,
+        manager: "FBRTDBMgr",
+        output_dir: str,
+        file_format: Optional[str] = None,
+        max_workers: int = 8,
+        users_per_checkpoint: int = 100,
+        rows_per_file: int = 50_000,
+        page_size: int = 500,
+        env_ids: Optional[Iterable[str]] = None,
+    ):
+        """Initialize the exporter.
+
+        Args:
+            manager: Database manager to read from
+            output_dir: Directory receiving the export tree and checkpoint
+            file_format: 'parquet' or 'jsonl'; parquet if pyarrow is installed when omitted
+            max_workers: Users fetched in parallel
+            users_per_checkpoint: Users per window between checkpoints
+            rows_per_file: Buffered rows per table and env before a part is written
+            page_size: Children per query for ledger, history and files
+            env_ids: Only export these environments; all when omitted
+        """
+        if file_format is None:
+            file_format = FORMAT_PARQUET if pq is not None else FORMAT_JSONL
+        if file_format == FORMAT_PARQUET and pq is None:
+            raise ValueError("parquet export requires pyarrow")
+        if file_format not in (FORMAT_PARQUET, FORMAT_JSONL):
+            raise ValueError(f"unknown export format {file_format!r}")
+        self.manager = manager
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.max_workers = max_workers
+        self.users_per_checkpoint = users_per_checkpoint
+        self.rows_per_file = rows_per_file
+        self.page_size = page_size
+        self.env_ids = set(env_ids) if env_ids is not None else None
+        self._lock = threading.Lock()
+        self._buffers: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._part_seq = 0
+        self._rows: Dict[str, int] = {table: 0 for table in EXPORT_COLUMNS}
+
+    def _part_path(self, table: str, env_id: str, seq: int) -> str:
+        extension = "parquet" if self.file_format == FORMAT_PARQUET else "jsonl.gz"
+        return os.path.join(self.output_dir, table, f"env={env_id}", f"part-{seq:06d}.{extension}")
+
+    def _write_part(self, table: str, env_id: str, rows: List[Dict[str, Any]], seq: int) -> None:
+        path = self._part_path(table, env_id, seq)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.file_format == FORMAT_PARQUET:
+            schema = pa.schema([
+                (column, pa.int64() if column in _INT_COLUMNS else pa.string())
+                for column in EXPORT_COLUMNS[table] + ("extra",)
+            ])
+            pq.write_table(pa.Table.from_pylist(rows, schema=schema), path, compression="zstd")
+        else:
+            with gzip.open(path, "wt", encoding="utf-8") as part:
+                for row in rows:
+                    part.write(json.dumps(row, default=str) + "\n")
+
+    def _emit(self, table: str, env_id: str, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        with self._lock:
+            buffer = self._buffers.setdefault((table, env_id), [])
+            buffer.extend(rows)
+            self._rows[table] += len(rows)
+            if len(buffer) < self.rows_per_file:
+                return
+            del self._buffers[(table, env_id)]
+            self._part_seq += 1
+            seq = self._part_seq
+        self._write_part(table, env_id, buffer, seq)
+
+    def _flush(self) -> None:
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            parts = []
+            for (table, env_id), rows in buffers.items():
+                self._part_seq += 1
+                parts.append((table, env_id, rows, self._part_seq))
+        for part in parts:
+            self._write_part(*part)
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.output_dir, CHECKPOINT_FILE)
+
+    def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._checkpoint_path(), "r", encoding="utf-8") as checkpoint:
+                return json.load(checkpoint)
+        except FileNotFoundError:
+            return None
+
+    def _save_checkpoint(self, last_user_id: str, users: int) -> None:
+        state = {
+            "last_user_id": last_user_id,
+            "users": users,
+            "part_seq": self._part_seq,
+            "rows": self._rows,
+            "format": self.file_format,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        tmp_path = self._checkpoint_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(tmp_path, self._checkpoint_path())
+
+    def _discard_parts_after(self, seq: int) -> None:
+        """Remove parts written after the last checkpoint (their users are exported again)."""
+        for table in EXPORT_COLUMNS:
+            table_dir = os.path.join(self.output_dir, table)
+            if not os.path.isdir(table_dir):
+                continue
+            for env_dir in os.listdir(table_dir):
+                for name in os.listdir(os.path.join(table_dir, env_dir)):
+                    # part-{seq}.{extension}; seq outgrows its zero padding past 999999
+                    part_seq = name[len("part-"):].split(".", 1)[0]
+                    if name.startswith("part-") and part_seq.isdigit() and int(part_seq) > seq:
+                        os.remove(os.path.join(table_dir, env_dir, name))
+
+    def _get(self, path: str, **options: Any) -> Any:
+        """Read a node, raising instead of returning None when RTDB did not answer."""
+        result = self.manager.read(path, **options)
+        if not result.available:
+            raise RTDBUnavailableError(f"export read of {path} failed: {result.error}")
+        return result.value
+
+    def _export_env(self, user_id: str, env_id: str) -> None:
+        base = f"users/{user_id}/env/{env_id}"
+        keys = {"user_id": user_id, "env_id": env_id}
+
+        # ops and reservations are bookkeeping, not exported (nor downloaded)
+        credits = self._get(f"{base}/credits", fields=BALANCE_FIELDS + ("shard_count", "updated_at"))
+        if isinstance(credits, dict):
+            self._emit("credits", env_id, [_row("credits", {
+                "balance": credits_total(credits),
+                "shard_count": credits.get("shard_count"),
+                "updated_at": credits.get("updated_at"),
+            }, **keys)])
+        profile = self._get(f"{base}/profile")
+        if isinstance(profile, dict):
+            self._emit("profile", env_id, [_row("profile", profile, **keys)])
+
+        for table, key_column in (("ledger", "key"), ("history", "event_id")):
+            page: List[Dict[str, Any]] = []
+            # key order needs no index rule
+            for key, record in self.manager.iter_children(f"{base}/{table}", page_size=self.page_size, strict=True):
+                if isinstance(record, dict):
+                    page.append(_row(table, dict({key_column: key}, **record), **keys))
+                if len(page) >= self.page_size:
+                    self._emit(table, env_id, page)
+                    page = []
+            self._emit(table, env_id, page)
+
+        for run_id in self.manager.list_keys(f"{base}/output", strict=True):
+            page = []
+            files_path = f"{base}/output/{run_id}/files"
+            for file_id, record in self.manager.iter_children(files_path, page_size=self.page_size, strict=True):
+                if isinstance(record, dict):
+                    page.append(_row("files", record, run_id=run_id, file_id=file_id, **keys))
+                if len(page) >= self.page_size:
+                    self._emit("files", env_id, page)
+                    page = []
+            self._emit("files", env_id, page)
+
+    def _export_user(self, user_id: str) -> None:
+        for env_id in self.manager.list_keys(f"users/{user_id}/env", strict=True):
+            if self.env_ids is None or env_id in self.env_ids:
+                self._export_env(user_id, env_id)
+
+    def run(self, user_ids: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Export all users (or the given ones), resuming from a previous checkpoint.
+
+        Args:
+            user_ids: Users to export; listed with a shallow read of 'users' when omitted
+
+        Returns:
+            Dict with users exported in this run, rows per table, parts written
+            and the user id the run resumed after (if any)
+
+        Raises:
+            RTDBUnavailableError: If a read failed; windows checkpointed before
+                it are kept and the next run resumes after them
+        """
+        if user_ids is None:
+            user_ids = self.manager.list_keys("users", strict=True)
+        # sorted, so the checkpoint is a watermark over the user order
+        pending = sorted(str(user_id) for user_id in user_ids)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        resumed_after = None
+        done = 0
+        checkpoint = self._load_checkpoint()
+        if checkpoint and checkpoint.get("format") == self.file_format:
+            resumed_after = checkpoint["last_user_id"]
+            done = int(checkpoint.get("users") or 0)
+            self._part_seq = int(checkpoint.get("part_seq") or 0)
+            self._rows.update(checkpoint.get("rows") or {})
+            self._discard_parts_after(self._part_seq)
+            pending = [user_id for user_id in pending if user_id > resumed_after]
+
+        exported = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fb_core-export") as pool:
+            for start in range(0, len(pending), self.users_per_checkpoint):
+                window = pending[start:start + self.users_per_checkpoint]
+                # list() re-raises the first failure before the window is checkpointed
+                list(pool.map(self._export_user, window))
+                self._flush()
+                exported += len(window)
+                self._save_checkpoint(window[-1], done + exported)
+                logger.info("Export checkpoint users=%d last_user_id=%s", done + exported, window[-1])
+
+        return {
+            "users": exported,
+            "rows": dict(self._rows),
+            "parts": self._part_seq,
+            "resumed_after": resumed_after,
+        }
+
+
+def export_users(manager: "FBRTDBMgr", output_dir: str, **options: Any) -> Dict[str, Any]:
+    """Export every user's env tree to output_dir (see UserExporter for options)."""
+    user_ids = options.pop("user_ids", None)
+    return UserExporter(manager, output_dir, **options).run(user_ids)
@@ -0,0 +1,86 @@
+"""
+Idempotency records for credit operations.
+
+Applied operation ids are stored next to the balance they changed
+(`credits/ops/{op}` or `credits/shards/{i}/ops/{op}`) inside the same
+transaction, so a retried operation is detected atomically and its original
+result can be returned.
+
+Records are kept for IDEMPOTENCY_RETENTION_SECONDS, but at most
+IDEMPOTENCY_MAX_OPS per node (the oldest go first), since every credits
+transaction reads and writes them. Callers whose retries may come later or
+more often than that (e.g. payment webhooks) can additionally check the
+operation's ledger entry; the ledger is not the primary record, as its
+writes may be deferred or fail after the credit transaction committed.
+"""
+
+import re
+import time
+from typing import Any, Dict, Optional
+
+from fb_core.credit_shards import iter_shards
+
+# RTDB keys may not contain . $ # [ ] / or control characters
+_INVALID_KEY_CHARS = re.compile(r"[.$#\[\]/\x00-\x1f\x7f]")
+
+# how long a retried operation is recognised, and the records kept per credits or shard node
+IDEMPOTENCY_RETENTION_SECONDS = 7 * 24 * 3600
+IDEMPOTENCY_MAX_OPS = 1000
+
+
+def operation_key(operation_id: str) -> str:
+    """RTDB-safe key for an operation id."""
+    return _INVALID_KEY_CHARS.sub("_", str(operation_id))[:768]
+
+
+def find_operation(node: Any, key: str) -> Optional[Dict[str, Any]]:
+    """Look up an applied operation in a credits or shard node.
+
+    For a full credits node, the ops of every shard are searched as well.
+
+    Args:
+        node: Credits node or shard node (as passed to a transaction)
+        key: Operation key from operation_key()
+
+    Returns:
+        The stored operation entry, or None if not applied
+    """
+    if not isinstance(node, dict):
+        return None
+    ops = node.get("ops")
+    if isinstance(ops, dict) and isinstance(ops.get(key), dict):
+        return ops[key]
+    for _, shard in iter_shards(node):
+        entry = find_operation(shard, key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def record_operation(
+    node: Dict[str, Any],
+    key: str,
+    entry: Dict[str, Any],
+    max_ops: int = IDEMPOTENCY_MAX_OPS,
+    retention_seconds: float = IDEMPOTENCY_RETENTION_SECONDS,
+) -> None:
+    """Store an operation entry in node['ops'], pruning old entries.
+
+    Args:
+        node: Credits or shard node to mutate in place
+        key: Operation key from operation_key()
+        entry: Result data to keep for the operation
+        max_ops: Maximum number of entries kept per node
+        retention_seconds: Entries older than this are dropped
+    """
+    now = time.time()
+    ops = node.get("ops") if isinstance(node.get("ops"), dict) else {}
+    ops = {
+        op: value for op, value in ops.items()
+        if isinstance(value, dict) and float(value.get("at") or 0) >= now - retention_seconds
+    }
+    ops[key] = dict(entry, at=now)
+    if len(ops) > max_ops:
+        for op in sorted(ops, key=lambda op: float(ops[op].get("at") or 0))[:len(ops) - max_ops]:
+            del ops[op]
+    node["ops"] = ops
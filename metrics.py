@@ -0,0 +1,228 @@
+"""
+Instrumentation hooks for fb_core.
+
+Metrics are off by default: every instrumented call first checks whether a
+sink is installed, so the disabled cost is one global lookup. enable_metrics()
+installs a sink (InMemoryMetrics unless another MetricsSink is given), which
+then receives:
+
+- fb_core_rtdb_operation_seconds{op}: latency of each backend call, retries included
+- fb_core_rtdb_errors_total{op}: backend calls that failed
+- fb_core_rtdb_payload_bytes{op}: JSON size written (set/update) or read (get/query)
+- fb_core_rtdb_transaction_attempts: update function runs per transaction
+- fb_core_flow_seconds{flow} and fb_core_flow_round_trips{flow}: latency and
+  backend calls of high-level flows (sync_user_session, record_purchase_event,
+  add/deduct credits)
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+
+_BUCKETS: Dict[str, Sequence[float]] = {
+    "fb_core_rtdb_operation_seconds": LATENCY_BUCKETS,
+    "fb_core_flow_seconds": LATENCY_BUCKETS,
+    "fb_core_rtdb_payload_bytes": SIZE_BUCKETS,
+    "fb_core_rtdb_transaction_attempts": COUNT_BUCKETS,
+    "fb_core_flow_round_trips": COUNT_BUCKETS,
+}
+
+Labels = Optional[Dict[str, str]]
+
+
+class MetricsSink:
+    """Receiver of fb_core measurements (e.g. an adapter to prometheus_client or StatsD)."""
+
+    def observe(self, name: str, value: float, labels: Labels = None) -> None:
+        """Record one sample of a histogram."""
+        raise NotImplementedError
+
+    def increment(self, name: str, amount: float = 1, labels: Labels = None) -> None:
+        """Add amount to a counter."""
+        raise NotImplementedError
+
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _label_key(labels: Labels) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class InMemoryMetrics(MetricsSink):
+    """Thread-safe in-process counters and fixed-bucket histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], _Histogram]] = {}
+
+    def observe(self, name: str, value: float, labels: Labels = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(_BUCKETS.get(name, LATENCY_BUCKETS))
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, labels: Labels = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def reset(self) -> None:
+        """Drop all recorded series."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of all series.
+
+        Returns:
+            Dict with 'counters' (name -> list of {labels, value}) and
+            'histograms' (name -> list of {labels, count, sum, buckets}),
+            where buckets maps each upper bound to its cumulative count
+        """
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = []
+                for key, histogram in series.items():
+                    cumulative, buckets = 0, {}
+                    for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        buckets[bound] = cumulative
+                    histograms[name].append({
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": buckets,
+                    })
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        """Render all series in the Prometheus text exposition format."""
+        lines: List[str] = []
+        snapshot = self.snapshot()
+        for name, series in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {name} counter")
+            for entry in series:
+                lines.append(f"{name}{_format_labels(_label_key(entry['labels']))} {entry['value']}")
+        for name, series in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE {name} histogram")
+            for entry in series:
+                key = _label_key(entry["labels"])
+                for bound, count in entry["buckets"].items():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _format_labels(key, f'le="{le}"')
+                    lines.append(f"{name}_bucket{bucket_labels} {count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {entry['sum']}")
+                lines.append(f"{name}_count{_format_labels(key)} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+
+_sink: Optional[MetricsSink] = None
+# round-trip counters of the flows running in this context (outermost first)
+_flows: contextvars.ContextVar[Tuple[List[int], ...]] = contextvars.ContextVar("fb_core_flows", default=())
+
+
+def enable_metrics(sink: Optional[MetricsSink] = None) -> MetricsSink:
+    """Install a metrics sink (a new InMemoryMetrics if omitted) and return it."""
+    global _sink
+    _sink = sink if sink is not None else InMemoryMetrics()
+    return _sink
+
+
+def disable_metrics() -> None:
+    """Remove the metrics sink; instrumentation becomes a no-op."""
+    global _sink
+    _sink = None
+
+
+def get_metrics() -> Optional[MetricsSink]:
+    """Return the installed sink, or None when metrics are disabled."""
+    return _sink
+
+
+def payload_size(value: Any) -> int:
+    """Approximate wire size of a JSON value."""
+    return len(json.dumps(value, separators=(",", ":"), default=str))
+
+
+def record_operation(op: str, seconds: float, failed: bool = False, payload: Any = None) -> None:
+    """Record one backend call (called by FBRTDBMgr when a sink is installed)."""
+    sink = _sink
+    if sink is None:
+        return
+    labels = {"op": op}
+    sink.observe("fb_core_rtdb_operation_seconds", seconds, labels)
+    if failed:
+        sink.increment("fb_core_rtdb_errors_total", 1, labels)
+    elif payload is not None:
+        sink.observe("fb_core_rtdb_payload_bytes", payload_size(payload), labels)
+    for counter in _flows.get():
+        counter[0] += 1
+
+
+def record_transaction_attempts(attempts: int) -> None:
+    """Record how many times a transaction ran its update function."""
+    sink = _sink
+    if sink is not None:
+        sink.observe("fb_core_rtdb_transaction_attempts", attempts)
+
+
+def instrument_flow(flow: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator recording latency and backend round trips of a high-level flow."""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _sink is None:
+                return fn(*args, **kwargs)
+            counter = [0]
+            token = _flows.set(_flows.get() + (counter,))
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _flows.reset(token)
+                sink = _sink
+                if sink is not None:
+                    labels = {"flow": flow}
+                    sink.observe("fb_core_flow_seconds", time.perf_counter() - started, labels)
+                    sink.observe("fb_core_flow_round_trips", counter[0], labels)
+        return wrapper
+    return decorator
@@ -0,0 +1,129 @@
+"""
+Time-sortable keys compatible with RTDB push IDs.
+
+A push ID is 8 characters of millisecond timestamp followed by 12 random
+characters, all from an alphabet whose ASCII order matches its value order,
+so keys sort lexicographically by creation time. Within one millisecond the
+random part is incremented instead of redrawn, keeping keys generated by one
+process strictly increasing. The random part is redrawn from the OS
+entropy pool for every new millisecond and after fork(), so processes
+(including forked workers) do not share a sequence.
+"""
+
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple, Union
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+_TIME_LENGTH = 8
+_RANDOM_LENGTH = 12
+
+
+def _encode_time(millis: int) -> str:
+    chars = []
+    for _ in range(_TIME_LENGTH):
+        chars.append(PUSH_CHARS[millis % 64])
+        millis //= 64
+    return "".join(reversed(chars))
+
+
+def _to_millis(when: Union[datetime, float, int]) -> int:
+    if isinstance(when, datetime):
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return int(when.timestamp() * 1000)
+    return int(float(when) * 1000)
+
+
+class PushIdGenerator:
+    """Thread-safe generator of strictly increasing push IDs."""
+
+    def __init__(self):
+        self._random = random.SystemRandom()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the last key, so the next one draws a fresh random part."""
+        self._lock = threading.Lock()
+        self._last_millis = -1
+        self._last_random: List[int] = [0] * _RANDOM_LENGTH
+
+    def generate(self, now_millis: Optional[int] = None) -> str:
+        """Return a new push ID for now (or for now_millis)."""
+        if now_millis is None:
+            now_millis = int(time.time() * 1000)
+        with self._lock:
+            if now_millis <= self._last_millis:
+                # same millisecond, or the clock went back: stay monotonic
+                now_millis = self._last_millis
+                for index in range(_RANDOM_LENGTH - 1, -1, -1):
+                    if self._last_random[index] != 63:
+                        self._last_random[index] += 1
+                        break
+                    self._last_random[index] = 0
+                else:
+                    # 64^12 keys in one millisecond: borrow the next one
+                    now_millis += 1
+            else:
+                self._last_random = [self._random.randrange(64) for _ in range(_RANDOM_LENGTH)]
+            self._last_millis = now_millis
+            suffix = "".join(PUSH_CHARS[value] for value in self._last_random)
+        return _encode_time(now_millis) + suffix
+
+
+_generator = PushIdGenerator()
+
+if hasattr(os, "register_at_fork"):
+    # a forked child would otherwise continue the parent's increment sequence
+    os.register_at_fork(after_in_child=_generator.reset)
+
+
+def generate_push_id() -> str:
+    """Return a new time-sortable key from the process-wide generator."""
+    return _generator.generate()
+
+
+def push_id_lower_bound(when: Union[datetime, float, int]) -> str:
+    """Smallest push ID that can be generated at or after when (datetime or epoch seconds)."""
+    return _encode_time(_to_millis(when)) + PUSH_CHARS[0] * _RANDOM_LENGTH
+
+
+def push_id_upper_bound(when: Union[datetime, float, int]) -> str:
+    """Largest push ID that can be generated at or before when (datetime or epoch seconds)."""
+    return _encode_time(_to_millis(when)) + PUSH_CHARS[-1] * _RANDOM_LENGTH
+
+
+def push_id_range(
+    start: Optional[Union[datetime, float, int]] = None,
+    end: Optional[Union[datetime, float, int]] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    """Inclusive (start_at, end_at) key bounds of a time window for key-ordered queries.
+
+    Args:
+        start: Window start (datetime or epoch seconds); open if None
+        end: Window end (datetime or epoch seconds); open if None
+
+    Returns:
+        Key bounds to pass to FBRTDBMgr.iter_children; None for an open side.
+    """
+    return (
+        push_id_lower_bound(start) if start is not None else None,
+        push_id_upper_bound(end) if end is not None else None,
+    )
+
+
+def push_id_time(key: str) -> Optional[datetime]:
+    """Creation time encoded in a push ID, or None if key is not a push ID."""
+    if len(key) != _TIME_LENGTH + _RANDOM_LENGTH:
+        return None
+    millis = 0
+    for char in key[:_TIME_LENGTH]:
+        value = PUSH_CHARS.find(char)
+        if value < 0:
+            return None
+        millis = millis * 64 + value
+    return datetime.fromtimestamp(millis / 1000.0, tz=timezone.utc)
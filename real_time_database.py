@@ -1,107 +1,426 @@
 """
 Firebase Realtime Database Manager for fb_core.
 
-Provides low-level operations against Firebase Realtime Database using the admin SDK.
+Provides low-level operations against Firebase Realtime Database. Storage is
+delegated to a pluggable backend (see fb_core.backends); by default the admin
+SDK is used.
 """
 
 import os
+import copy
+import contextvars
 import logging
-from typing import Any, Callable, Optional, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Dict, Iterator, List, Sequence, Tuple
 
-import firebase_admin
-from firebase_admin import db
+from fb_core import metrics
+from fb_core.backends import (
+    KEY,
+    AbortTransaction,
+    FirebaseBackend,
+    RTDBBackend,
+    _has_increment,
+    _key_order,
+    join_path,
+    split_path,
+)
+from fb_core.resilience import Resilience, RTDBUnavailableError
+from fb_core.write_behind import WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 
 
+class ReadResult:
+    """Outcome of FBRTDBMgr.read: found, not found, or unavailable."""
+
+    FOUND = "found"
+    NOT_FOUND = "not_found"
+    UNAVAILABLE = "unavailable"
+
+    __slots__ = ("status", "value", "error")
+
+    def __init__(self, status: str, value: Any = None, error: Optional[BaseException] = None):
+        self.status = status
+        self.value = value
+        self.error = error
+
+    @property
+    def found(self) -> bool:
+        return self.status == self.FOUND
+
+    @property
+    def available(self) -> bool:
+        """True if RTDB answered (whether or not data exists)."""
+        return self.status != self.UNAVAILABLE
+
+    def __repr__(self) -> str:
+        return f"ReadResult({self.status!r}, {self.value!r})"
+
+
 class FBRTDBMgr:
     """Manages operations against Firebase Realtime Database."""
 
-    def __init__(self):
+    # parallel child reads of one projected read (see read(fields=...))
+    READ_CONCURRENCY = 8
+
+    def __init__(self, backend: Optional[RTDBBackend] = None, resilience: Optional[Resilience] = None):
         """Initialize the database manager.
         
-        Requires that firebase_admin.initialize_app() has already been called.
+        Without an explicit backend, requires that firebase_admin.initialize_app()
+        has already been called.
+        
+        Args:
+            backend: Storage backend (e.g. InMemoryBackend); defaults to FirebaseBackend
+            resilience: Retry/circuit breaker policy for backend calls; a default
+                Resilience() if omitted
         """
-        try:
-            self.app = firebase_admin.get_app()
-        except ValueError:
-            logger.warning("Firebase app not initialized. Some operations will fail.")
-            self.app = None
+        if backend is None:
+            backend = FirebaseBackend()
+        self.backend = backend
+        self.app = getattr(backend, "app", None)
+        self.resilience = resilience if resilience is not None else Resilience()
+        self.write_queue: Optional[WriteBehindQueue] = None
+        self._read_pool: Optional[ThreadPoolExecutor] = None
+        self._read_pool_lock = threading.Lock()
 
     def _is_available(self) -> bool:
-        """Return True if the Firebase app is initialized and has a DB URL configured."""
-        if not self.app:
-            return False
+        """Return True if the backend can serve requests."""
+        return self.backend.is_available()
+
+    def _call(self, op: str, path: str, fn: Callable[..., Any], *args: Any, retry: bool = True, **kwargs: Any) -> Any:
+        """Run a backend call under the retry and circuit breaker policy, recording metrics.
+        
+        With retry=False the call is attempted once (for writes that must not be repeated).
+        """
+        run = self.resilience.call if retry else self.resilience.call_once
+        if metrics.get_metrics() is None:
+            return run(f"{op} {path}", fn, *args, **kwargs)
+        started = time.perf_counter()
         try:
-            # db.reference() will raise ValueError if no databaseURL is set
-            db.reference("/")
-            return True
+            result = run(f"{op} {path}", fn, *args, **kwargs)
+        except AbortTransaction:
+            metrics.record_operation(op, time.perf_counter() - started)
+            raise
         except Exception:
-            return False
+            metrics.record_operation(op, time.perf_counter() - started, failed=True)
+            raise
+        if op in ("set", "update"):
+            payload = args[1]
+        elif op in ("get", "query"):
+            payload = result
+        else:
+            payload = None
+        metrics.record_operation(op, time.perf_counter() - started, payload=payload)
+        return result
 
-    def get_data(self, path: str) -> Optional[Any]:
+    def health_check(self) -> bool:
+        """Re-probe the backend and refresh the cached availability state.
+        
+        A successful probe also closes the circuit breaker.
+        
+        Returns:
+            True if the backend can serve requests.
+        """
+        healthy = self.backend.health_check()
+        if healthy:
+            self.resilience.breaker.reset()
+        return healthy
+
+    def invalidate(self) -> None:
+        """Drop cached availability and references, e.g. after re-initializing the app."""
+        self.backend.invalidate()
+        self.app = getattr(self.backend, "app", None)
+
+    def get_data(
+        self,
+        path: str,
+        shallow: bool = False,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Optional[Any]:
         """Retrieve data from the specified path in RTDB.
         
         Args:
             path: The database path (e.g., 'users/uid123/credits')
+            shallow: If True, child objects are returned as True (keys only)
+            fields: Child paths to fetch instead of the whole node (see read())
+            
+        Returns:
+            The data at the path, or None if not found or error occurs
+            (use read() to tell the two apart).
+        """
+        return self.read(path, shallow=shallow, fields=fields).value
+
+    def read(
+        self,
+        path: str,
+        shallow: bool = False,
+        fields: Optional[Sequence[str]] = None,
+    ) -> ReadResult:
+        """Retrieve data from the specified path, reporting why nothing was returned.
+        
+        With fields, only those children are downloaded, concurrently, and the
+        value is a dict of the fields that exist (e.g. fields=('balance',
+        'shards') of a credits node skips its ops and reservations).
+        
+        Args:
+            path: The database path (e.g., 'users/uid123/credits')
+            shallow: If True, child objects are returned as True (keys only)
+            fields: Child paths (may be nested, 'a/b') to project the node to
             
         Returns:
-            The data at the path, or None if not found or error occurs.
+            ReadResult with status found, not_found or unavailable.
         """
         try:
             if not self._is_available():
-                return None
-            ref = db.reference(path)
-            data = ref.get()
-            return data
+                return ReadResult(ReadResult.UNAVAILABLE, error=RTDBUnavailableError("backend not available"))
+            if fields is not None:
+                value = self._get_fields(path, list(fields), shallow)
+            else:
+                value = self._call("get", path, self.backend.get, path, shallow=shallow)
         except Exception as e:
             logger.warning(f"Error reading {path}: {e}")
-            return None
+            return ReadResult(ReadResult.UNAVAILABLE, error=e)
+        if value is None:
+            return ReadResult(ReadResult.NOT_FOUND)
+        return ReadResult(ReadResult.FOUND, value)
+
+    def _get_fields(self, path: str, fields: List[str], shallow: bool) -> Optional[Dict[str, Any]]:
+        """Fetch several children of path in parallel; None if none of them exists."""
+        paths = [join_path(path, field) for field in fields]
+        if len(paths) == 1:
+            values = [self._call("get", paths[0], self.backend.get, paths[0], shallow=shallow)]
+        else:
+            pool = self._get_read_pool()
+            # each task runs in a copy of our context so flow metrics count its round trip
+            futures = [
+                pool.submit(
+                    contextvars.copy_context().run,
+                    self._call, "get", child, self.backend.get, child, shallow=shallow,
+                )
+                for child in paths
+            ]
+            values = [future.result() for future in futures]
+        projected = {field: value for field, value in zip(fields, values) if value is not None}
+        return projected or None
+
+    def _get_read_pool(self) -> ThreadPoolExecutor:
+        if self._read_pool is None:
+            with self._read_pool_lock:
+                if self._read_pool is None:
+                    self._read_pool = ThreadPoolExecutor(
+                        max_workers=self.READ_CONCURRENCY,
+                        thread_name_prefix="fb_core-read",
+                    )
+        return self._read_pool
+
+    def exists(self, path: str) -> bool:
+        """Return True if a value is stored at path.
+        
+        Only the node's keys are transferred (shallow read); use
+        read(path, shallow=True) to tell a missing node from an unavailable backend.
+        
+        Args:
+            path: The database path
+            
+        Returns:
+            True if the node exists, False if it does not or on error.
+        """
+        return self.read(path, shallow=True).found
+
+    def list_keys(self, path: str, strict: bool = False) -> List[str]:
+        """List the child keys of a node without downloading the children.
+        
+        Args:
+            path: The database path (e.g., 'users' or 'users/uid123/env/default/output')
+            strict: If True, raise on a read error instead of returning []
+            
+        Returns:
+            Child keys in RTDB key order; empty if the node is missing, a leaf, or on error.
+            
+        Raises:
+            RTDBUnavailableError: If strict and the node could not be read
+        """
+        result = self.read(path, shallow=True)
+        if strict and not result.available:
+            raise RTDBUnavailableError(f"listing {path} failed: {result.error}")
+        value = result.value
+        if isinstance(value, list):
+            return [str(index) for index, child in enumerate(value) if child is not None]
+        if not isinstance(value, dict):
+            return []
+        return sorted(value, key=_key_order)
+
+    def iter_children(
+        self,
+        path: str,
+        order_by: str = KEY,
+        start_at: Any = None,
+        end_at: Any = None,
+        page_size: int = 500,
+        strict: bool = False,
+    ) -> Iterator[Tuple[str, Any]]:
+        """Yield the children of path in order, fetching one page per query.
+        
+        Only page_size children are held in memory at a time and the first
+        ones are yielded as soon as the first page arrives.
+        
+        Args:
+            path: The database path (e.g., 'users/uid123/env/default/history')
+            order_by: KEY to order by child key, otherwise a child path
+                (e.g. 'timestamp'; add an .indexOn rule for it)
+            start_at: Inclusive lower bound of the ordered value
+            end_at: Inclusive upper bound of the ordered value
+            page_size: Children fetched per query
+            strict: If True, raise on a read error instead of stopping early
+            
+        Yields:
+            (key, value) pairs; iteration stops early on a read error.
+            
+        Raises:
+            RTDBUnavailableError: If strict and a page could not be read
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be positive")
+        cursor = start_at
+        # keys already yielded whose ordered value equals the cursor
+        boundary: set = set()
+        while True:
+            try:
+                if not self._is_available():
+                    raise RTDBUnavailableError("backend not available")
+                page = self._call(
+                    "query",
+                    path,
+                    self.backend.query,
+                    path,
+                    order_by=order_by,
+                    start_at=cursor,
+                    end_at=end_at,
+                    limit=page_size + len(boundary),
+                )
+            except Exception as e:
+                if strict:
+                    raise RTDBUnavailableError(f"query {path} failed: {e}") from e
+                logger.warning(f"Error querying {path}: {e}")
+                return
+            fresh = [(key, value) for key, value in page if key not in boundary]
+            for key, value in fresh:
+                yield key, value
+            if len(page) < page_size + len(boundary) or not fresh:
+                return
+            # RTDB cursors are inclusive and value-only: resume at the last value
+            # and skip the children with that value that were already yielded
+            next_cursor = self._ordered_value(*fresh[-1], order_by)
+            if next_cursor != cursor:
+                boundary = set()
+            boundary.update(key for key, value in fresh if self._ordered_value(key, value, order_by) == next_cursor)
+            cursor = next_cursor
+
+    @staticmethod
+    def _ordered_value(key: str, value: Any, order_by: str) -> Any:
+        """Value a child is ordered by in a query."""
+        if order_by == KEY:
+            return key
+        for segment in split_path(order_by):
+            value = value.get(segment) if isinstance(value, dict) else None
+        return value
 
-    def update_data(self, path: str, data: Dict[str, Any]) -> bool:
+    def update_data(self, path: str, data: Dict[str, Any], strict: bool = False) -> bool:
         """Update data at the specified path in RTDB.
         
+        Updates containing server-side increments are not retried: after a
+        lost response the increment may already be applied, and sending it
+        again would count it twice.
+        
         Args:
             path: The database path
             data: Dictionary of data to update
+            strict: If True, raise instead of returning False
             
         Returns:
             True if successful, False otherwise.
+            
+        Raises:
+            RTDBUnavailableError: If strict and RTDB is unavailable
+            Exception: If strict, the backend's error for a rejected write
         """
         try:
             if not self._is_available():
+                if strict:
+                    raise RTDBUnavailableError("backend not available")
                 return False
-            ref = db.reference(path)
-            ref.update(data)
+            self._call("update", path, self.backend.update, path, data, retry=not _has_increment(data))
             return True
         except Exception as e:
+            if strict:
+                raise
             logger.warning(f"Error updating {path}: {e}")
             return False
 
+    def read_snapshot(self, path: str) -> Optional[Tuple[str, Any]]:
+        """Read a node with its ETag, to seed a later transact(snapshot=...).
+        
+        Args:
+            path: The database path
+            
+        Returns:
+            (etag, value), or None if the backend has no ETags (only the REST
+            transport does) or on error
+        """
+        get_with_etag = getattr(self.backend, "get_with_etag", None)
+        if get_with_etag is None:
+            return None
+        try:
+            if not self._is_available():
+                return None
+            return self._call("get", path, get_with_etag, path)
+        except Exception as e:
+            logger.warning(f"Error reading snapshot of {path}: {e}")
+            return None
+
     def transact(
         self,
         path: str,
         update_fn: Callable[[Any], Any],
+        snapshot: Optional[Tuple[str, Any]] = None,
     ) -> bool:
         """Perform an atomic transaction at the specified path.
         
         Args:
             path: The database path
-            update_fn: Function that takes current value and returns new value
+            update_fn: Function that takes current value and returns new value;
+                it may raise AbortTransaction to abort without writing
+            snapshot: (etag, value) from read_snapshot(); the first attempt
+                writes against it instead of reading the node first
             
         Returns:
             True if transaction was committed, False if aborted.
         """
+        # only ETag-aware backends take a snapshot
+        options = {"snapshot": snapshot} if snapshot is not None else {}
         try:
             if not self._is_available():
                 return False
-            ref = db.reference(path)
-            result = ref.transaction(update_fn)
-            # Firebase SDK returns (committed, result_data) tuple
-            # or just the committed boolean depending on SDK version
-            if isinstance(result, tuple):
-                return bool(result[0])
-            return bool(result)
+            if metrics.get_metrics() is None:
+                # backends raise TransactionAbortedError when the commit fails
+                self._call("transaction", path, self.backend.transaction, path, update_fn, **options)
+                return True
+            attempts = [0]
+
+            def _counted(current):
+                attempts[0] += 1
+                return update_fn(current)
+
+            try:
+                self._call("transaction", path, self.backend.transaction, path, _counted, **options)
+            finally:
+                metrics.record_transaction_attempts(attempts[0])
+            return True
+        except AbortTransaction:
+            # update_fn chose not to write
+            return False
         except Exception as e:
             logger.warning(f"Error in transaction on {path}: {e}")
             return False
@@ -109,6 +428,9 @@ class FBRTDBMgr:
     def set_data(self, path: str, data: Any) -> bool:
         """Set data at the specified path (overwrites existing).
         
+        Dicts are merged into the node, so an empty dict changes nothing (it
+        never deletes the node; use remove_data for that).
+        
         Args:
             path: The database path
             data: Data to set
@@ -119,12 +441,13 @@ class FBRTDBMgr:
         try:
             if not self._is_available():
                 return False
-            ref = db.reference(path)
             if isinstance(data, dict):
+                if not data:
+                    return True
                 # update merges, safe against accidental overwrites
-                ref.update(data)
+                self._call("update", path, self.backend.update, path, data, retry=not _has_increment(data))
             else:
-                ref.set(data)
+                self._call("set", path, self.backend.set, path, data, retry=not _has_increment(data))
             return True
         except Exception as e:
             logger.warning(f"Error setting {path}: {e}")
@@ -142,9 +465,167 @@ class FBRTDBMgr:
         try:
             if not self._is_available():
                 return False
-            ref = db.reference(path)
-            ref.delete()
+            self._call("delete", path, self.backend.delete, path)
             return True
         except Exception as e:
             logger.warning(f"Error removing {path}: {e}")
             return False
+
+    def listen(self, path: str, callback: Callable[[Any], None]) -> Optional[Any]:
+        """Stream changes at the specified path to callback.
+
+        Args:
+            path: The database path
+            callback: Called with events carrying event_type, path and data
+
+        Returns:
+            A registration whose close() stops the stream, or None on error.
+        """
+        try:
+            if not self._is_available():
+                return None
+            return self._call("listen", path, self.backend.listen, path, callback)
+        except Exception as e:
+            logger.warning(f"Error listening on {path}: {e}")
+            return None
+
+    def enable_write_behind(self, **options: Any) -> WriteBehindQueue:
+        """Start a write-behind queue for deferrable writes (history, ledger).
+        
+        Args:
+            **options: WriteBehindQueue options (max_batch, flush_interval_ms,
+                max_queue, overflow, spool_path, ...)
+            
+        Returns:
+            The running queue, also available as self.write_queue
+        """
+        if self.write_queue is None:
+            self.write_queue = WriteBehindQueue(self, **options)
+        return self.write_queue
+
+    def disable_write_behind(self, timeout: Optional[float] = 10.0) -> bool:
+        """Flush and stop the write-behind queue.
+        
+        Returns:
+            True if all queued writes were committed
+        """
+        queue, self.write_queue = self.write_queue, None
+        return queue.close(timeout) if queue is not None else True
+
+    def batch(self) -> "WriteBatch":
+        """Start a write batch that is flushed as one multi-path update.
+        
+        Returns:
+            A new WriteBatch bound to this manager
+        """
+        return WriteBatch(self)
+
+
+class WriteBatch:
+    """Accumulates path/value writes and flushes them as one root-level update.
+    
+    Staged writes follow set semantics (the value replaces the node, None
+    deletes it); update() stages one write per child so siblings are merged.
+    Overlapping paths are folded together because RTDB rejects a multi-path
+    update that contains both a path and one of its ancestors.
+    
+    Can be used as a context manager, committing on a clean exit.
+    """
+
+    def __init__(self, manager: FBRTDBMgr):
+        """Initialize an empty batch.
+        
+        Args:
+            manager: Database manager used to commit the batch
+        """
+        self.manager = manager
+        self._writes: Dict[str, Any] = {}
+        self._callbacks: List[Callable[[], None]] = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def __enter__(self) -> "WriteBatch":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+
+    @property
+    def writes(self) -> Dict[str, Any]:
+        """Copy of the staged path -> value mapping."""
+        return dict(self._writes)
+
+    def set(self, path: str, value: Any) -> "WriteBatch":
+        """Stage a write replacing the value at path.
+        
+        Args:
+            path: The database path
+            value: Data to set (None deletes the node)
+            
+        Returns:
+            The batch, for chaining
+        """
+        path = join_path(path)
+        if not path:
+            raise ValueError("Cannot stage a write to the database root")
+        prefix = path + "/"
+        for staged in list(self._writes):
+            if staged.startswith(prefix):
+                del self._writes[staged]
+            elif path.startswith(staged + "/"):
+                # fold into the staged ancestor instead of adding an overlapping path
+                node = self._writes[staged]
+                node = copy.deepcopy(node) if isinstance(node, dict) else {}
+                self._writes[staged] = node
+                segments = split_path(path[len(staged) + 1:])
+                for segment in segments[:-1]:
+                    child = node.get(segment)
+                    if not isinstance(child, dict):
+                        child = {}
+                        node[segment] = child
+                    node = child
+                node[segments[-1]] = value
+                return self
+        self._writes[path] = value
+        return self
+
+    def update(self, path: str, data: Dict[str, Any]) -> "WriteBatch":
+        """Stage a merge of data into the node at path.
+        
+        Args:
+            path: The database path
+            data: Dictionary of children to write
+            
+        Returns:
+            The batch, for chaining
+        """
+        for key, value in data.items():
+            self.set(join_path(path, key), value)
+        return self
+
+    def remove(self, path: str) -> "WriteBatch":
+        """Stage deletion of the node at path."""
+        return self.set(path, None)
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """Register a callback to run once the batch has been committed successfully."""
+        self._callbacks.append(callback)
+
+    def commit(self, strict: bool = False) -> bool:
+        """Flush all staged writes as a single multi-path update.
+        
+        Args:
+            strict: If True, raise instead of returning False (see update_data)
+            
+        Returns:
+            True if successful (or nothing was staged), False otherwise.
+        """
+        writes, self._writes = self._writes, {}
+        callbacks, self._callbacks = self._callbacks, []
+        committed = self.manager.update_data("/", writes, strict=strict) if writes else True
+        if committed:
+            for callback in callbacks:
+                callback()
+        return committed
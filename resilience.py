@@ -0,0 +1,197 @@
+"""
+Retries, backoff and circuit breaking for FBRTDBMgr operations.
+
+Errors are classified as retryable (network failures, timeouts, throttling,
+transaction contention) or permanent. Retryable errors are retried with
+jittered exponential backoff within a per-operation deadline, and a circuit
+breaker opens after repeated retryable failures so that calls fail fast
+while RTDB is unhealthy instead of each waiting for its own timeout.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from firebase_admin import exceptions as fb_exceptions
+
+from fb_core.backends import TransactionAbortedError
+
+logger = logging.getLogger(__name__)
+
+_RETRYABLE_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    TransactionAbortedError,
+    fb_exceptions.UnavailableError,
+    fb_exceptions.DeadlineExceededError,
+    fb_exceptions.InternalError,
+    fb_exceptions.ResourceExhaustedError,
+    fb_exceptions.UnknownError,
+    fb_exceptions.AbortedError,
+)
+
+
+class RTDBUnavailableError(Exception):
+    """RTDB could not serve the request (after retries, or the circuit is open)."""
+
+
+class CircuitOpenError(RTDBUnavailableError):
+    """Raised without calling RTDB while the circuit breaker is open."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Return True for transient errors worth retrying."""
+    if isinstance(error, _RETRYABLE_ERRORS):
+        return True
+    # requests/urllib3 connection errors surface as OSError subclasses
+    return isinstance(error, OSError) and not isinstance(error, (FileNotFoundError, PermissionError))
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker shared by all operations of a manager."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the breaker.
+
+        Args:
+            failure_threshold: Consecutive failed operations that open the circuit
+            reset_timeout: Seconds the circuit stays open before one probe call is let through
+            clock: Monotonic time source
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Return True if a call may go out now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                # let a single probe through
+                self._state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("RTDB circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("RTDB circuit opened after %d failures", self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def reset(self) -> None:
+        """Close the circuit, e.g. after a successful health check."""
+        self.record_success()
+
+
+class Resilience:
+    """Retry policy plus circuit breaker applied to every backend call of a manager."""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.05,
+        max_delay: float = 1.0,
+        deadline: Optional[float] = 10.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        """Initialize the policy.
+
+        Args:
+            max_attempts: Attempts per operation, including the first
+            base_delay: Backoff before the second attempt, doubled per attempt
+            max_delay: Upper bound of a single backoff
+            deadline: Seconds an operation may spend including retries (None = unbounded);
+                bound single requests with the app's httpTimeout option
+            breaker: Circuit breaker; a default one is created if omitted
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+    def call(self, operation: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn with retries; permanent errors are raised unchanged.
+
+        Args:
+            operation: Name used in log messages (e.g. 'get users/uid/credits')
+            fn: Backend call to run
+
+        Returns:
+            fn's result
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+            RTDBUnavailableError: If retryable errors persisted past the attempts or deadline
+        """
+        return self._call(operation, self.max_attempts, fn, args, kwargs)
+
+    def call_once(self, operation: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run fn once under the circuit breaker, for writes that must not be repeated.
+
+        A timeout does not tell whether the write was applied, so writes that
+        are not idempotent (server-side increments) are never retried.
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+            RTDBUnavailableError: If the call failed with a retryable error
+        """
+        return self._call(operation, 1, fn, args, kwargs)
+
+    def _call(self, operation: str, max_attempts: int, fn: Callable[..., Any], args: Any, kwargs: Any) -> Any:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"RTDB circuit open, {operation} not attempted")
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error):
+                    # the service answered, so it is healthy
+                    self.breaker.record_success()
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                elapsed = time.monotonic() - started
+                if attempt >= max_attempts or (self.deadline is not None and elapsed + delay > self.deadline):
+                    self.breaker.record_failure()
+                    raise RTDBUnavailableError(f"{operation} failed after {attempt} attempts: {error}") from error
+                logger.debug("Retrying %s after %s (attempt %d)", operation, error, attempt)
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
@@ -0,0 +1,369 @@
+"""
+Realtime Database REST transport for FBRTDBMgr.
+
+RestBackend speaks the RTDB REST protocol directly over one pooled
+keep-alive requests session instead of going through db.Reference, so pool
+size, compression and timeouts are under our control. Transactions are
+compare-and-set writes: a PUT carrying `if-match: <etag>` commits only if
+the node is unchanged, and a rejected write (412) returns the current value
+and ETag, so each retry costs one round trip. The ETag and value of the last
+committed transaction per path are remembered, which lets the next
+transaction on that node skip its initial read; callers holding a snapshot
+can pass it in as well. A stale ETag only costs one rejected write.
+
+    manager = FBRTDBMgr(RestBackend(app, pool_size=64))
+
+An http:// database URL (e.g. http://127.0.0.1:9000/?ns=demo) selects
+emulator mode: no Google credentials, the namespace is sent as `ns`.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, quote, urlparse
+
+import firebase_admin
+import requests
+from firebase_admin import exceptions as fb_exceptions
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+from fb_core.backends import (
+    KEY,
+    ListenerEvent,
+    RTDBBackend,
+    TransactionAbortedError,
+    _clone,
+    _key_order,
+    _normalize,
+    _value_order,
+    join_path,
+    split_path,
+)
+from fb_core.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# HTTP status -> FirebaseError subclass raised for it (5xx/429 are retryable in resilience)
+_STATUS_ERRORS = {
+    400: fb_exceptions.InvalidArgumentError,
+    401: fb_exceptions.UnauthenticatedError,
+    403: fb_exceptions.PermissionDeniedError,
+    404: fb_exceptions.NotFoundError,
+    409: fb_exceptions.ConflictError,
+    412: fb_exceptions.FailedPreconditionError,
+    429: fb_exceptions.ResourceExhaustedError,
+    500: fb_exceptions.InternalError,
+    503: fb_exceptions.UnavailableError,
+    504: fb_exceptions.DeadlineExceededError,
+}
+
+
+def _error_for(response: requests.Response) -> fb_exceptions.FirebaseError:
+    """Build the FirebaseError for a failed response."""
+    try:
+        message = response.json().get("error")
+    except (ValueError, AttributeError):
+        message = None
+    message = message or response.text or f"HTTP {response.status_code}"
+    if response.status_code in _STATUS_ERRORS:
+        error_class = _STATUS_ERRORS[response.status_code]
+    elif response.status_code >= 500:
+        error_class = fb_exceptions.UnavailableError
+    else:
+        error_class = fb_exceptions.UnknownError
+    return error_class(f"RTDB {response.request.method} failed: {message}", http_response=response)
+
+
+class _StreamListener:
+    """Server-sent events stream of one path, dispatched on a daemon thread."""
+
+    def __init__(self, backend: "RestBackend", path: str, callback: Callable[[Any], None]):
+        self._backend = backend
+        self._path = path
+        self._callback = callback
+        self._closed = threading.Event()
+        self._response: Optional[requests.Response] = None
+        self._thread = threading.Thread(target=self._run, name=f"fb_core-rest-listen {path}", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop the stream; no callbacks are made afterwards."""
+        self._closed.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def _run(self) -> None:
+        delay = 1.0
+        while not self._closed.is_set():
+            session = self._backend._new_session()
+            try:
+                response = session.get(
+                    self._backend._url(self._path),
+                    params=self._backend._params(),
+                    headers={"Accept": "text/event-stream"},
+                    stream=True,
+                    timeout=(self._backend.timeout[0], None),
+                )
+                self._response = response
+                if not response.ok:
+                    raise _error_for(response)
+                delay = 1.0
+                if not self._consume(response):
+                    return
+            except Exception as error:
+                if self._closed.is_set():
+                    return
+                logger.warning("RTDB stream on %s interrupted: %s", self._path, error)
+                self._closed.wait(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                session.close()
+
+    def _consume(self, response: requests.Response) -> bool:
+        """Dispatch events until the stream ends; False if it must not be reopened."""
+        event_type = None
+        for line in response.iter_lines(decode_unicode=True):
+            if self._closed.is_set():
+                return False
+            if line.startswith("event:"):
+                event_type = line[6:].strip()
+            elif line.startswith("data:") and event_type in ("put", "patch"):
+                payload = json.loads(line[5:].strip())
+                self._callback(ListenerEvent(event_type, payload.get("path", "/"), payload.get("data")))
+            elif line.startswith("data:") and event_type == "cancel":
+                logger.warning("RTDB stream on %s cancelled: %s", self._path, line[5:].strip())
+                return False
+            # auth_revoked: the stream ends and is reopened with a fresh token
+        return True
+
+
+class RestBackend(RTDBBackend):
+    """Backend that calls the Realtime Database REST API over a pooled session."""
+
+    def __init__(
+        self,
+        app: Optional[Any] = None,
+        database_url: Optional[str] = None,
+        pool_size: int = 32,
+        gzip: bool = True,
+        timeout: Union[float, Tuple[float, float]] = (3.05, 30.0),
+        max_retries: int = 25,
+        etag_cache_size: int = 4096,
+        etag_ttl: float = 300.0,
+    ):
+        """Initialize the backend.
+
+        Args:
+            app: Firebase app supplying credentials and databaseURL; defaults to the default app
+            database_url: Database URL overriding the app's databaseURL; an http:// URL
+                with ?ns=<namespace> talks to an emulator or local stand-in without credentials
+            pool_size: Keep-alive connections kept per host (also the concurrency limit)
+            gzip: Ask for gzip-compressed responses
+            timeout: Request timeout in seconds, or a (connect, read) pair
+            max_retries: Conditional writes per transaction before giving up
+            etag_cache_size: Paths whose last committed ETag and value are remembered
+            etag_ttl: Seconds a remembered ETag is used to skip the initial read
+        """
+        if app is None and database_url is None:
+            try:
+                app = firebase_admin.get_app()
+            except ValueError:
+                logger.warning("Firebase app not initialized. Some operations will fail.")
+        self.app = app
+        if database_url is None and app is not None:
+            database_url = app.options.get("databaseURL")
+        self.database_url = database_url
+        self.pool_size = pool_size
+        self.gzip = gzip
+        self.timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        self.max_retries = max_retries
+        self._etags = TTLCache(maxsize=etag_cache_size, ttl=etag_ttl)
+        self._base_url = None
+        self._namespace = None
+        if database_url:
+            parsed = urlparse(database_url)
+            self._base_url = f"{parsed.scheme}://{parsed.netloc}"
+            if parsed.scheme == "http":
+                self._namespace = (parse_qs(parsed.query).get("ns") or [parsed.netloc.split(".")[0]])[0]
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+
+    def _new_session(self) -> requests.Session:
+        if self._namespace is not None:
+            session = requests.Session()
+            # emulator admin token
+            session.headers["Authorization"] = "Bearer owner"
+        else:
+            session = AuthorizedSession(self.app.credential.get_credential())
+        # retries are left to FBRTDBMgr's resilience policy
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Accept-Encoding"] = "gzip" if self.gzip else "identity"
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """The shared keep-alive session, created on first use."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    def _url(self, path: str) -> str:
+        return f"{self._base_url}/{quote(join_path(path), safe='/')}.json"
+
+    def _params(self, **params: Any) -> Dict[str, Any]:
+        if self._namespace is not None:
+            params["ns"] = self._namespace
+        return params
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        body: Any = None,
+        allow: Tuple[int, ...] = (),
+    ) -> requests.Response:
+        data = None if method in ("GET", "DELETE") else json.dumps(body, separators=(",", ":"))
+        response = self.session.request(
+            method,
+            self._url(path),
+            params=self._params(**(params or {})),
+            headers=headers,
+            data=data,
+            timeout=self.timeout,
+        )
+        if not response.ok and response.status_code not in allow:
+            raise _error_for(response)
+        return response
+
+    def is_available(self) -> bool:
+        return self._base_url is not None and (self._namespace is not None or self.app is not None)
+
+    def invalidate(self) -> None:
+        self._etags.clear()
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def close(self) -> None:
+        """Close the pooled connections."""
+        self.invalidate()
+
+    def get(self, path: str, shallow: bool = False) -> Any:
+        params = {"shallow": "true"} if shallow else None
+        return self._request("GET", path, params=params).json()
+
+    def get_with_etag(self, path: str) -> Tuple[str, Any]:
+        """Read a node together with its ETag.
+
+        Returns:
+            (etag, value) tuple, usable as the snapshot of transaction()
+        """
+        response = self._request("GET", path, headers={"X-Firebase-ETag": "true"})
+        return response.headers["ETag"], response.json()
+
+    def set(self, path: str, value: Any) -> None:
+        self._request("PUT", path, params={"print": "silent"}, body=value)
+
+    def update(self, path: str, value: Dict[str, Any]) -> None:
+        if not isinstance(value, dict) or not value:
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        self._request("PATCH", path, params={"print": "silent"}, body=value)
+
+    def delete(self, path: str) -> None:
+        self._request("DELETE", path, params={"print": "silent"})
+
+    def transaction(
+        self,
+        path: str,
+        update_fn: Callable[[Any], Any],
+        snapshot: Optional[Tuple[str, Any]] = None,
+    ) -> Any:
+        """Atomically replace the value at path with update_fn(current).
+
+        Args:
+            path: Node to update
+            update_fn: Function of the current value returning the new value;
+                it may raise AbortTransaction to abort without writing
+            snapshot: (etag, value) the caller already holds (see get_with_etag);
+                the remembered ETag of the last transaction, or a fresh read, otherwise
+
+        Returns:
+            The committed value.
+
+        Raises:
+            TransactionAbortedError: If the node kept changing for max_retries writes.
+        """
+        key = join_path(path)
+        if snapshot is None:
+            snapshot = self._etags.get(key)
+        etag, current = snapshot if snapshot is not None else self.get_with_etag(path)
+        for attempt in range(self.max_retries):
+            new_value = _normalize(update_fn(_clone(current)))
+            response = self._request("PUT", path, headers={"if-match": etag}, body=new_value, allow=(412,))
+            if response.status_code == 412:
+                # lost the race: the rejection carries the current value and ETag
+                etag, current = response.headers["ETag"], response.json()
+                self._etags.pop(key)
+                # jittered backoff so hot nodes do not starve unlucky writers
+                time.sleep(random.uniform(0, min(0.1, 0.002 * 2 ** attempt)))
+                continue
+            new_etag = response.headers.get("ETag")
+            if new_etag is None:
+                # without an ETag the next transaction has to read the node again
+                self._etags.pop(key)
+            else:
+                self._etags.set(key, (new_etag, _clone(new_value)))
+            return new_value
+        raise TransactionAbortedError(f"Transaction at {path} aborted after {self.max_retries} attempts")
+
+    def query(
+        self,
+        path: str,
+        order_by: str = KEY,
+        start_at: Any = None,
+        end_at: Any = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[str, Any]]:
+        # query parameter values are JSON encoded
+        params = {"orderBy": json.dumps(order_by)}
+        if start_at is not None:
+            params["startAt"] = json.dumps(start_at)
+        if end_at is not None:
+            params["endAt"] = json.dumps(end_at)
+        if limit is not None:
+            params["limitToFirst"] = str(limit)
+        result = self._request("GET", path, params=params).json()
+        if isinstance(result, list):
+            result = {str(index): value for index, value in enumerate(result) if value is not None}
+        if not result:
+            return []
+        # JSON objects carry no order; restore the query order locally
+        if order_by == KEY:
+            keys = sorted(result, key=_key_order)
+        else:
+            child_path = split_path(order_by)
+
+            def order(key: str) -> Tuple[Any, ...]:
+                value = result[key]
+                for segment in child_path:
+                    value = value.get(segment) if isinstance(value, dict) else None
+                return _value_order(value), _key_order(key)
+
+            keys = sorted(result, key=order)
+        return [(key, result[key]) for key in keys]
+
+    def listen(self, path: str, callback: Callable[[Any], None]) -> _StreamListener:
+        return _StreamListener(self, path, callback)
+
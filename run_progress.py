@@ -0,0 +1,182 @@
+"""
+Throttled progress reporting for output runs.
+
+A RunProgress handle takes status, progress and metric updates at any rate,
+coalesces them in memory and writes only the fields that changed since the
+last write, at most once per min_interval. A trailing write makes sure the
+latest values reach RTDB after a burst, and terminal statuses (completed,
+error, ...) are written immediately. Only the changed children of the run
+node are updated, so created_at and recorded files are never rewritten.
+Handles are flushed on close and at interpreter shutdown.
+"""
+
+import atexit
+import logging
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from fb_core.db_admin import FirebaseAdmin
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = frozenset({"completed", "error", "failed", "cancelled"})
+RUN_PROGRESS_MIN_INTERVAL = 1.0
+
+_open_runs: "weakref.WeakSet[RunProgress]" = weakref.WeakSet()
+
+
+class RunProgress:
+    """Coalescing, rate-limited writer of one run's status, progress and metrics."""
+
+    def __init__(
+        self,
+        admin: "FirebaseAdmin",
+        run_id: str,
+        min_interval: float = RUN_PROGRESS_MIN_INTERVAL,
+    ):
+        """Initialize the handle; nothing is written until the first update.
+
+        Args:
+            admin: FirebaseAdmin of the user owning the run
+            run_id: Run identifier (its output space should exist)
+            min_interval: Minimum seconds between two writes of non-terminal updates
+        """
+        self.admin = admin
+        self.run_id = run_id
+        self.path = f"{admin.database}/output/{run_id}"
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        # serializes writes, so an older snapshot never lands after a newer one
+        self._write_lock = threading.Lock()
+        self._pending: Dict[str, Any] = {}
+        self._written: Dict[str, Any] = {}
+        self._last_write = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+        self.writes = 0
+        _open_runs.add(self)
+
+    def __enter__(self) -> "RunProgress":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self.status not in TERMINAL_STATUSES:
+            self.close(status="error", error=f"{exc_type.__name__}: {exc}")
+        else:
+            self.close()
+
+    @property
+    def status(self) -> Optional[str]:
+        """Latest status given to the handle (written or pending)."""
+        with self._lock:
+            return self._pending.get("status", self._written.get("status"))
+
+    def update(
+        self,
+        status: Optional[str] = None,
+        progress: Optional[float] = None,
+        **metrics: Any,
+    ) -> None:
+        """Record new values; they are written now or coalesced into a later write.
+
+        Args:
+            status: Run status ('running', 'completed', 'error', ...)
+            progress: Completion, e.g. a fraction or a percentage
+            **metrics: Values stored under the run's `metrics/{name}`
+        """
+        fields: Dict[str, Any] = {f"metrics/{name}": value for name, value in metrics.items()}
+        if status is not None:
+            fields["status"] = status
+        if progress is not None:
+            fields["progress"] = progress
+        self._merge(fields, immediate=status in TERMINAL_STATUSES)
+
+    def _merge(self, fields: Dict[str, Any], immediate: bool) -> None:
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"Run progress handle for {self.run_id} is closed")
+            for key, value in fields.items():
+                if self._written.get(key) == value:
+                    # back to the stored value: nothing to write for this field
+                    self._pending.pop(key, None)
+                else:
+                    self._pending[key] = value
+            if not self._pending:
+                return
+            wait = self.min_interval - (time.monotonic() - self._last_write)
+            if not immediate and wait > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self._on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self) -> bool:
+        """Write pending changes now.
+
+        Returns:
+            True if nothing was pending or the write succeeded; failed changes
+            stay pending for the next write
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                changes, self._pending = self._pending, {}
+                if not changes:
+                    return True
+                self._last_write = time.monotonic()
+            update_data = dict(changes, updated_at=datetime.now(timezone.utc).isoformat())
+            written = self.admin.db_manager.update_data(self.path, update_data)
+            with self._lock:
+                if written:
+                    self._written.update(changes)
+                    self.writes += 1
+                else:
+                    # keep newer values that arrived during the write
+                    for key, value in changes.items():
+                        self._pending.setdefault(key, value)
+                    logger.warning("Failed to write progress of run %s for %s", self.run_id, self.admin.user_id)
+            return written
+
+    def close(self, status: Optional[str] = None, **fields: Any) -> bool:
+        """Write a final update (if given) plus everything pending and stop the handle.
+
+        Args:
+            status: Final status, e.g. 'completed'
+            **fields: Extra run fields written with it (e.g. error message)
+
+        Returns:
+            True if all pending changes were written
+        """
+        with self._lock:
+            if self._closed:
+                return not self._pending
+            for key, value in fields.items():
+                self._pending[key] = value
+            if status is not None:
+                self._pending["status"] = status
+            self._closed = True
+            _open_runs.discard(self)
+        return self.flush()
+
+
+@atexit.register
+def flush_all_runs() -> None:
+    """Flush every open run progress handle in this process (run automatically at exit)."""
+    for run in list(_open_runs):
+        try:
+            run.close()
+        except Exception as error:
+            logger.warning("Failed to flush run progress at shutdown: %s", error)
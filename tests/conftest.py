@@ -0,0 +1,87 @@
+"""
+Shared fixtures: an in-memory RTDB with switchable failures and clean caches.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+from typing import Any, Callable, Dict, Set
+
+import pytest
+
+# the checkout is the fb_core package itself; import it from here when it is not installed
+if importlib.util.find_spec("fb_core") is None:
+    _ROOT = Path(__file__).resolve().parent.parent
+    _spec = importlib.util.spec_from_file_location(
+        "fb_core", _ROOT / "__init__.py", submodule_search_locations=[str(_ROOT)]
+    )
+    sys.modules["fb_core"] = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules["fb_core"])
+
+from fb_core import db_admin
+from fb_core.backends import InMemoryBackend
+from fb_core.real_time_database import FBRTDBMgr
+from fb_core.resilience import CircuitBreaker, Resilience
+
+
+class FlakyBackend(InMemoryBackend):
+    """InMemoryBackend whose calls fail with ConnectionError while listed in `down`."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.down: Set[str] = set()
+
+    def _check(self, op: str) -> None:
+        if op in self.down:
+            raise ConnectionError(f"{op} unavailable")
+
+    def get(self, path: str, shallow: bool = False) -> Any:
+        self._check("get")
+        return super().get(path, shallow=shallow)
+
+    def query(self, path: str, *args: Any, **kwargs: Any) -> Any:
+        self._check("query")
+        return super().query(path, *args, **kwargs)
+
+    def set(self, path: str, value: Any) -> None:
+        self._check("set")
+        super().set(path, value)
+
+    def update(self, path: str, value: Dict[str, Any]) -> None:
+        self._check("update")
+        super().update(path, value)
+
+    def transaction(self, path: str, update_fn: Callable[[Any], Any]) -> Any:
+        self._check("transaction")
+        return super().transaction(path, update_fn)
+
+
+@pytest.fixture(autouse=True)
+def clean_caches():
+    """Process-wide caches must not leak results between tests."""
+    db_admin.clear_balance_cache()
+    db_admin.clear_known_spaces_cache()
+    db_admin._seen_operations.clear()
+    yield
+    db_admin.clear_balance_cache()
+    db_admin.clear_known_spaces_cache()
+    db_admin._seen_operations.clear()
+
+
+@pytest.fixture
+def backend() -> FlakyBackend:
+    return FlakyBackend()
+
+
+@pytest.fixture
+def manager(backend: FlakyBackend) -> FBRTDBMgr:
+    # one attempt and a breaker that never opens keep failure tests fast and independent
+    resilience = Resilience(max_attempts=1, breaker=CircuitBreaker(failure_threshold=1_000_000))
+    manager = FBRTDBMgr(backend=backend, resilience=resilience)
+    yield manager
+    manager.disable_write_behind(timeout=1.0)
+
+
+@pytest.fixture
+def admin(manager: FBRTDBMgr) -> db_admin.FirebaseAdmin:
+    return db_admin.FirebaseAdmin("user-1", db_manager=manager)
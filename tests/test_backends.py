@@ -0,0 +1,100 @@
+"""
+InMemoryBackend semantics the managers rely on (they mirror RTDB's).
+"""
+
+import threading
+
+import pytest
+
+from fb_core.backends import KEY, AbortTransaction, InMemoryBackend
+
+
+def test_set_replaces_and_update_merges():
+    backend = InMemoryBackend()
+    backend.set("a", {"x": 1, "y": 2})
+    backend.set("a", {"x": 3})
+    assert backend.get("a") == {"x": 3}
+
+    backend.update("a", {"y": 4, "z/w": 5})
+    assert backend.get("a") == {"x": 3, "y": 4, "z": {"w": 5}}
+
+
+def test_update_rejects_empty_and_overlapping_paths():
+    backend = InMemoryBackend()
+    with pytest.raises(ValueError):
+        backend.update("a", {})
+    with pytest.raises(ValueError):
+        backend.update("a", {"b": 1, "b/c": 2})
+
+
+def test_none_and_empty_values_delete_and_prune_parents():
+    backend = InMemoryBackend({"a": {"b": {"c": 1}, "d": 2}})
+    backend.set("a/b/c", None)
+    assert backend.get("a") == {"d": 2}
+
+    backend.set("a/d", {})
+    assert backend.get("a") is None
+
+
+def test_reads_return_copies():
+    backend = InMemoryBackend({"a": {"b": 1}})
+    value = backend.get("a")
+    value["b"] = 2
+    assert backend.get("a/b") == 1
+
+
+def test_shallow_get_returns_keys_only():
+    backend = InMemoryBackend({"a": {"leaf": 1, "node": {"deep": 2}}})
+    assert backend.get("a", shallow=True) == {"leaf": 1, "node": True}
+
+
+def test_query_orders_by_key_and_child_with_bounds():
+    backend = InMemoryBackend({"h": {"b": {"t": 2}, "a": {"t": 3}, "c": {"t": 1}}})
+    assert [key for key, _ in backend.query("h", order_by=KEY)] == ["a", "b", "c"]
+    assert [key for key, _ in backend.query("h", order_by="t")] == ["c", "b", "a"]
+    assert [key for key, _ in backend.query("h", order_by="t", start_at=2, limit=1)] == ["b"]
+    assert [key for key, _ in backend.query("h", order_by=KEY, end_at="b")] == ["a", "b"]
+
+
+def test_server_increment_resolves_against_stored_value():
+    backend = InMemoryBackend({"n": 2})
+    backend.update("/", {"n": {".sv": {"increment": 3}}, "m": {".sv": {"increment": 1}}})
+    assert backend.get("n") == 5
+    assert backend.get("m") == 1
+
+
+def test_transaction_abort_leaves_node_unchanged():
+    backend = InMemoryBackend({"n": 1})
+
+    def _abort(current):
+        raise AbortTransaction()
+
+    with pytest.raises(AbortTransaction):
+        backend.transaction("n", _abort)
+    assert backend.get("n") == 1
+
+
+def test_concurrent_transactions_do_not_lose_increments():
+    backend = InMemoryBackend({"n": 0})
+
+    def _bump():
+        for _ in range(50):
+            backend.transaction("n", lambda current: (current or 0) + 1)
+
+    threads = [threading.Thread(target=_bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.get("n") == 200
+
+
+def test_listener_gets_current_value_and_changes():
+    backend = InMemoryBackend({"a": {"b": 1}})
+    events = []
+    registration = backend.listen("a", lambda event: events.append(event.data))
+    backend.set("a/b", 2)
+    backend.set("other", 1)
+    registration.close()
+    backend.set("a/b", 3)
+    assert events == [{"b": 1}, {"b": 2}]
@@ -0,0 +1,71 @@
+"""
+Ledger compaction: checkpoints, progress markers and failed reads.
+"""
+
+from datetime import datetime, timezone
+
+from fb_core.compaction import compact_ledger
+
+NOW = datetime(2026, 6, 1, tzinfo=timezone.utc)
+
+
+def _seed(backend, admin):
+    backend.set(f"{admin.database}/ledger", {
+        "op-1": {"type": "add_credits", "amount": 5, "new_balance": 5, "timestamp": "2026-01-01T10:00:00+00:00"},
+        "op-2": {"type": "deduct_credits", "amount": 2, "new_balance": 3, "timestamp": "2026-01-01T11:00:00+00:00"},
+        "op-3": {"type": "add_credits", "amount": 1, "new_balance": 4, "timestamp": "2026-05-31T12:00:00+00:00"},
+    })
+    backend.set(f"{admin.database}/ledger_checkpoints/2026-01-01", {
+        "day": "2026-01-01",
+        "entries": 10,
+        "by_type": {"add_credits": {"count": 10, "amount": 50}},
+    })
+
+
+def _fail_reads_of(backend, fragment):
+    """Make reads below paths containing fragment fail; returns the restoring function."""
+    get = backend.get
+
+    def _get(path, shallow=False):
+        if fragment in path:
+            raise ConnectionError("get unavailable")
+        return get(path, shallow=shallow)
+
+    backend.get = _get
+    return lambda: setattr(backend, "get", get)
+
+
+def test_old_entries_are_merged_into_the_days_checkpoint(admin, backend):
+    _seed(backend, admin)
+
+    assert compact_ledger(admin, NOW.replace(month=3)) == 2
+
+    checkpoint = backend.get(f"{admin.database}/ledger_checkpoints/2026-01-01")
+    assert checkpoint["entries"] == 12
+    assert checkpoint["by_type"]["add_credits"] == {"count": 11, "amount": 55}
+    assert checkpoint["closing_balance"] == 3
+    assert list(backend.get(f"{admin.database}/ledger")) == ["op-3"]
+    assert backend.get(f"{admin.database}/compaction/ledger")["compacted"] == 2
+
+
+def test_unreadable_checkpoint_keeps_the_ledger(admin, backend):
+    _seed(backend, admin)
+    restore = _fail_reads_of(backend, "ledger_checkpoints")
+
+    assert compact_ledger(admin, NOW.replace(month=3)) == 0
+    restore()
+
+    assert len(backend.get(f"{admin.database}/ledger")) == 3
+    assert backend.get(f"{admin.database}/ledger_checkpoints/2026-01-01")["entries"] == 10
+
+
+def test_unreadable_progress_does_not_reset_the_marker(admin, backend):
+    _seed(backend, admin)
+    backend.set(f"{admin.database}/compaction/ledger", {"compacted": 40})
+    restore = _fail_reads_of(backend, "compaction/")
+
+    assert compact_ledger(admin, NOW.replace(month=3)) == 0
+    restore()
+
+    assert backend.get(f"{admin.database}/compaction/ledger") == {"compacted": 40}
+    assert len(backend.get(f"{admin.database}/ledger")) == 3
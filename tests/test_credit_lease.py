@@ -0,0 +1,94 @@
+"""
+Credit leases: retried reservations and settlements, expired reservations.
+"""
+
+import time
+
+import pytest
+
+from fb_core import db_admin
+from fb_core.real_time_database import FBRTDBMgr
+from fb_core.resilience import CircuitBreaker, Resilience, RTDBUnavailableError
+
+
+@pytest.fixture
+def retrying_admin(backend):
+    # two attempts, so a commit whose response was lost is sent again
+    resilience = Resilience(max_attempts=2, base_delay=0, breaker=CircuitBreaker(failure_threshold=1_000_000))
+    manager = FBRTDBMgr(backend=backend, resilience=resilience)
+    yield db_admin.FirebaseAdmin("user-1", db_manager=manager)
+    manager.disable_write_behind(timeout=1.0)
+
+
+def _lose_next_response(backend):
+    """Commit the next transaction but report a connection error to the caller."""
+    transaction = backend.transaction
+
+    def _lost(path, update_fn):
+        backend.transaction = transaction
+        transaction(path, update_fn)
+        raise ConnectionError("response lost")
+
+    backend.transaction = _lost
+
+
+def _credits(backend, admin):
+    return backend.get(f"{admin.database}/credits")
+
+
+def test_lost_reservation_response_reserves_once(retrying_admin, backend):
+    retrying_admin.add_credits_atomic(100, "fund")
+    lease = retrying_admin.reserve_credits(10)
+
+    _lose_next_response(backend)
+    lease.deduct(1)
+
+    reserved = _credits(backend, retrying_admin)["reserved"]
+    assert [entry["amount"] for entry in reserved.values()] == [10]
+    assert lease.close()["settled"] is True
+    assert retrying_admin.get_credits(use_cache=False) == 99
+
+
+def test_lost_settlement_response_refunds_once(retrying_admin, backend):
+    retrying_admin.add_credits_atomic(100, "fund")
+    lease = retrying_admin.reserve_credits(10)
+    lease.deduct(3)
+
+    _lose_next_response(backend)
+    summary = lease.close()
+
+    assert summary["settled"] is True
+    assert summary["consumed"] == 3
+    assert retrying_admin.get_credits(use_cache=False) == 97
+    assert not _credits(backend, retrying_admin).get("reserved")
+
+
+def test_expired_reservation_is_recovered_and_late_settlement_charged(admin, backend):
+    admin.add_credits_atomic(100, "fund")
+    lease = admin.reserve_credits(10, ttl_seconds=0)
+    lease.deduct(4)
+    time.sleep(0.01)
+
+    assert admin.recover_expired_leases() == 10
+    assert admin.get_credits(use_cache=False) == 100
+    assert admin.recover_expired_leases() == 0
+
+    assert lease.close()["settled"] is True
+    assert admin.get_credits(use_cache=False) == 96
+
+
+def test_recovery_without_expired_reservations_writes_nothing(admin, backend):
+    admin.add_credits_atomic(100, "fund")
+    lease = admin.reserve_credits(10, ttl_seconds=60)
+    lease.deduct(1)
+    before = _credits(backend, admin)
+
+    assert admin.recover_expired_leases() == 0
+    assert _credits(backend, admin) == before
+    lease.close()
+
+
+def test_failed_recovery_raises(admin, backend):
+    backend.down.add("transaction")
+    with pytest.raises(RTDBUnavailableError):
+        admin.recover_expired_leases()
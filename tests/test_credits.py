@@ -0,0 +1,143 @@
+"""
+Idempotent credit operations, failed transactions and the shard migration.
+"""
+
+import pytest
+
+from fb_core import db_admin
+from fb_core.resilience import RTDBUnavailableError
+
+
+def _ledger(backend, admin):
+    return backend.get(f"{admin.database}/ledger") or {}
+
+
+def test_retried_operation_is_applied_once(admin):
+    first = admin.add_credits_atomic(10, "op-1")
+    db_admin._seen_operations.clear()
+
+    retry = admin.add_credits_atomic(10, "op-1")
+
+    assert retry["duplicate"] is True
+    assert retry["new_balance"] == first["new_balance"] == 10
+    assert admin.get_credits(use_cache=False) == 10
+
+
+def test_failed_add_is_not_recorded_and_can_be_retried(admin, backend):
+    backend.down.add("transaction")
+    with pytest.raises(RTDBUnavailableError):
+        admin.add_credits_atomic(100, "op-1")
+    assert _ledger(backend, admin) == {}
+    assert db_admin._seen_operations.get((admin.database, "op-1")) is None
+
+    backend.down.clear()
+    result = admin.add_credits_atomic(100, "op-1")
+
+    assert not result.get("duplicate")
+    assert result["new_balance"] == 100
+    assert admin.get_credits(use_cache=False) == 100
+
+
+def test_failed_deduct_raises_instead_of_deducting_nothing(admin, backend):
+    admin.add_credits_atomic(5, "fund")
+    backend.down.add("transaction")
+
+    with pytest.raises(RTDBUnavailableError):
+        admin.deduct_credits_atomic(3, "op-2")
+
+    backend.down.clear()
+    assert admin.deduct_credits_atomic(3, "op-2")["deducted"] == 3
+    assert admin.get_credits(use_cache=False) == 2
+
+
+def test_failed_transaction_does_not_cache_a_balance(admin, backend):
+    admin.add_credits_atomic(7, "fund")
+    db_admin.clear_balance_cache()
+    backend.down.add("transaction")
+
+    with pytest.raises(RTDBUnavailableError):
+        admin.add_credits_atomic(1, "op-3")
+
+    assert db_admin._balance_cache.get(admin.database) is None
+    assert admin.get_credits() == 7
+
+
+def test_insufficient_credits_still_raise_value_error(admin):
+    admin.add_credits_atomic(2, "fund")
+    with pytest.raises(ValueError, match="insufficient credits"):
+        admin.deduct_credits_atomic(5, "op-4")
+    assert admin.get_credits(use_cache=False) == 2
+
+
+def test_retry_after_inline_record_expired_is_found_in_ledger(admin, backend):
+    admin.add_credits_atomic(3, "op-5")
+    db_admin._seen_operations.clear()
+    backend.set(f"{admin.database}/credits/ops", None)
+
+    assert admin.add_credits_atomic(3, "op-5", check_ledger=True)["duplicate"] is True
+    assert admin.get_credits(use_cache=False) == 3
+
+
+def test_operations_do_not_depend_on_the_ledger(admin, backend):
+    admin.add_credits_atomic(3, "op-6")
+    db_admin._seen_operations.clear()
+    get = backend.get
+
+    def _get(path, shallow=False):
+        if "/ledger" in path:
+            raise ConnectionError("get unavailable")
+        return get(path, shallow=shallow)
+
+    backend.get = _get
+    assert admin.deduct_credits_atomic(1, "op-7")["deducted"] == 1
+    # an unreadable ledger falls back to the inline record
+    assert admin.add_credits_atomic(3, "op-6", check_ledger=True)["duplicate"] is True
+    backend.get = get
+
+    assert admin.get_credits(use_cache=False) == 2
+
+
+def test_migration_keeps_pre_migration_operations_idempotent(admin, backend):
+    admin.add_credits_atomic(7, "op-before")
+    # only the inline record is left, e.g. the ledger write was still queued
+    backend.set(f"{admin.database}/ledger", None)
+    db_admin._seen_operations.clear()
+
+    assert admin.migrate_credits_to_shards(4) == 7
+    retry = admin.add_credits_atomic(7, "op-before")
+
+    assert retry["duplicate"] is True
+    assert admin.get_credits(use_cache=False) == 7
+    credits = backend.get(f"{admin.database}/credits")
+    assert "ops" not in credits
+    assert credits["balance"] == 0
+    assert sum(shard["balance"] for shard in credits["shards"].values()) == 7
+
+
+def test_sharded_operations_after_migration(admin):
+    admin.add_credits_atomic(10, "fund")
+    admin.migrate_credits_to_shards(3)
+
+    added = admin.add_credits_atomic(5, "op-add")
+    deducted = admin.deduct_credits_atomic(12, "op-deduct")
+    db_admin._seen_operations.clear()
+
+    assert added["new_balance"] == 15
+    assert deducted["deducted"] == 12
+    assert admin.deduct_credits_atomic(12, "op-deduct")["duplicate"] is True
+    assert admin.get_credits(use_cache=False) == 3
+
+
+def test_remigration_moves_records_of_dropped_shards(admin, backend):
+    admin.add_credits_atomic(10, "fund")
+    admin.migrate_credits_to_shards(8)
+    for index in range(8):
+        admin.add_credits_atomic(1, f"op-{index}")
+    backend.set(f"{admin.database}/ledger", None)
+    db_admin._seen_operations.clear()
+
+    admin.migrate_credits_to_shards(2)
+
+    for index in range(8):
+        assert admin.add_credits_atomic(1, f"op-{index}")["duplicate"] is True
+    assert admin.get_credits(use_cache=False) == 18
@@ -0,0 +1,67 @@
+"""
+User export: JSON lines parts, strict reads and resuming from a checkpoint.
+"""
+
+import gzip
+import json
+
+import pytest
+
+from fb_core.export import FORMAT_JSONL, UserExporter
+from fb_core.resilience import RTDBUnavailableError
+
+
+def _seed(backend, *user_ids):
+    for index, user_id in enumerate(user_ids):
+        backend.set(f"users/{user_id}/env/default", {
+            "credits": {"balance": 10 + index, "ops": {"op": {"type": "add_credits"}}},
+            "ledger": {"op-1": {"type": "add_credits", "amount": 10 + index, "timestamp": "2026-01-01"}},
+        })
+
+
+def _rows(output_dir, table):
+    rows = []
+    for part in sorted((output_dir / table / "env=default").iterdir()):
+        with gzip.open(part, "rt", encoding="utf-8") as lines:
+            rows.extend(json.loads(line) for line in lines)
+    return rows
+
+
+def test_export_writes_rows_per_table(manager, backend, tmp_path):
+    _seed(backend, "u1", "u2")
+
+    report = UserExporter(manager, str(tmp_path), file_format=FORMAT_JSONL).run()
+
+    assert report["users"] == 2
+    assert report["rows"]["credits"] == report["rows"]["ledger"] == 2
+    assert sorted(row["balance"] for row in _rows(tmp_path, "credits")) == [10, 11]
+    # inline op records are bookkeeping, not exported
+    assert all(row["extra"] is None for row in _rows(tmp_path, "credits"))
+
+
+def test_failed_read_resumes_after_the_last_checkpoint(manager, backend, tmp_path):
+    _seed(backend, "u1", "u2")
+    get = backend.get
+
+    def _get(path, shallow=False):
+        if path.startswith("users/u2"):
+            raise ConnectionError("get unavailable")
+        return get(path, shallow=shallow)
+
+    backend.get = _get
+    with pytest.raises(RTDBUnavailableError):
+        UserExporter(manager, str(tmp_path), file_format=FORMAT_JSONL, users_per_checkpoint=1, max_workers=1).run()
+    backend.get = get
+    # a long export: part numbers outgrow their zero padding
+    checkpoint_path = tmp_path / "_checkpoint.json"
+    checkpoint = json.loads(checkpoint_path.read_text())
+    checkpoint_path.write_text(json.dumps(dict(checkpoint, part_seq=200_000)))
+    stale = tmp_path / "ledger" / "env=default" / "part-1000001.jsonl.gz"
+    stale.write_bytes(gzip.compress(b'{"user_id": "u2"}\n'))
+
+    report = UserExporter(manager, str(tmp_path), file_format=FORMAT_JSONL, users_per_checkpoint=1).run()
+
+    assert report["resumed_after"] == "u1"
+    assert report["users"] == 1
+    assert not stale.exists()
+    assert sorted(row["user_id"] for row in _rows(tmp_path, "ledger")) == ["u1", "u2"]
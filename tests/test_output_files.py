@@ -0,0 +1,63 @@
+"""
+Streaming output files to a run in chunks with server-side running totals.
+"""
+
+from fb_core import db_admin
+from fb_core.real_time_database import FBRTDBMgr
+from fb_core.resilience import CircuitBreaker, Resilience
+
+
+def _files(count, size=10):
+    for index in range(count):
+        yield {"name": f"f{index}.txt", "size_bytes": size}
+
+
+def _run(backend, admin, run_id):
+    return backend.get(f"{admin.database}/output/{run_id}")
+
+
+def test_files_are_written_in_bounded_chunks_with_totals(admin, backend):
+    result = admin.stream_output_files("run-1", _files(10), status="completed", max_chunk_files=3)
+
+    assert result["success"] is True
+    assert (result["files"], result["bytes"], result["chunks"]) == (10, 100, 4)
+    run = _run(backend, admin, "run-1")
+    assert len(run["files"]) == run["file_count"] == 10
+    assert run["total_bytes"] == 100
+    assert run["status"] == "completed"
+
+
+def test_chunks_are_bounded_by_size(admin):
+    result = admin.stream_output_files("run-1", _files(6), max_chunk_bytes=1)
+
+    assert result["chunks"] == 6
+
+
+def test_repeated_calls_accumulate(admin, backend):
+    admin.stream_output_files("run-1", _files(2))
+    admin.stream_output_files("run-1", _files(3, size=5))
+
+    run = _run(backend, admin, "run-1")
+    assert run["file_count"] == 5
+    assert run["total_bytes"] == 35
+
+
+def test_chunk_with_lost_response_is_not_counted_twice(backend):
+    update = backend.update
+    lost = []
+
+    def _lose_first_response(path, value):
+        update(path, value)
+        if not lost:
+            lost.append(path)
+            raise TimeoutError("response lost")
+
+    backend.update = _lose_first_response
+    resilience = Resilience(max_attempts=3, base_delay=0, breaker=CircuitBreaker(failure_threshold=1_000_000))
+    admin = db_admin.FirebaseAdmin("user-1", db_manager=FBRTDBMgr(backend=backend, resilience=resilience))
+
+    result = admin.stream_output_files("run-1", _files(4), max_chunk_files=2)
+
+    assert result["success"] is False
+    run = _run(backend, admin, "run-1")
+    assert run["file_count"] == len(run["files"]) == 2
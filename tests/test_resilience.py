@@ -0,0 +1,105 @@
+"""
+Retry policy and circuit breaker around backend calls.
+"""
+
+import pytest
+
+from fb_core.backends import TransactionAbortedError
+from fb_core.real_time_database import FBRTDBMgr
+from fb_core.resilience import CircuitBreaker, CircuitOpenError, Resilience, RTDBUnavailableError, is_retryable
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _failing(errors):
+    calls = []
+
+    def _call():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    return _call, calls
+
+
+def test_transient_errors_are_classified_as_retryable():
+    assert is_retryable(ConnectionError())
+    assert is_retryable(TimeoutError())
+    assert is_retryable(TransactionAbortedError("contention"))
+    assert not is_retryable(ValueError("rejected"))
+    assert not is_retryable(PermissionError())
+
+
+def test_retryable_error_is_retried_until_it_succeeds():
+    resilience = Resilience(max_attempts=3, base_delay=0)
+    call, calls = _failing([ConnectionError(), TimeoutError()])
+
+    assert resilience.call("get a", call) == "ok"
+    assert len(calls) == 3
+
+
+def test_exhausted_retries_raise_unavailable():
+    resilience = Resilience(max_attempts=2, base_delay=0)
+    call, calls = _failing([ConnectionError()] * 5)
+
+    with pytest.raises(RTDBUnavailableError):
+        resilience.call("get a", call)
+    assert len(calls) == 2
+
+
+def test_permanent_error_is_raised_unchanged_without_retry():
+    resilience = Resilience(max_attempts=3, base_delay=0)
+    call, calls = _failing([ValueError("rejected")])
+
+    with pytest.raises(ValueError):
+        resilience.call("set a", call)
+    assert len(calls) == 1
+
+
+def test_call_once_does_not_retry():
+    resilience = Resilience(max_attempts=3, base_delay=0)
+    call, calls = _failing([ConnectionError()])
+
+    with pytest.raises(RTDBUnavailableError):
+        resilience.call_once("update a", call)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_fails_fast_and_probes_after_the_timeout():
+    clock = _Clock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30.0, clock=clock)
+    resilience = Resilience(max_attempts=1, base_delay=0, breaker=breaker)
+    call, calls = _failing([ConnectionError()] * 2)
+    for _ in range(2):
+        with pytest.raises(RTDBUnavailableError):
+            resilience.call("get a", call)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        resilience.call("get a", call)
+    assert len(calls) == 2
+
+    clock.now = 30.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert resilience.call("get a", call) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_manager_reports_open_circuit_as_unavailable(backend):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    manager = FBRTDBMgr(backend=backend, resilience=Resilience(max_attempts=1, breaker=breaker))
+    backend.down.add("get")
+
+    assert not manager.read("a").available
+    backend.down.clear()
+    result = manager.read("a")
+
+    assert not result.available
+    assert isinstance(result.error, CircuitOpenError)
@@ -0,0 +1,72 @@
+"""
+REST transport against the local stand-in server: ETag snapshots and conditional writes.
+"""
+
+import pytest
+
+from fb_core.backends import AbortTransaction
+from fb_core.bench import RestStandInServer
+from fb_core.real_time_database import FBRTDBMgr
+from fb_core.rest_backend import RestBackend
+
+
+@pytest.fixture
+def server():
+    with RestStandInServer() as server:
+        yield server
+
+
+@pytest.fixture
+def rest_manager(server):
+    manager = FBRTDBMgr(RestBackend(database_url=server.url))
+    yield manager
+    manager.backend.close()
+
+
+def _bump(current):
+    return dict(current or {}, n=int((current or {}).get("n") or 0) + 1)
+
+
+def test_snapshot_seeds_the_transaction_without_a_read(rest_manager, server):
+    rest_manager.set_data("a/n", 1)
+    snapshot = rest_manager.read_snapshot("a")
+    assert snapshot[1] == {"n": 1}
+
+    before = server.round_trips
+    assert rest_manager.transact("a", _bump, snapshot=snapshot)
+
+    assert server.round_trips - before == 1
+    assert rest_manager.get_data("a") == {"n": 2}
+
+
+def test_stale_snapshot_is_retried_against_the_current_value(rest_manager, server):
+    rest_manager.set_data("a/n", 1)
+    stale = rest_manager.read_snapshot("a")
+    assert rest_manager.transact("a", _bump, snapshot=stale)
+
+    assert rest_manager.transact("a", _bump, snapshot=stale)
+    assert rest_manager.get_data("a") == {"n": 3}
+
+
+def test_committed_etag_is_reused_by_the_next_transaction(rest_manager, server):
+    assert rest_manager.transact("a", _bump)
+    before = server.round_trips
+
+    assert rest_manager.transact("a", _bump)
+
+    assert server.round_trips - before == 1
+    assert rest_manager.get_data("a") == {"n": 2}
+
+
+def test_aborted_transaction_writes_nothing(rest_manager):
+    rest_manager.set_data("a/n", 1)
+
+    def _abort(current):
+        raise AbortTransaction()
+
+    assert not rest_manager.transact("a", _abort, snapshot=rest_manager.read_snapshot("a"))
+    assert rest_manager.get_data("a") == {"n": 1}
+
+
+def test_backends_without_etags_take_no_snapshot(manager):
+    assert manager.read_snapshot("a") is None
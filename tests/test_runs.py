@@ -0,0 +1,18 @@
+"""
+Output runs: created_at is written once, without reading the run first.
+"""
+
+
+def test_created_at_is_written_with_the_first_update_only(admin, backend):
+    backend.down.add("get")
+    run_id = admin.ensure_output_space("run-1")
+    run_path = f"{admin.database}/output/{run_id}"
+    backend.down.clear()
+    created_at = backend.get(f"{run_path}/created_at")
+    assert isinstance(created_at, int)
+
+    admin.ensure_output_space(run_id, status="completed")
+
+    run = backend.get(run_path)
+    assert run["created_at"] == created_at
+    assert run["status"] == "completed"
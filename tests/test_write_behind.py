@@ -0,0 +1,136 @@
+"""
+Write-behind queue: interval flushes, bounded retries and dead letters.
+"""
+
+import time
+
+import pytest
+
+from fb_core.write_behind import WriteBehindQueue
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_single_write_is_flushed_after_the_interval(manager, backend):
+    queue = WriteBehindQueue(manager, max_batch=500, flush_interval_ms=20)
+    try:
+        queue.enqueue("events/a", {"n": 1})
+        assert _wait_for(lambda: backend.get("events/a") == {"n": 1}, timeout=1.0)
+    finally:
+        queue.close()
+
+
+def test_rejected_write_is_isolated_and_dead_lettered(manager, backend):
+    update = backend.update
+
+    def _reject_bad(path, value):
+        if any("bad" in key for key in value):
+            raise ValueError("rejected by rules")
+        update(path, value)
+
+    backend.update = _reject_bad
+    queue = WriteBehindQueue(manager, max_batch=100, flush_interval_ms=10, retry_delay_ms=1)
+    try:
+        for index in range(10):
+            queue.enqueue(f"events/e{index}", index)
+        queue.enqueue("events/bad", 1)
+        for index in range(10, 20):
+            queue.enqueue(f"events/e{index}", index)
+        assert queue.flush(timeout=5.0)
+    finally:
+        queue.close()
+
+    assert len(backend.get("events")) == 20
+    assert list(queue.dead_letters) == [("events/bad", 1)]
+
+
+def test_unavailable_rtdb_is_retried_a_bounded_number_of_times(manager, backend, tmp_path):
+    dead_letter_path = tmp_path / "dead.jsonl"
+    backend.down.add("update")
+    queue = WriteBehindQueue(
+        manager,
+        flush_interval_ms=1,
+        retry_delay_ms=1,
+        max_attempts=3,
+        dead_letter_path=str(dead_letter_path),
+    )
+    try:
+        queue.enqueue("events/a", 1)
+        assert queue.flush(timeout=5.0)
+        assert list(queue.dead_letters) == [("events/a", 1)]
+        assert queue.failures == 3
+        assert dead_letter_path.read_text().count("events/a") == 1
+
+        backend.down.clear()
+        assert queue.requeue_dead_letters() == 1
+        assert queue.flush(timeout=5.0)
+    finally:
+        queue.close()
+
+    assert backend.get("events/a") == 1
+    assert not queue.dead_letters
+
+
+def test_transient_failure_keeps_order_and_recovers(manager, backend):
+    backend.down.add("update")
+    queue = WriteBehindQueue(manager, flush_interval_ms=1, retry_delay_ms=20, max_attempts=10)
+    try:
+        queue.enqueue("events/a", 1)
+        queue.enqueue("events/a", 2)
+        time.sleep(0.05)
+        backend.down.clear()
+        assert queue.flush(timeout=5.0)
+    finally:
+        queue.close()
+
+    assert backend.get("events/a") == 2
+    assert not queue.dead_letters
+
+
+def test_spool_keeps_dead_letters_without_a_dead_letter_file(manager, backend, tmp_path):
+    spool_path = tmp_path / "spool.jsonl"
+    update = backend.update
+
+    def _reject_bad(path, value):
+        if any("bad" in key for key in value):
+            raise ValueError("rejected by rules")
+        update(path, value)
+
+    backend.update = _reject_bad
+    queue = WriteBehindQueue(manager, flush_interval_ms=1, retry_delay_ms=1, spool_path=str(spool_path))
+    try:
+        queue.enqueue("events/bad", 1)
+        assert queue.flush(timeout=5.0)
+        queue.enqueue("events/a", 2)
+        assert queue.flush(timeout=5.0)
+        # a later successful batch must not drop the only copy of the dead letter
+        assert "events/bad" in spool_path.read_text()
+        assert "events/a" not in spool_path.read_text()
+    finally:
+        queue.close()
+
+    assert spool_path.exists()
+    backend.update = update
+    replayed = WriteBehindQueue(manager, flush_interval_ms=1, spool_path=str(spool_path))
+    try:
+        assert replayed.flush(timeout=5.0)
+    finally:
+        replayed.close()
+    assert backend.get("events") == {"a": 2, "bad": 1}
+
+
+def test_unserializable_value_is_rejected_before_it_is_queued(manager, tmp_path):
+    queue = WriteBehindQueue(manager, flush_interval_ms=1, spool_path=str(tmp_path / "spool.jsonl"))
+    try:
+        with pytest.raises(TypeError):
+            queue.enqueue("events/a", object())
+        assert len(queue) == 0
+    finally:
+        queue.close()
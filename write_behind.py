@@ -0,0 +1,327 @@
+"""
+Write-behind queue for fire-and-forget RTDB writes.
+
+History events and ledger entries are never read back on the request path,
+so they can be enqueued and written later. A worker thread coalesces queued
+writes into one multi-path update every flush interval or whenever a batch
+fills up. Pending writes are flushed at interpreter shutdown and can be
+mirrored to a local spool file, which is replayed on start-up so writes
+survive a crash.
+
+A failing batch is retried a bounded number of times. Writes RTDB rejects
+are isolated by splitting the batch until the offending write is alone, so
+one bad write never blocks the writes queued behind it. Writes that cannot
+be committed are moved to a dead-letter list (and file, if configured)
+instead of being retried forever.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, List, Optional, Tuple
+
+from fb_core.resilience import RTDBUnavailableError
+
+if TYPE_CHECKING:
+    from fb_core.real_time_database import FBRTDBMgr
+
+logger = logging.getLogger(__name__)
+
+# what enqueue() does when the queue is full
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_WRITE_THROUGH = "write_through"
+_OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_WRITE_THROUGH)
+
+_open_queues: "weakref.WeakSet[WriteBehindQueue]" = weakref.WeakSet()
+
+
+class WriteBehindQueue:
+    """Bounded queue of (path, value) writes flushed by a background thread."""
+
+    def __init__(
+        self,
+        manager: "FBRTDBMgr",
+        max_batch: int = 500,
+        flush_interval_ms: float = 200.0,
+        max_queue: int = 10_000,
+        overflow: str = OVERFLOW_BLOCK,
+        spool_path: Optional[str] = None,
+        retry_delay_ms: float = 1000.0,
+        max_attempts: int = 5,
+        dead_letter_path: Optional[str] = None,
+    ):
+        """Initialize and start the queue.
+
+        Args:
+            manager: Database manager used to commit the writes
+            max_batch: Maximum writes per multi-path update
+            flush_interval_ms: Maximum time a write waits before being flushed
+            max_queue: Maximum number of pending writes
+            overflow: Policy when full: 'block', 'drop_oldest', 'drop_newest' or 'write_through'
+            spool_path: Optional file mirroring pending writes (replayed on start)
+            retry_delay_ms: Pause before retrying after a failed flush (doubles per attempt)
+            max_attempts: Flushes of a batch while RTDB is unavailable before its
+                writes are dead-lettered
+            dead_letter_path: Optional file receiving writes that were given up on
+        """
+        if overflow not in _OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {overflow!r}")
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.manager = manager
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.spool_path = spool_path
+        self.retry_delay = retry_delay_ms / 1000.0
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self.dropped = 0
+        self.written = 0
+        self.failures = 0
+        self.dead_letters: Deque[Tuple[str, Any]] = deque(maxlen=max_queue)
+        self._pending: Deque[Tuple[str, Any]] = deque()
+        self._in_flight = 0
+        # size of the next batch; shrinks to isolate a rejected write
+        self._batch_limit = max_batch
+        # consecutive failed flushes of the batch at the head of the queue
+        self._attempts = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        self._spool = None
+        if spool_path:
+            self._replay_spool()
+            self._spool = open(spool_path, "a", encoding="utf-8")
+        self._worker = threading.Thread(target=self._run, name="fb_core-write-behind", daemon=True)
+        self._worker.start()
+        _open_queues.add(self)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _replay_spool(self) -> None:
+        if not os.path.exists(self.spool_path):
+            return
+        replayed = 0
+        with open(self.spool_path, "r", encoding="utf-8") as spool:
+            for line in spool:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn last line from a crash
+                    continue
+                self._pending.append((record["path"], record["value"]))
+                replayed += 1
+        if replayed:
+            logger.info("Replayed %d spooled writes from %s", replayed, self.spool_path)
+
+    def enqueue(self, path: str, value: Any, timeout: Optional[float] = None) -> bool:
+        """Queue a write of value at path (set semantics).
+
+        Args:
+            path: The database path
+            value: Data to write
+            timeout: Maximum time to wait for space under the 'block' policy
+
+        Returns:
+            True if the write was queued (or written through), False if dropped
+        """
+        with self._cond:
+            if self._closed:
+                raise ValueError("write-behind queue is closed")
+            write_through = False
+            if len(self._pending) >= self.max_queue:
+                if self.overflow == OVERFLOW_WRITE_THROUGH:
+                    write_through = True
+                elif self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._pending.popleft()
+                    self.dropped += 1
+                elif not self._cond.wait_for(lambda: len(self._pending) < self.max_queue, timeout):
+                    self.dropped += 1
+                    return False
+            if not write_through:
+                if self._spool is not None:
+                    # serialize first: a value that cannot be spooled is rejected, not queued
+                    line = json.dumps({"path": path, "value": value}) + "\n"
+                    self._spool.write(line)
+                    self._spool.flush()
+                self._pending.append((path, value))
+                # wake the worker on the first write (it starts the flush
+                # interval) and when a batch is full
+                if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                    self._cond.notify_all()
+        if write_through:
+            # outside the lock: a synchronous round trip must not stall the worker
+            return self.manager.set_data(path, value)
+        return True
+
+    def _take_batch(self):
+        items = []
+        while self._pending and len(items) < self._batch_limit:
+            items.append(self._pending.popleft())
+        self._in_flight += len(items)
+        self._cond.notify_all()
+        return items
+
+    def _commit(self, items) -> Optional[Exception]:
+        """Write items as one multi-path update; returns the error if it failed."""
+        batch = self.manager.batch()
+        for path, value in items:
+            batch.set(path, value)
+        try:
+            batch.commit(strict=True)
+        except Exception as error:
+            return error
+        return None
+
+    def _finish(self, items, error: Optional[Exception]) -> bool:
+        """Account for a flushed batch.
+
+        Returns:
+            True if the worker should pause before the next flush
+        """
+        with self._cond:
+            self._in_flight -= len(items)
+            retry = False
+            if error is None:
+                self.written += len(items)
+                self._attempts = 0
+                self._batch_limit = min(self.max_batch, self._batch_limit * 2)
+                if not self._pending and not self._in_flight and self._spool is not None:
+                    # everything spooled so far is durable in RTDB or dead-lettered
+                    self._spool.seek(0)
+                    self._spool.truncate()
+                    if self.dead_letters and not self.dead_letter_path:
+                        # the spool is the only copy of given-up writes
+                        for path, value in self.dead_letters:
+                            self._spool.write(json.dumps({"path": path, "value": value}) + "\n")
+                    self._spool.flush()
+            elif not isinstance(error, RTDBUnavailableError):
+                # RTDB rejected the update: split the batch until the bad write is alone
+                self.failures += 1
+                self._attempts = 0
+                if len(items) > 1:
+                    self._batch_limit = max(1, len(items) // 2)
+                    self._pending.extendleft(reversed(items))
+                else:
+                    self._dead_letter(items, error)
+            else:
+                self.failures += 1
+                self._attempts += 1
+                if self._attempts >= self.max_attempts:
+                    self._attempts = 0
+                    self._dead_letter(items, error)
+                else:
+                    # keep order: failed writes go back to the front
+                    self._pending.extendleft(reversed(items))
+                    retry = True
+            self._cond.notify_all()
+            return retry
+
+    def _dead_letter(self, items: List[Tuple[str, Any]], error: Exception) -> None:
+        """Give up on items: keep them in dead_letters (and the dead-letter file)."""
+        self.dead_letters.extend(items)
+        logger.error("Write-behind gave up on %d writes (first %s): %s", len(items), items[0][0], error)
+        if self.dead_letter_path:
+            try:
+                with open(self.dead_letter_path, "a", encoding="utf-8") as dead:
+                    for path, value in items:
+                        dead.write(json.dumps({"path": path, "value": value}) + "\n")
+            except (OSError, TypeError, ValueError) as write_error:
+                logger.warning("Failed to write dead letters to %s: %s", self.dead_letter_path, write_error)
+
+    def requeue_dead_letters(self) -> int:
+        """Queue every dead-lettered write again (e.g. after an outage ended).
+
+        Returns:
+            Number of writes queued
+        """
+        with self._cond:
+            items, self.dead_letters = list(self.dead_letters), deque(maxlen=self.max_queue)
+        for path, value in items:
+            self.enqueue(path, value)
+        return len(items)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                # idle until the first write arrives
+                while not self._pending and not self._closed:
+                    self._flush_requested = False
+                    self._cond.wait()
+                # then give later writes up to flush_interval to join the batch
+                deadline = time.monotonic() + self.flush_interval
+                while not (self._closed or self._flush_requested) and len(self._pending) < self._batch_limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._pending:
+                    return
+                items = self._take_batch()
+            error = self._commit(items)
+            if self._finish(items, error):
+                if self._closed:
+                    logger.warning(
+                        "Write-behind flush failed during shutdown, %d writes left pending", len(self._pending)
+                    )
+                    return
+                time.sleep(self.retry_delay * 2 ** (self._attempts - 1))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every write queued so far has been committed or dead-lettered.
+
+        Args:
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            True if the queue drained, False on timeout
+        """
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout: Optional[float] = 10.0) -> bool:
+        """Flush pending writes and stop the worker.
+
+        Returns:
+            True if the queue drained before the timeout (check dead_letters
+            for writes that were given up on)
+        """
+        with self._cond:
+            if self._closed:
+                return not self._pending
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        drained = not self._pending and not self._in_flight
+        if self._spool is not None:
+            self._spool.close()
+            # without a dead-letter file, the spool is the only copy of given-up writes
+            if drained and (self.dead_letter_path or not self.dead_letters):
+                os.remove(self.spool_path)
+        _open_queues.discard(self)
+        return drained
+
+
+@atexit.register
+def flush_all_queues() -> None:
+    """Flush and close every open write-behind queue (run automatically at exit)."""
+    for queue in list(_open_queues):
+        try:
+            queue.close()
+        except Exception as error:
+            logger.warning("Failed to flush write-behind queue at shutdown: %s", error)